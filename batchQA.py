@@ -0,0 +1,203 @@
+#######################################################
+# Batched question answering over a FAISS vector store
+#######################################################
+
+# For evaluation and FAQ jobs over many questions: each batch is embedded in one
+# call and searched with one matrix FAISS search, every retrieved chunk is read
+# from the docstore once, and answers are generated concurrently on a bounded pool.
+
+import os
+import re
+import time
+import hashlib
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+import numpy as np
+from langchain.schema import Document
+from ingest import Batched
+from hybridRetriever import ReciprocalRankFusion
+from semanticCache import CachedGenerate, GetSemanticCache
+from metrics import Span, EstimateTokens, MetricsCallbackHandler
+from modelRouter import Route
+
+# The prompt RetrievalQA's "stuff" chain uses, so answers match the single-question path
+QA_TEMPLATE = """Use the following pieces of context to answer the question at the end. If you don't know the answer, just say that you don't know, don't try to make up an answer.
+
+{context}
+
+Question: {question}
+Helpful Answer:"""
+
+
+def ContentKey(doc):
+    # Chunks with the same text count once, whichever file or id they came from
+    return hashlib.sha256(re.sub(r"\s+", " ", doc.page_content).strip().encode("utf-8")).hexdigest()
+
+
+def Dedupe(docs):
+    seen, kept = set(), []
+    for doc in docs:
+        key = ContentKey(doc)
+        if key not in seen:
+            seen.add(key)
+            kept.append(doc)
+    return kept
+
+
+class BatchQA:
+    # get_llm(model) returns the LLM for the model the router picks per question.
+    # bm25 and reranker are optional and work as in HybridRetriever; namespace
+    # turns on the semantic cache, reusing each question's batch embedding.
+    def __init__(self, store, get_llm, k=3, fetch_k=20, bm25=None, reranker=None, rrf_k=60,
+                 batch_size=64, max_workers=8, max_in_flight=None, namespace=None, pipeline="vectorStore"):
+        self.store = store
+        self.get_llm = get_llm
+        self.k = k
+        self.fetch_k = fetch_k
+        self.bm25 = bm25
+        self.reranker = reranker
+        self.rrf_k = rrf_k
+        self.batch_size = batch_size
+        self.max_workers = max_workers
+        self.max_in_flight = max_in_flight or max_workers * 4
+        self.namespace = namespace
+        self.pipeline = pipeline
+
+    @classmethod
+    def FromRetriever(cls, retriever, get_llm, **kwargs):
+        # Same store, lexical index and settings as a HybridRetriever
+        settings = dict(k=retriever.k, fetch_k=retriever.fetch_k, bm25=retriever.bm25,
+                        reranker=retriever.reranker, rrf_k=retriever.rrf_k)
+        settings.update(kwargs)
+        return cls(retriever.vectorstore, get_llm, **settings)
+
+    def Embed(self, questions):
+        # One batched call; rows are normalized when the store searches by cosine
+        vectors = np.asarray(self.store.embedding_function.embed_documents(questions), dtype=np.float32)
+        if getattr(self.store, "_normalize_L2", False):
+            norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+            vectors = vectors / np.where(norms == 0, 1, norms)
+        return vectors
+
+    def Search(self, vectors):
+        # One FAISS search for the whole batch; a chunk retrieved for several
+        # questions is read from the docstore once
+        if self.store.index.ntotal == 0:
+            return [[] for _ in vectors]
+        _, rows = self.store.index.search(vectors, min(self.fetch_k, self.store.index.ntotal))
+        docs = {}
+        for row in np.unique(rows):
+            if row < 0:
+                continue
+            doc = self.store.docstore.search(self.store.index_to_docstore_id[int(row)])
+            if isinstance(doc, Document):
+                docs[int(row)] = doc
+        return [[docs[int(row)] for row in result if int(row) in docs] for result in rows]
+
+    def Retrieve(self, questions):
+        # [(docs, vector, timings)] for a batch; embed and search times are for
+        # the whole batch and shared by its questions
+        with Span(self.pipeline, "retrieval", "batch_embed"):
+            started = time.perf_counter()
+            vectors = self.Embed(questions)
+            embed_seconds = time.perf_counter() - started
+        with Span(self.pipeline, "retrieval", "batch_search"):
+            started = time.perf_counter()
+            vector_results = self.Search(vectors)
+            search_seconds = time.perf_counter() - started
+
+        retrieved = []
+        for question, vector, vector_docs in zip(questions, vectors, vector_results):
+            started = time.perf_counter()
+            docs = vector_docs
+            if self.bm25 is not None:
+                docs = ReciprocalRankFusion([vector_docs, self.bm25.search(question, k=self.fetch_k)], k=self.rrf_k)
+            docs = Dedupe(docs)
+            docs = self.reranker.rerank(question, docs) if self.reranker is not None else docs[:self.k]
+            timings = {
+                "batch_size": len(questions),
+                "batch_embed": embed_seconds,
+                "batch_search": search_seconds,
+                "fusion": time.perf_counter() - started,
+            }
+            retrieved.append((docs, vector, timings))
+        return retrieved
+
+    def Generate(self, question, docs):
+        prompt = QA_TEMPLATE.format(context="\n\n".join(doc.page_content for doc in docs), question=question)
+        model, _ = Route(self.pipeline, question, sources=len(docs), context_tokens=EstimateTokens(prompt))
+        return self.get_llm(model).invoke(prompt, config={"callbacks": [MetricsCallbackHandler(self.pipeline)]})
+
+    def Answer(self, index, question, docs, vector, timings, queued):
+        # Runs on the pool; failures are reported in the result instead of
+        # stopping the batch
+        started = time.perf_counter()
+        timings["queue"] = started - queued
+        result = {"index": index, "question": question, "answer": None, "error": None,
+                  "sources": [doc.metadata for doc in docs], "timings": timings}
+        try:
+            if self.namespace is None:
+                result["answer"] = self.Generate(question, docs)
+            else:
+                # The cache only reuses the batch vector if it embeds with the same model
+                same = GetSemanticCache().embeddings is self.store.embedding_function
+                norm = np.linalg.norm(vector)
+                result["answer"] = CachedGenerate(self.namespace, question, lambda: self.Generate(question, docs),
+                                                  vector=vector / norm if same and norm else None)
+        except Exception as e:
+            result["error"] = f"{type(e).__name__}: {e}"
+        timings["generation"] = time.perf_counter() - started
+        return result
+
+    def Run(self, questions, ordered=True):
+        # Yields one result dict per question: in input order, or as each answer
+        # completes with ordered=False. questions can be any iterable; only
+        # max_in_flight answers (running or waiting to be yielded) are held at once.
+        pool = ThreadPoolExecutor(max_workers=self.max_workers)
+        pending, finished = {}, {}
+        next_index = 0
+
+        def Ready():
+            nonlocal next_index
+            if not ordered:
+                results = list(finished.values())
+                finished.clear()
+                return results
+            results = []
+            while next_index in finished:
+                results.append(finished.pop(next_index))
+                next_index += 1
+            return results
+
+        def WaitOne():
+            done, _ = wait(list(pending), return_when=FIRST_COMPLETED)
+            for future in done:
+                finished[pending.pop(future)] = future.result()
+
+        try:
+            index = 0
+            for batch in Batched(questions, self.batch_size):
+                for question, (docs, vector, timings) in zip(batch, self.Retrieve(batch)):
+                    while pending and len(pending) + len(finished) >= self.max_in_flight:
+                        WaitOne()
+                        yield from Ready()
+                    pending[pool.submit(self.Answer, index, question, docs, vector, timings, time.perf_counter())] = index
+                    index += 1
+                yield from Ready()
+            while pending:
+                WaitOne()
+                yield from Ready()
+        finally:
+            pool.shutdown(wait=False, cancel_futures=True)
+
+    def AnswerAll(self, questions, ordered=True):
+        return list(self.Run(questions, ordered))
+
+
+def GetBatchQA(retriever, get_llm, namespace=None):
+    return BatchQA.FromRetriever(
+        retriever,
+        get_llm,
+        batch_size=int(os.getenv("qa_batch_size", "64")),
+        max_workers=int(os.getenv("qa_workers", "8")),
+        namespace=namespace,
+    )
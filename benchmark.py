@@ -0,0 +1,355 @@
+#######################################################
+# Offline benchmark: every script against local fake services
+#######################################################
+
+# Usage: python benchmark.py [--stages chat_retrieval,coder] [--iterations 50]
+#        [--concurrency 8] [--latency llm=0.5] [--error-rate wikipedia=0.1]
+#        [--agent-mode react] [--router-mode large] [--llm-backend local] [--cache] [--output benchmark_results.json]
+
+import os
+import sys
+import json
+import time
+import uuid
+import argparse
+import resource
+import tempfile
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+TOPICS = [
+    "photosynthesis", "the french revolution", "black holes", "metallica",
+    "the water cycle", "prime numbers", "the roman empire", "plate tectonics",
+    "machine learning", "the immune system", "renaissance art", "climate change",
+    "quantum entanglement", "the silk road", "volcanoes", "dna replication",
+    "world war one", "the stock market", "coral reefs", "the printing press",
+]
+
+CODER_INPUTS = [
+    "Write a Python function that adds two numbers",
+    "def add(a, b):\n    return a + c\n\nprint(add(2, 3))",
+]
+
+
+# Questions per call in the vector_batch stage
+BATCH_QUESTIONS = 32
+
+
+def Questions(count):
+    return [f"Tell me about {TOPICS[i % len(TOPICS)]}" + (f" ({i // len(TOPICS)})" if i >= len(TOPICS) else "")
+            for i in range(count)]
+
+
+def Percentile(values, p):
+    if not values:
+        return None
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, max(0, round(p / 100 * (len(ordered) - 1))))
+    return ordered[index]
+
+
+def ResetPeakRSS():
+    # Writing 5 to clear_refs resets VmHWM, so each stage gets its own peak
+    try:
+        with open("/proc/self/clear_refs", "w") as f:
+            f.write("5")
+        return True
+    except OSError:
+        return False
+
+
+def PeakRSS():
+    # Peak resident set size in MB: VmHWM on Linux, ru_maxrss (process
+    # lifetime peak) elsewhere
+    try:
+        with open("/proc/self/status") as f:
+            for line in f:
+                if line.startswith("VmHWM:"):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    maxrss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return maxrss / (1024 * 1024) if sys.platform == "darwin" else maxrss / 1024
+
+
+def ParseOverrides(items, parse=float):
+    # ["llm=0.5", "*=0.1"] -> {"llm": 0.5, "*": 0.1}
+    overrides = {}
+    for item in items or []:
+        service, _, value = item.partition("=")
+        overrides[service.strip()] = parse(value)
+    return overrides
+
+
+def ServiceSettings(overrides):
+    from fakeServices import SERVICES
+    settings = {}
+    if "*" in overrides:
+        settings = dict.fromkeys(SERVICES, overrides["*"])
+    settings.update({k: v for k, v in overrides.items() if k != "*"})
+    return settings
+
+
+def WriteCorpus(directory, documents=40):
+    from fakeServices import FakeParagraph
+    os.makedirs(directory, exist_ok=True)
+    for i in range(documents):
+        topic = TOPICS[i % len(TOPICS)]
+        with open(os.path.join(directory, f"doc_{i:03d}.txt"), "w", encoding="utf-8") as f:
+            f.write("\n\n".join(FakeParagraph(f"{topic} section {j}", 150) for j in range(6)))
+    return directory
+
+
+def TextSplitter():
+    from langchain.text_splitter import RecursiveCharacterTextSplitter
+    return RecursiveCharacterTextSplitter(chunk_size=500, chunk_overlap=0, length_function=len)
+
+
+def Stages(llm, ttft):
+    # name -> (setup, call); setup runs once, untimed, and returns the
+    # function timed per iteration
+    def ChatRetrieval():
+        import chatPipeline
+        return chatPipeline.RetrieveContext
+
+    def ChatGeneration():
+        import chatPipeline
+        contexts = {}
+
+        def Call(question):
+            # Same path as the app: semantic cache, then a streamed answer
+            if question not in contexts:
+                contexts[question] = chatPipeline.RetrieveContext(question)
+            started = time.perf_counter()
+            cached = chatPipeline.LookupResponse(question)
+            if cached is not None:
+                return cached
+            text = ""
+            for token in chatPipeline.SharedStreamResponse(question, *contexts[question]):
+                if not text:
+                    ttft.append(time.perf_counter() - started)
+                text += token
+            chatPipeline.StoreResponse(question, text)
+            return text
+        return Call
+
+    def Agent(module_name):
+        def Setup():
+            module = __import__(module_name)
+            module.GetAgent()
+            return module.Ask
+        return Setup
+
+    def VectorBuild():
+        from clients import GetEmbeddings
+        from ingest import IncrementalIngest
+        corpus = WriteCorpus("corpus")
+        splitter = TextSplitter()
+        # A fresh index every iteration: a full build, not an incremental no-op
+        return lambda question: IncrementalIngest(corpus, f"index_{uuid.uuid4().hex}", GetEmbeddings(), splitter)
+
+    def VectorQuery():
+        from langchain.chains import RetrievalQA
+        from clients import GetEmbeddings
+        from ingest import IncrementalIngest
+        from hybridRetriever import HybridRetriever
+        from semanticCache import CachedGenerate
+        from metrics import MetricsCallbackHandler
+        library, _ = IncrementalIngest(WriteCorpus("corpus"), "index_query", GetEmbeddings(), TextSplitter())
+        retriever = HybridRetriever.FromFaiss(library, k=3)
+        qa = RetrievalQA.from_chain_type(llm=llm, chain_type="stuff", retriever=retriever)
+        return lambda question: CachedGenerate("vectorStore:index_query", question, lambda: qa.invoke(question, config={"callbacks": [MetricsCallbackHandler("vectorStore")]}))
+
+    def VectorBatch():
+        # Each call answers BATCH_QUESTIONS questions through the batch QA API
+        from clients import GetEmbeddings
+        from ingest import IncrementalIngest
+        from hybridRetriever import HybridRetriever
+        from batchQA import BatchQA
+        library, _ = IncrementalIngest(WriteCorpus("corpus"), "index_query", GetEmbeddings(), TextSplitter())
+        qa = BatchQA.FromRetriever(HybridRetriever.FromFaiss(library, k=3), lambda model: llm)
+        questions = Questions(BATCH_QUESTIONS)
+        return lambda question: qa.AnswerAll(questions)
+
+    def Coder():
+        import coder
+
+        def Call(question):
+            agent = coder.AIAgent(api_key="fake", repo_id="mistralai/Mixtral-8x7B-Instruct-v0.1")
+            return agent.run(question)
+        return Call
+
+    def Image():
+        import imageProcessing
+        return imageProcessing.ProcessQuery
+
+    return {
+        "chat_retrieval": ChatRetrieval,
+        "chat_generation": ChatGeneration,
+        "tavily_agent": Agent("tavilyDdg"),
+        "wiki_agent": Agent("wikiDdgAgent"),
+        "vector_build": VectorBuild,
+        "vector_query": VectorQuery,
+        "vector_batch": VectorBatch,
+        "coder": Coder,
+        "image": Image,
+    }
+
+
+def RunStage(setup, inputs, iterations, concurrency):
+    try:
+        call = setup()
+    except Exception as e:
+        return {"error": f"setup failed: {type(e).__name__}: {e}"}
+
+    latencies, errors = [], []
+    lock = threading.Lock()
+
+    def Timed(i):
+        started = time.perf_counter()
+        try:
+            call(inputs[i % len(inputs)])
+            failed = None
+        except Exception as e:
+            failed = f"{type(e).__name__}: {e}"
+        elapsed = time.perf_counter() - started
+        with lock:
+            if failed:
+                errors.append(failed)
+            else:
+                latencies.append(elapsed)
+
+    exact_peak = ResetPeakRSS()
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        list(executor.map(Timed, range(iterations)))
+    wall = time.perf_counter() - started
+
+    return {
+        "iterations": iterations,
+        "concurrency": concurrency,
+        "succeeded": len(latencies),
+        "errors": len(errors),
+        "error_samples": sorted(set(errors))[:5],
+        "wall_seconds": wall,
+        "throughput_per_second": len(latencies) / wall if wall else None,
+        "latency_ms": {
+            "p50": Millis(Percentile(latencies, 50)),
+            "p95": Millis(Percentile(latencies, 95)),
+            "p99": Millis(Percentile(latencies, 99)),
+            "mean": Millis(sum(latencies) / len(latencies)) if latencies else None,
+            "max": Millis(max(latencies)) if latencies else None,
+        },
+        "peak_rss_mb": PeakRSS(),
+        "peak_rss_is_per_stage": exact_peak,
+    }
+
+
+def Millis(seconds):
+    return None if seconds is None else seconds * 1000
+
+
+def CacheStats():
+    from searchCache import GetSearchCache
+    from semanticCache import GetSemanticCache
+    return {"search": GetSearchCache().Stats(), "semantic": GetSemanticCache().Stats()}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the scripts against local fake services")
+    parser.add_argument("--stages", default="all", help="comma-separated stage names, or all")
+    parser.add_argument("--iterations", type=int, default=20)
+    parser.add_argument("--concurrency", type=int, default=4)
+    parser.add_argument("--queries", type=int, default=10, help="distinct questions, reused round-robin")
+    parser.add_argument("--latency", action="append", metavar="SERVICE=SECONDS",
+                        help="per-request latency of a fake service; * sets every service")
+    parser.add_argument("--error-rate", action="append", metavar="SERVICE=RATE",
+                        help="share of requests a fake service answers with 503; * sets every service")
+    parser.add_argument("--token-latency", type=float, default=0.01, help="seconds per streamed LLM token")
+    parser.add_argument("--agent-mode", choices=["fanout", "react"], default=None,
+                        help="agent_mode for the tavily and wiki agents (default: the environment's)")
+    parser.add_argument("--router-mode", choices=["cascade", "small", "large"], default=None,
+                        help="router_mode for model selection (default: the environment's)")
+    parser.add_argument("--llm-backend", choices=["hf", "local"], default=None,
+                        help="llm_backend; local runs localLLM.py against a fake llama.cpp server")
+    parser.add_argument("--cache", action="store_true", help="keep the search and semantic caches enabled")
+    parser.add_argument("--workdir", default=None, help="scratch directory (default: a new temp dir)")
+    parser.add_argument("--output", default="benchmark_results.json")
+    args = parser.parse_args()
+
+    output = os.path.abspath(args.output)
+    workdir = os.path.abspath(args.workdir or tempfile.mkdtemp(prefix="benchmark_"))
+    os.makedirs(workdir, exist_ok=True)
+    os.chdir(workdir)
+
+    # Must be set before the modules read them
+    os.environ["HF_HUB_OFFLINE"] = "1"
+    os.environ["TRANSFORMERS_OFFLINE"] = "1"
+    os.environ["image_store_path"] = os.path.join(workdir, "images", "store")
+    if args.agent_mode:
+        os.environ["agent_mode"] = args.agent_mode
+    if args.router_mode:
+        os.environ["router_mode"] = args.router_mode
+    if args.llm_backend:
+        os.environ["llm_backend"] = args.llm_backend
+    if not args.cache:
+        os.environ["search_cache_size"] = "0"
+        os.environ["semantic_cache_threshold"] = "2"
+
+    from fakeServices import FakeServer, InstallFakes
+    from clients import Timings
+    from metrics import GetRegistry
+
+    server = FakeServer(
+        latency=ServiceSettings(ParseOverrides(args.latency)),
+        error_rate=ServiceSettings(ParseOverrides(args.error_rate)),
+        token_latency=args.token_latency,
+    ).start()
+    llm = InstallFakes(server.url)
+
+    ttft = []
+    stages = Stages(llm, ttft)
+    names = list(stages) if args.stages == "all" else [name.strip() for name in args.stages.split(",")]
+    questions = Questions(args.queries)
+
+    results = {}
+    for name in names:
+        if name not in stages:
+            parser.error(f"unknown stage {name}; choose from {', '.join(stages)}")
+        inputs = CODER_INPUTS if name == "coder" else questions
+        print(f"Running {name}...", flush=True)
+        results[name] = RunStage(stages[name], inputs, args.iterations, args.concurrency)
+        if name == "chat_generation" and "error" not in results[name]:
+            results[name]["time_to_first_token_ms"] = {
+                "p50": Millis(Percentile(ttft, 50)),
+                "p95": Millis(Percentile(ttft, 95)),
+                "p99": Millis(Percentile(ttft, 99)),
+            }
+
+    report = {
+        "config": dict(vars(args), workdir=workdir, latency=server.latency, error_rate=server.error_rate),
+        "stages": results,
+        "services": server.stats,
+        "caches": CacheStats(),
+        "client_timings_ms": {name: seconds * 1000 for name, seconds in Timings().items()},
+        "metrics": GetRegistry().Snapshot(),
+    }
+    server.stop()
+
+    with open(output, "w", encoding="utf-8") as f:
+        json.dump(report, f, indent=2)
+
+    print(f"\n{'stage':<16} {'ok':>5} {'err':>5} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9} {'req/s':>8} {'rss MB':>8}")
+    for name, stage in results.items():
+        if "error" in stage:
+            print(f"{name:<16} {stage['error']}")
+            continue
+        latency = stage["latency_ms"]
+        cells = [latency["p50"], latency["p95"], latency["p99"], stage["throughput_per_second"]]
+        cells = ["-" if value is None else f"{value:.1f}" for value in cells]
+        print(f"{name:<16} {stage['succeeded']:>5} {stage['errors']:>5} {cells[0]:>9} {cells[1]:>9} {cells[2]:>9} {cells[3]:>8} {stage['peak_rss_mb']:>8.1f}")
+    print(f"\nResults written to {output}")
+
+
+if __name__ == "__main__":
+    main()
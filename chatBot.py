@@ -3,67 +3,103 @@
 #######################################################
 
 import os
+import time
+import contextlib
+from concurrent.futures import ThreadPoolExecutor
 from dotenv import load_dotenv
 import streamlit as st
-from huggingface_hub import InferenceClient
-from duckduckgo_search import DDGS
-from langchain_community.retrievers import WikipediaRetriever
 from typing import Any
-
-retriver = WikipediaRetriever()
+from semanticCache import ReplayTokens
+from clients import GetInferenceClient, GetWikipediaRetriever
+from chatPipeline import (
+    DefaultContextBuilder,
+    RetrieveContext,
+    SharedStreamResponse,
+    LookupResponse,
+    StoreResponse,
+)
 
 load_dotenv()
-api_key = os.getenv("huggingfacehub_api_token")
+
+# Streaming redraw batching and chat history limits
+REDRAW_INTERVAL = float(os.getenv("stream_redraw_interval", "0.1"))
+REDRAW_CHARS = int(os.getenv("stream_redraw_chars", "200"))
+HISTORY_WINDOW = int(os.getenv("history_window", "20"))
+HISTORY_LIMIT = int(os.getenv("history_limit", "200"))
 
 
 class StreamlitCallbackHandler:
+    # Tokens are buffered and the container is redrawn at most every
+    # REDRAW_INTERVAL seconds or REDRAW_CHARS characters, instead of after
+    # every token; call flush() once the stream ends
     def __init__(self, container):
         self.container = container
         self.text = ""
+        self.pending = 0
+        self.last_redraw = time.monotonic()
 
     def __call__(self, token: str, **kwargs: Any) -> None:
         self.text += token
+        self.pending += len(token)
+        now = time.monotonic()
+        if self.pending >= REDRAW_CHARS or now - self.last_redraw >= REDRAW_INTERVAL:
+            self.container.markdown(self.text)
+            self.pending = 0
+            self.last_redraw = now
+
+    def flush(self) -> None:
         self.container.markdown(self.text)
+        self.pending = 0
 
-client = InferenceClient(model="mistralai/Mixtral-8x7B-Instruct-v0.1", token=api_key)
-
-def SearchWikipedia(query):
-    try:
-        return retriver.invoke(query)
-    except:
-        return "No relevant information found on Wikipedia."
+# Clients and the retrieval pool are held with st.cache_resource, so reruns
+# reuse them instead of building new ones
+@st.cache_resource
+def WikipediaRetrieverResource():
+    return GetWikipediaRetriever()
 
-def SearchDuckDuckGo(query, num_results=3):
-    with DDGS() as ddgs:
-        results = [r for r in ddgs.text(query, max_results=num_results)]
-    return "\n".join([f"Title: {r['title']}\nSnippet: {r['body']}" for r in results])
+@st.cache_resource
+def InferenceClientResource(model_id):
+    return GetInferenceClient(model_id)
 
-def GenerateResponse(prompt, wiki_info, ddg_info, stream_container):
-    combined_input = f"""Based on the following information:
+@st.cache_resource
+def ContextBuilderResource():
+    return DefaultContextBuilder()
 
-Wikipedia: '{wiki_info}'
+@st.cache_resource
+def RetrievalPool():
+    return ThreadPoolExecutor(max_workers=int(os.getenv("retrieval_workers", "8")))
 
-DuckDuckGo Search Results:
-{ddg_info}
-
-User question: {prompt}
-
-Provide a comprehensive and accurate answer, combining the above information with your own knowledge:"""
-    
+def GenerateResponse(prompt, wiki_info, ddg_info, stream_container, messages=()):
     stream_handler = StreamlitCallbackHandler(stream_container)
     
-    for token in client.text_generation(combined_input, max_new_tokens=300, temperature=0.7, stream=True):
-        stream_handler(token)
+    tokens = SharedStreamResponse(prompt, wiki_info, ddg_info, messages,
+                                  get_client=InferenceClientResource, builder=ContextBuilderResource())
+    with contextlib.closing(tokens):
+        for token in tokens:
+            stream_handler(token)
+    stream_handler.flush()
     
     return stream_handler.text
 
+def ReplayResponse(response, stream_container):
+    # A near-duplicate question was already answered; stream the cached answer
+    stream_handler = StreamlitCallbackHandler(stream_container)
+    for token in ReplayTokens(response):
+        stream_handler(token)
+    stream_handler.flush()
+    return stream_handler.text
+
 st.title("AI Tutor with Wikipedia and DuckDuckGo Integration")
 st.write("Hi! I'm here to help you with your homework. I'll search Wikipedia and the internet, then combine that with my knowledge to provide accurate information. Feel free to ask anything, but remember not to copy and paste!")
 
 if "messages" not in st.session_state:
     st.session_state.messages = []
 
-for message in st.session_state.messages:
+# Only the most recent turns are re-rendered on each rerun
+hidden = len(st.session_state.messages) - HISTORY_WINDOW
+if hidden > 0:
+    st.caption(f"{hidden} earlier messages hidden")
+for message in st.session_state.messages[-HISTORY_WINDOW:]:
     with st.chat_message(message["role"]):
         st.markdown(message["content"])
 
@@ -73,11 +109,18 @@ if prompt := st.chat_input("What would you like to know?"):
         st.markdown(prompt)
 
     with st.chat_message("assistant"):
-        with st.spinner("Searching Wikipedia and DuckDuckGo..."):
-            wiki_info = SearchWikipedia(prompt)
-            ddg_info = SearchDuckDuckGo(prompt)
-        
-        stream_container = st.empty()
-        response = GenerateResponse(prompt, wiki_info, ddg_info, stream_container)
+        history = st.session_state.messages[:-1]
+        cached_response = LookupResponse(prompt, history)
+        if cached_response is not None:
+            stream_container = st.empty()
+            response = ReplayResponse(cached_response, stream_container)
+        else:
+            with st.spinner("Searching Wikipedia and DuckDuckGo..."):
+                wiki_info, ddg_info = RetrieveContext(prompt, RetrievalPool(), WikipediaRetrieverResource())
+
+            stream_container = st.empty()
+            response = GenerateResponse(prompt, wiki_info, ddg_info, stream_container, history)
+            StoreResponse(prompt, response, history)
         
     st.session_state.messages.append({"role": "assistant", "content": response})
+    del st.session_state.messages[:-HISTORY_LIMIT]
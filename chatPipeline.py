@@ -0,0 +1,151 @@
+#######################################################
+# Chat pipeline = Wikipedia + DuckDuckGo + streaming generation
+# (shared by the Streamlit app and other front ends)
+#######################################################
+
+import os
+import json
+import time
+import hashlib
+from concurrent.futures import ThreadPoolExecutor
+from dotenv import load_dotenv
+from duckduckgo_search import DDGS
+from searchCache import CachedSearch, NormalizeQuery
+from semanticCache import GetSemanticCache
+from clients import Lazy, GetInferenceClient, GetWikipediaRetriever
+from contextBuilder import ContextBuilder
+from metrics import Traced, AddTokens, CountCache
+from singleFlight import GetStreamGroup
+from resilience import Resilient, GetBackend
+from modelRouter import Route, LARGE_MODEL
+
+load_dotenv()
+
+# Tokenizer for the context budget and semantic cache namespace; the model
+# that answers is picked per request by modelRouter.py
+MODEL_ID = LARGE_MODEL
+
+# Per-source deadlines (seconds) for the retrieval stage
+WIKI_TIMEOUT = float(os.getenv("wiki_timeout", "4"))
+DDG_TIMEOUT = float(os.getenv("ddg_timeout", "4"))
+
+WIKI_FALLBACK = "No relevant information found on Wikipedia."
+DDG_FALLBACK = "No relevant information found on DuckDuckGo."
+
+
+def DefaultContextBuilder():
+    return ContextBuilder(
+        MODEL_ID,
+        budget=int(os.getenv("context_budget", "2048")),
+        history_budget=int(os.getenv("history_budget", "400")),
+    )
+
+
+def RetrievalPool():
+    return Lazy("retrieval_pool", lambda: ThreadPoolExecutor(max_workers=int(os.getenv("retrieval_workers", "8"))))
+
+
+@Traced("chatBot", "retriever", "wikipedia")
+def SearchWikipedia(query, retriever=None):
+    try:
+        retriever = retriever or GetWikipediaRetriever()
+        return CachedSearch("wikipedia_docs", query, lambda q: Resilient("wiki", retriever.invoke, q))
+    except Exception:
+        return WIKI_FALLBACK
+
+def DuckDuckGoSnippets(query, num_results=3):
+    with DDGS(timeout=int(DDG_TIMEOUT) or 1) as ddgs:
+        results = [r for r in ddgs.text(query, max_results=num_results)]
+    return [{"title": r["title"], "body": r["body"]} for r in results]
+
+@Traced("chatBot", "tool", "duckduckgo")
+def SearchDuckDuckGo(query, num_results=3):
+    try:
+        results = CachedSearch(f"ddg_snippets:{num_results}", query,
+                               lambda q: Resilient("ddg", DuckDuckGoSnippets, q, num_results))
+    except Exception:
+        return DDG_FALLBACK
+    if not results:
+        return DDG_FALLBACK
+    return "\n".join([f"Title: {r['title']}\nSnippet: {r['body']}" for r in results])
+
+@Traced("chatBot", "retrieval", "context")
+def RetrieveContext(query, executor=None, wiki_retriever=None):
+    # Send the Wikipedia and DuckDuckGo lookups at once. Each source has its own
+    # deadline; a source that fails or misses it is replaced by its fallback text
+    # so generation can start as soon as both results are in or timed out.
+    sources = [
+        (lambda q: SearchWikipedia(q, wiki_retriever), WIKI_TIMEOUT, WIKI_FALLBACK),
+        (SearchDuckDuckGo, DDG_TIMEOUT, DDG_FALLBACK),
+    ]
+    executor = executor or RetrievalPool()
+    started = time.monotonic()
+    futures = [executor.submit(search, query) for search, _, _ in sources]
+
+    results = []
+    for future, (_, timeout, fallback) in zip(futures, sources):
+        remaining = max(0.0, started + timeout - time.monotonic())
+        try:
+            results.append(future.result(timeout=remaining))
+        except Exception:
+            # Don't block on a straggler; it finishes in the background and is discarded
+            future.cancel()
+            results.append(fallback)
+
+    return tuple(results)
+
+@Traced("chatBot", "llm", "generate")
+def StreamResponse(prompt, wiki_info, ddg_info, messages=(), get_client=None, builder=None):
+    # Yields generated tokens. The prompt holds ranked, deduplicated passages
+    # and a rolling summary of earlier turns, trimmed to a fixed token budget.
+    # The router picks the model before the first token, since a streamed
+    # answer cannot be retried on a larger model.
+    builder = builder or Lazy("context_builder", DefaultContextBuilder)
+    combined_input = builder.Build(prompt, wiki_info, ddg_info, messages)
+    tokens_in = builder.CountTokens(combined_input)
+    AddTokens("chatBot", "llm", "generate", tokens_in=tokens_in)
+    sources = sum(1 for info in (wiki_info, ddg_info) if info not in (WIKI_FALLBACK, DDG_FALLBACK))
+    model, _ = Route("chatBot", prompt, sources=sources, context_tokens=tokens_in)
+    client = (get_client or GetInferenceClient)(model)
+    # Failures count towards the LLM circuit breaker; while it is open,
+    # requests fail fast instead of waiting on the endpoint
+    with GetBackend("llm").Guard():
+        for token in client.text_generation(combined_input, max_new_tokens=300, temperature=0.7, stream=True):
+            yield token
+
+def HistoryDigest(messages):
+    # Stable digest of the earlier turns a prompt is built from
+    turns = [(message.get("role"), message.get("content")) for message in messages or ()]
+    return hashlib.sha256(json.dumps(turns).encode("utf-8")).hexdigest()
+
+def SharedStreamResponse(prompt, wiki_info, ddg_info, messages=(), get_client=None, builder=None):
+    # StreamResponse shared between concurrent sessions asking the same
+    # question with the same conversation history: one generation whose
+    # tokens go to every subscriber. The history is part of the key, so a
+    # follow-up like "explain more" is never answered from another session's
+    # turns. Close the iterator to leave; generation stops when the last
+    # subscriber has left.
+    return GetStreamGroup("chatBot").Subscribe(
+        f"{NormalizeQuery(prompt)}:{HistoryDigest(messages)}",
+        lambda: StreamResponse(prompt, wiki_info, ddg_info, messages, get_client, builder),
+    )
+
+# The semantic cache is keyed on the question alone, so it only serves the
+# first turn of a conversation; follow-ups depend on the earlier turns
+def LookupResponse(prompt, messages=()):
+    if messages:
+        return None
+    try:
+        cached = GetSemanticCache().lookup(prompt, namespace=f"chatBot:{MODEL_ID}")
+    except Exception:
+        return None
+    CountCache("semantic", f"chatBot:{MODEL_ID}", cached is not None)
+    return cached
+
+def StoreResponse(prompt, response, messages=()):
+    if messages:
+        return
+    try:
+        GetSemanticCache().update(prompt, response, namespace=f"chatBot:{MODEL_ID}")
+    except Exception:
+        pass
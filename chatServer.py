@@ -0,0 +1,266 @@
+#######################################################
+# Async HTTP service = chat pipeline + agents over SSE
+#######################################################
+
+# Usage: python chatServer.py
+#   curl -N -X POST localhost:8000/chat -d '{"question": "What is photosynthesis?"}'
+#   curl -N -X POST localhost:8000/agents/wikiDdgAgent -d '{"question": "Who was Ada Lovelace?"}'
+
+import os
+import json
+import time
+import asyncio
+import threading
+import contextlib
+from aiohttp import web
+from dotenv import load_dotenv
+from semanticCache import ReplayTokens
+from clients import ImportModule
+from metrics import GetRegistry
+from chatPipeline import RetrieveContext, SharedStreamResponse, LookupResponse, StoreResponse
+
+load_dotenv()
+
+AGENTS = {"tavilyDdg", "wikiDdgAgent"}
+
+
+class Overloaded(Exception):
+    pass
+
+
+class Cancelled(Exception):
+    pass
+
+
+class GenerationLimiter:
+    # At most `concurrency` requests generate at once and up to `max_queue`
+    # more wait for a slot; beyond that, or after waiting `queue_timeout`
+    # seconds, the request is rejected with a 429
+    def __init__(self, concurrency=4, max_queue=16, queue_timeout=30.0):
+        self.concurrency = concurrency
+        self.max_queue = max_queue
+        self.queue_timeout = queue_timeout
+        self.semaphore = asyncio.Semaphore(concurrency)
+        self.running = 0
+        self.waiting = 0
+        self.rejected = 0
+
+    @contextlib.asynccontextmanager
+    async def slot(self):
+        if self.semaphore.locked() and self.waiting >= self.max_queue:
+            self.Reject()
+            raise Overloaded(f"{self.running} generations running and {self.waiting} queued")
+        self.waiting += 1
+        try:
+            await asyncio.wait_for(self.semaphore.acquire(), self.queue_timeout)
+        except asyncio.TimeoutError:
+            self.Reject()
+            raise Overloaded(f"no generation slot within {self.queue_timeout:.0f}s")
+        finally:
+            self.waiting -= 1
+        self.running += 1
+        try:
+            yield
+        finally:
+            self.running -= 1
+            self.semaphore.release()
+
+    def Reject(self):
+        self.rejected += 1
+        GetRegistry().Inc("server_rejected_total", {})
+
+    def Stats(self):
+        return {
+            "running": self.running,
+            "waiting": self.waiting,
+            "rejected": self.rejected,
+            "max_generations": self.concurrency,
+            "max_queue": self.max_queue,
+        }
+
+
+async def StreamFromThread(work):
+    # work(emit) runs on a worker thread. Tokens it passes to emit() are
+    # yielded as ("token", token) as they arrive, then ("done", return value).
+    # If the consumer goes away, the next emit() raises and the work unwinds.
+    loop = asyncio.get_running_loop()
+    queue = asyncio.Queue()
+    stopped = threading.Event()
+
+    def Put(item):
+        try:
+            loop.call_soon_threadsafe(queue.put_nowait, item)
+        except RuntimeError:
+            stopped.set()
+
+    def Emit(token):
+        if stopped.is_set():
+            raise Cancelled()
+        Put(("token", token))
+
+    def Run():
+        try:
+            Put(("done", work(Emit)))
+        except Cancelled:
+            pass
+        except Exception as e:
+            Put(("error", e))
+
+    loop.run_in_executor(None, Run)
+    try:
+        while True:
+            kind, value = await queue.get()
+            if kind == "error":
+                raise value
+            yield kind, value
+            if kind == "done":
+                return
+    finally:
+        stopped.set()
+
+
+async def Send(response, event, data):
+    await response.write(f"event: {event}\ndata: {json.dumps(data)}\n\n".encode())
+
+
+async def OpenStream(request):
+    response = web.StreamResponse(headers={
+        "Content-Type": "text/event-stream",
+        "Cache-Control": "no-cache",
+        "X-Accel-Buffering": "no",
+    })
+    await response.prepare(request)
+    return response
+
+
+def TooManyRequests(error, limiter):
+    return web.json_response(
+        {"error": f"server busy: {error}", **limiter.Stats()},
+        status=429,
+        headers={"Retry-After": os.getenv("server_retry_after", "5")},
+    )
+
+
+async def ReadQuestion(request):
+    try:
+        body = await request.json()
+    except Exception:
+        raise web.HTTPBadRequest(text="expected a JSON body")
+    question = str(body.get("question", "")).strip()
+    if not question:
+        raise web.HTTPBadRequest(text="question is required")
+    return question, body
+
+
+async def StreamAnswer(request, work, timings):
+    # Streams tokens from work(emit) as server-sent events, then a done event
+    # with the full answer and timings (or an error event). Returns the
+    # response and the answer; the answer is None on errors and disconnects.
+    response = await OpenStream(request)
+    started = time.perf_counter()
+    answer = None
+    try:
+        async for kind, value in StreamFromThread(work):
+            if kind == "token":
+                if "first_token" not in timings:
+                    timings["first_token"] = time.perf_counter() - started
+                await Send(response, "token", {"text": value})
+            else:
+                answer = value
+        timings["generation"] = time.perf_counter() - started
+        await Send(response, "done", {"answer": answer, "timings": timings})
+    except ConnectionResetError:
+        return response, None
+    except Exception as e:
+        await Send(response, "error", {"error": f"{type(e).__name__}: {e}"})
+        answer = None
+    await response.write_eof()
+    return response, answer
+
+
+async def Chat(request):
+    # Body: {"question": ..., "messages": [{"role": ..., "content": ...}]}
+    question, body = await ReadQuestion(request)
+    messages = body.get("messages") or []
+    limiter = request.app["limiter"]
+
+    cached = await asyncio.to_thread(LookupResponse, question, messages)
+    if cached is not None:
+        # Cache hits replay without taking a generation slot
+        def Replay(emit):
+            for token in ReplayTokens(cached):
+                emit(token)
+            return cached
+        response, _ = await StreamAnswer(request, Replay, {"cached": True})
+        return response
+
+    try:
+        async with limiter.slot():
+            started = time.perf_counter()
+            wiki_info, ddg_info = await asyncio.to_thread(RetrieveContext, question)
+            timings = {"retrieval": time.perf_counter() - started}
+
+            def Work(emit):
+                # Concurrent identical questions share one generation
+                text = ""
+                with contextlib.closing(SharedStreamResponse(question, wiki_info, ddg_info, messages)) as tokens:
+                    for token in tokens:
+                        emit(token)
+                        text += token
+                return text
+
+            response, answer = await StreamAnswer(request, Work, timings)
+    except Overloaded as e:
+        return TooManyRequests(e, limiter)
+    if answer is not None:
+        await asyncio.to_thread(StoreResponse, question, answer, messages)
+    return response
+
+
+async def Agent(request):
+    name = request.match_info["name"]
+    if name not in AGENTS:
+        raise web.HTTPNotFound(text=f"unknown agent {name}; choose from {', '.join(sorted(AGENTS))}")
+    question, _ = await ReadQuestion(request)
+    module = await asyncio.to_thread(ImportModule, name)
+    limiter = request.app["limiter"]
+    try:
+        async with limiter.slot():
+            response, _ = await StreamAnswer(request, lambda emit: module.Ask(question, on_token=emit), {})
+    except Overloaded as e:
+        return TooManyRequests(e, limiter)
+    return response
+
+
+async def Health(request):
+    return web.json_response({"status": "ok", **request.app["limiter"].Stats()})
+
+
+async def Metrics(request):
+    return web.Response(text=GetRegistry().Prometheus(), content_type="text/plain")
+
+
+async def Startup(app):
+    app["limiter"] = GenerationLimiter(
+        concurrency=int(os.getenv("server_max_generations", "4")),
+        max_queue=int(os.getenv("server_max_queue", "16")),
+        queue_timeout=float(os.getenv("server_queue_timeout", "30")),
+    )
+
+
+def CreateApp():
+    app = web.Application()
+    app.on_startup.append(Startup)
+    app.router.add_post("/chat", Chat)
+    app.router.add_post("/agents/{name}", Agent)
+    app.router.add_get("/health", Health)
+    app.router.add_get("/metrics", Metrics)
+    return app
+
+
+if __name__ == "__main__":
+    web.run_app(
+        CreateApp(),
+        host=os.getenv("server_host", "127.0.0.1"),
+        port=int(os.getenv("server_port", "8000")),
+    )
@@ -0,0 +1,158 @@
+#######################################################
+# Shared, lazily-initialized client registry
+#######################################################
+
+import os
+import time
+import importlib
+import threading
+from dotenv import load_dotenv
+
+load_dotenv()
+
+_clients = {}
+_timings = {}
+_building = {}
+_lock = threading.RLock()
+
+
+def ImportModule(name):
+    # importlib.import_module with the first (cold) import timed. The import
+    # runs outside _lock (importlib has per-module locks), so a slow first
+    # import does not hold up clients that need other modules.
+    key = f"import:{name}"
+    if key in _timings:
+        return importlib.import_module(name)
+    started = time.perf_counter()
+    module = importlib.import_module(name)
+    seconds = time.perf_counter() - started
+    with _lock:
+        _timings.setdefault(key, seconds)
+    return module
+
+
+def Lazy(name, factory):
+    # Build a client on first use and reuse it for the rest of the process.
+    # Each name has its own lock, so a slow build (e.g. loading a local model)
+    # only blocks callers waiting for that same client.
+    client = _clients.get(name)
+    if client is not None:
+        return client
+    with _lock:
+        if name in _clients:
+            return _clients[name]
+        building = _building.setdefault(name, threading.RLock())
+    with building:
+        if name not in _clients:
+            started = time.perf_counter()
+            client = factory()
+            with _lock:
+                _clients[name] = client
+                _timings[f"init:{name}"] = time.perf_counter() - started
+                _building.pop(name, None)
+        return _clients[name]
+
+
+def Register(name, client):
+    # Put a ready-made client in the registry, e.g. a local stand-in used by
+    # the benchmark; later Get* calls for the same name return it
+    with _lock:
+        _clients[name] = client
+
+
+def Timings():
+    with _lock:
+        return dict(_timings)
+
+
+def ReportTimings():
+    lines = [f"{name:<60} {seconds * 1000:8.1f} ms" for name, seconds in sorted(Timings().items())]
+    return "\n".join(lines)
+
+
+def GetHttpSession():
+    # One pooled requests.Session shared by the HTTP clients in this process
+    def Build():
+        requests = ImportModule("requests")
+        adapters = ImportModule("requests.adapters")
+        session = requests.Session()
+        adapter = adapters.HTTPAdapter(pool_connections=16, pool_maxsize=int(os.getenv("http_pool_size", "32")))
+        session.mount("https://", adapter)
+        session.mount("http://", adapter)
+        return session
+    return Lazy("http_session", Build)
+
+
+def ShareHttpSession():
+    # Point huggingface_hub (HuggingFaceEndpoint, InferenceClient) at the shared
+    # session. Only huggingface_hub < 1.0 has configure_http_backend; newer
+    # releases use httpx and keep their own pool.
+    def Configure():
+        try:
+            hub = ImportModule("huggingface_hub")
+        except ImportError:
+            return False
+        if not hasattr(hub, "configure_http_backend"):
+            return False
+        hub.configure_http_backend(backend_factory=GetHttpSession)
+        return True
+    return Lazy("huggingface_hub_http", Configure)
+
+
+def GetLLM(api_key_env="huggingfacehub_api_token", **kwargs):
+    # HuggingFaceEndpoint keyed by its settings, e.g. repo_id and temperature;
+    # with llm_backend=local, a llama.cpp model on this machine (localLLM.py)
+    if os.getenv("llm_backend", "hf").lower() == "local":
+        return Lazy(f"local_llm:{sorted(kwargs.items())}", lambda: ImportModule("localLLM").LocalLLM(**kwargs))
+
+    def Build():
+        api_key = os.getenv(api_key_env)
+        if not api_key:
+            raise ValueError(f"{api_key_env} not found in environment variables")
+        ShareHttpSession()
+        HuggingFaceEndpoint = ImportModule("langchain.llms").HuggingFaceEndpoint
+        return HuggingFaceEndpoint(huggingfacehub_api_token=api_key, **kwargs)
+    return Lazy(f"llm:{api_key_env}:{sorted(kwargs.items())}", Build)
+
+
+def GetInferenceClient(model, api_key_env="huggingfacehub_api_token"):
+    if os.getenv("llm_backend", "hf").lower() == "local":
+        return Lazy(f"local_inference_client:{model}", lambda: ImportModule("localLLM").LocalInferenceClient(model))
+
+    def Build():
+        ShareHttpSession()
+        InferenceClient = ImportModule("huggingface_hub").InferenceClient
+        return InferenceClient(model=model, token=os.getenv(api_key_env), timeout=float(os.getenv("llm_timeout", "60")))
+    return Lazy(f"inference_client:{model}", Build)
+
+
+def GetWikipediaRetriever():
+    return Lazy("wikipedia_retriever", lambda: ImportModule("langchain_community.retrievers").WikipediaRetriever())
+
+
+def GetWikipediaWrapper():
+    return Lazy("wikipedia_wrapper", lambda: ImportModule("langchain.utilities").WikipediaAPIWrapper())
+
+
+def GetDuckDuckGoSearch():
+    return Lazy("duckduckgo_search", lambda: ImportModule("langchain.tools").DuckDuckGoSearchRun())
+
+
+def GetTavilyRetriever(k=3):
+    def Build():
+        TavilySearchAPIRetriever = ImportModule("langchain_community.retrievers").TavilySearchAPIRetriever
+        return TavilySearchAPIRetriever(api_key=os.getenv("TAVILY_API_KEY"), k=k)
+    return Lazy(f"tavily_retriever:{k}", Build)
+
+
+def GetEmbeddings():
+    return Lazy("embeddings", lambda: ImportModule("embeddingClient").DefaultEmbeddings())
+
+
+def GetGemini(model_name="gemini-pro-vision"):
+    # genai.configure runs once, on the first caption request
+    def Configure():
+        genai = ImportModule("google.generativeai")
+        genai.configure(api_key=os.getenv("Gemini_api_key"))
+        return genai
+    return Lazy(f"gemini:{model_name}", lambda: Lazy("gemini_config", Configure).GenerativeModel(model_name))
@@ -3,25 +3,110 @@
 #######################################################
 import os
 import re
+import time
+import hashlib
 from dotenv import load_dotenv
 from langchain.llms import HuggingFaceEndpoint
 from langchain.prompts import PromptTemplate
 from langchain.chains import LLMChain
 import unittest
+from semanticCache import CachedGenerate
+from sandbox import GetSandbox
+from metrics import Traced, MetricsCallbackHandler
+from modelRouter import Route, Cascade, SmallModel
+from localLLM import LlmBackend
+from clients import GetLLM, ShareHttpSession
 
 class AIAgent:
-    def __init__(self, api_key: str, repo_id: str, temperature: float = 0.8, max_length: int = 150):
-        # Initialize the HuggingFace LLM endpoint
-        self.llm = HuggingFaceEndpoint(
-            huggingfacehub_api_token=api_key,
+    def __init__(
+        self,
+        api_key: str,
+        repo_id: str,
+        temperature: float = 0.8,
+        max_length: int = 150,
+        max_iterations: int = 5,
+        max_seconds: float = 120.0,
+        max_tokens: int = 8000,
+        small_repo_id: str = None,
+    ):
+        # Budget for the repair loop in run(): attempts, wall-clock seconds and
+        # estimated LLM tokens (prompt + completion)
+        self.max_iterations = max_iterations
+        self.max_seconds = max_seconds
+        self.max_tokens = max_tokens
+        self.tokens_used = 0
+        self.iterations = []
+        # Initialize the HuggingFace LLM endpoint. repo_id is the large model;
+        # generation and explanations try small_repo_id first (modelRouter.py)
+        self.repo_id = repo_id
+        self.small_repo_id = small_repo_id or SmallModel()
+        self.api_key = api_key
+        self.temperature = temperature
+        self.max_length = max_length
+        self.last_result = None
+        self.last_code = ""
+        # LLM calls report timings and token counts to the metrics registry
+        self.callbacks = [MetricsCallbackHandler("coder")]
+        self.llm = self.Endpoint(repo_id)
+        self.llms = {repo_id: self.llm}
+
+    def Endpoint(self, repo_id: str):
+        if LlmBackend() == "local":
+            return GetLLM(repo_id=repo_id, temperature=self.temperature, max_length=self.max_length)
+        ShareHttpSession()
+        return HuggingFaceEndpoint(
+            huggingfacehub_api_token=self.api_key,
             repo_id=repo_id,
-            temperature=temperature,
-            max_length=max_length
+            temperature=self.temperature,
+            max_length=self.max_length
         )
 
+    def Invoke(self, repo_id: str, prompt: str) -> str:
+        if repo_id not in self.llms:
+            self.llms[repo_id] = self.Endpoint(repo_id)
+        return self.llms[repo_id].invoke(prompt, config={"callbacks": self.callbacks})
+
+    def Ask(self, task: str, prompt: str) -> str:
+        # One LLM call on the model the router picks for this task and prompt
+        repo_id, _ = Route("coder", prompt, task=task, small=self.small_repo_id, large=self.repo_id)
+        return self.Invoke(repo_id, prompt)
+
+    def Compiles(self, code: str) -> bool:
+        try:
+            compile(code, "<generated>", "exec")
+        except (SyntaxError, ValueError):
+            return False
+        return True
+
+    def ExtractCode(self, text: str):
+        # The code in an LLM reply: a fenced block, the whole reply, or the
+        # reply from its first def/class/import line on; None if none compiles
+        candidates = re.findall(r"```[ \t]*(?:python|py)?[ \t]*\n(.*?)```", text, re.DOTALL | re.IGNORECASE)
+        candidates.append(text)
+        start = re.search(r"^(?:def|class|import|from|async def)\b", text, re.MULTILINE)
+        if start:
+            candidates.append(text[start.start():])
+        for candidate in candidates:
+            if candidate.strip() and self.Compiles(candidate):
+                return candidate
+        return None
+
+    def IsBroken(self, reply: str) -> bool:
+        # Confidence check for the small model's reply: it must contain code
+        # that compiles, prose and ``` fences around it are fine
+        return self.ExtractCode(reply) is None
+
     def GenerateCode(self, prompt: str) -> str:
-        # Use the LLM to generate code based on the prompt
-        response = self.llm.invoke(prompt)
+        # Use the LLM to generate code based on the prompt; near-duplicate
+        # requests are answered from the semantic cache. A small-model reply
+        # with no compilable code in it is regenerated on the large one.
+        # The code is returned without the prose and fences around it, or the
+        # whole reply if none of it compiles.
+        def Generate():
+            reply, _ = Cascade("coder", prompt, lambda repo_id: self.Invoke(repo_id, prompt), weak=self.IsBroken,
+                               task="generate_code", small=self.small_repo_id, large=self.repo_id)
+            return self.ExtractCode(reply) or reply
+        response = CachedGenerate(f"coder:{self.repo_id}", prompt, Generate)
         return response
 
     def CreateTestFunction(self, code: str) -> str:
@@ -43,42 +128,86 @@ if __name__ == "__main__":
 """
         return test_code
 
+    def TestFiles(self, code: str) -> dict:
+        # Source files for one sandboxed test run
+        return {
+            "generated_code.py": code,
+            "test_generated_code.py": self.CreateTestFunction(code),
+        }
+
+    @Traced("coder", "sandbox", "TestCode")
     def TestCode(self, code: str) -> bool:
-        # Write the code to a temporary file
-        with open("generated_code.py", "w") as f:
-            f.write(code)
-        
-        # Write the test code
-        test_code = self.CreateTestFunction(code)
-        with open("test_generated_code.py", "w") as f:
-            f.write(test_code)
-        
-        # Run the test file using unittest and capture the result
-        result = os.system("python test_generated_code.py")
-        return result == 0
+        # Run the tests in an isolated temp directory on the shared worker pool,
+        # with CPU, wall-clock and memory limits and captured output
+        self.last_code = code
+        self.last_result = GetSandbox().run(self.TestFiles(code), "test_generated_code.py")
+        return self.last_result["passed"]
+
+    def TestCandidates(self, codes: list) -> list:
+        # Test several candidate programs in parallel; results keep input order
+        return GetSandbox().map([self.TestFiles(code) for code in codes], "test_generated_code.py")
 
     def ExplainCode(self, code: str) -> str:
         # Use the LLM to generate an explanation of the code
         prompt = f"Explain the following Python code:\n{code}"
-        explanation = self.llm.invoke(prompt)
+        explanation = self.Ask("explain_code", prompt)
         return explanation
 
     def FixCode(self, code: str, error_message: str) -> str:
-        # Use the LLM to fix the code based on the error message
+        # Use the LLM to fix the code based on the error message; repairs go to
+        # the large model unless fix_code is removed from router_large_tasks.
+        # Returns the code in the reply, or None if the reply has none that compiles.
         prompt = f"Fix the following Python code:\n{code}\nError message: {error_message}"
-        fixed_code = self.llm.invoke(prompt)
-        return fixed_code
+        reply = self.Ask("fix_code", prompt)
+        self.tokens_used += self.EstimateTokens(prompt) + self.EstimateTokens(reply)
+        return self.ExtractCode(reply)
+
+    def EstimateTokens(self, text: str) -> int:
+        # Rough count (~4 characters per token) used only for budgeting
+        return len(text) // 4 + 1
+
+    def CodeHash(self, code: str) -> str:
+        return hashlib.sha256(code.strip().encode("utf-8")).hexdigest()
+
+    def RepairCode(self, code: str):
+        # Test/fix loop bounded by iteration count, wall-clock and token budget.
+        # Stops early when the LLM returns code that was already tried.
+        # Returns (code, passed, reason); per-iteration timings go to self.iterations.
+        started = time.monotonic()
+        self.tokens_used = 0
+        self.iterations = []
+        tried = set()
+        for iteration in range(1, self.max_iterations + 1):
+            tried.add(self.CodeHash(code))
+            test_started = time.monotonic()
+            passed = self.TestCode(code)
+            record = {"iteration": iteration, "test_seconds": time.monotonic() - test_started, "passed": passed}
+            self.iterations.append(record)
+            if passed:
+                return code, True, "passed"
+            if time.monotonic() - started >= self.max_seconds:
+                return code, False, "time budget exhausted"
+            if self.tokens_used >= self.max_tokens:
+                return code, False, "token budget exhausted"
+            if iteration == self.max_iterations:
+                break
+
+            fix_started = time.monotonic()
+            fixed_code = self.FixCode(code, self.GetErrorMessage())
+            record["fix_seconds"] = time.monotonic() - fix_started
+            if fixed_code is None:
+                return code, False, "fix contained no compilable code"
+            if self.CodeHash(fixed_code) in tried:
+                return code, False, "fix repeated an earlier attempt"
+            code = fixed_code
+        return code, False, "iteration limit reached"
 
     def run(self, input_text: str) -> str:
         if self.IsCode(input_text):
-            # If input is code, validate and correct it
-            code = input_text
-            while True:
-                if self.TestCode(code):
-                    break
-                else:
-                    error_message = self.GetErrorMessage()
-                    code = self.FixCode(code, error_message)
+            # If input is code, validate and correct it within the repair budget
+            code, passed, reason = self.RepairCode(input_text)
+            if not passed:
+                return f"Could not fix the code ({reason}, {len(self.iterations)} attempts):\n{code}\n\nLast error:\n{self.GetErrorMessage()}"
             explanation = self.ExplainCode(code)
             return f"Corrected Code:\n{code}\n\nExplanation:\n{explanation}"
         else:
@@ -91,16 +220,23 @@ if __name__ == "__main__":
         return bool(re.search(r'\bdef\b|\bclass\b|\bimport\b', text))
 
     def GetErrorMessage(self) -> str:
-        # Extract the last error message from the test run
-        with open("test_generated_code.py", "r") as f:
-            lines = f.readlines()
-        error_message = ""
-        for line in reversed(lines):
-            if "Traceback" in line or "Error" in line:
-                error_message = line + error_message
-            elif error_message:
-                error_message = line + error_message
-        return error_message
+        # Format the structured traceback captured by the sandbox for the fix prompt
+        if self.last_result is None or self.last_result["error"] is None:
+            return ""
+        error = self.last_result["error"]
+        lines = [f"{error['type']}: {error['message']}"]
+        code_lines = self.last_code.splitlines()
+        for frame in error["frames"]:
+            # <string> frames come from the exec() in CreateTestFunction, whose
+            # source starts with a blank line
+            if frame["file"] == "<string>" and 2 <= frame["line"] <= len(code_lines) + 1:
+                frame = dict(frame, file="generated_code", line=frame["line"] - 1, code=code_lines[frame["line"] - 2].strip())
+            # Frames of a SyntaxError have no function name
+            location = f"  {frame['file']}, line {frame['line']}"
+            if frame["name"]:
+                location += f", in {frame['name']}"
+            lines.append(f"{location}: {frame['code']}" if frame["code"] else location)
+        return "\n".join(lines)
 
 if __name__ == "__main__":
     load_dotenv()
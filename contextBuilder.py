@@ -0,0 +1,156 @@
+#######################################################
+# Token-budgeted prompt assembly for the chat tutor
+#######################################################
+
+import os
+import re
+import math
+from collections import Counter
+from clients import Lazy, ImportModule
+
+PROMPT_TEMPLATE = """{history}Based on the following information:
+
+{passages}
+
+User question: {question}
+
+Provide a comprehensive and accurate answer, combining the above information with your own knowledge:"""
+
+
+def Words(text):
+    return re.findall(r"\w+", text.lower())
+
+
+def Shingles(text, size=3):
+    words = Words(text)
+    return {tuple(words[i:i + size]) for i in range(max(1, len(words) - size + 1))}
+
+
+def FirstSentence(text, limit=200):
+    sentence = re.split(r"(?<=[.!?])\s", text.strip(), maxsplit=1)[0]
+    return sentence[:limit]
+
+
+def GetTokenizer(model_id):
+    # The model's own tokenizer, loaded once; None if it cannot be loaded
+    def Build():
+        try:
+            transformers = ImportModule("transformers")
+            return transformers.AutoTokenizer.from_pretrained(model_id, token=os.getenv("huggingfacehub_api_token"))
+        except Exception:
+            return None
+    return Lazy(f"tokenizer:{model_id}", Build)
+
+
+def SplitPassages(wiki_info, ddg_info):
+    # Wikipedia Documents are split into paragraphs, DuckDuckGo results into
+    # one passage per hit; fallback strings produce no passages
+    passages = []
+    if isinstance(wiki_info, list):
+        for doc in wiki_info:
+            title = doc.metadata.get("title", "")
+            for paragraph in re.split(r"\n\s*\n", doc.page_content):
+                if paragraph.strip():
+                    passages.append(("Wikipedia", f"{title}: {paragraph.strip()}" if title else paragraph.strip()))
+    if isinstance(ddg_info, str) and ddg_info.startswith("Title:"):
+        for hit in re.split(r"\n(?=Title: )", ddg_info):
+            passages.append(("DuckDuckGo", hit.replace("\nSnippet: ", ": ", 1).removeprefix("Title: ")))
+    return passages
+
+
+class ContextBuilder:
+    def __init__(self, model_id, budget=2048, history_budget=400, overlap=0.6):
+        self.model_id = model_id
+        self.budget = budget
+        self.history_budget = history_budget
+        self.overlap = overlap
+
+    def CountTokens(self, text):
+        tokenizer = GetTokenizer(self.model_id)
+        if tokenizer is None:
+            return len(text) // 4 + 1
+        return len(tokenizer.encode(text, add_special_tokens=False))
+
+    def Rank(self, question, passages):
+        # BM25-style term weighting against the question, computed over the
+        # passages at hand
+        query_terms = set(Words(question))
+        counts = [Counter(Words(text)) for _, text in passages]
+        lengths = [sum(c.values()) or 1 for c in counts]
+        avg_length = sum(lengths) / len(lengths) if lengths else 1
+        scores = []
+        for count, length in zip(counts, lengths):
+            score = 0.0
+            for term in query_terms:
+                df = sum(1 for c in counts if term in c)
+                if not df or term not in count:
+                    continue
+                idf = math.log(1 + (len(counts) - df + 0.5) / (df + 0.5))
+                tf = count[term]
+                score += idf * tf * 2.5 / (tf + 1.5 * (0.25 + 0.75 * length / avg_length))
+            scores.append(score)
+        order = sorted(range(len(passages)), key=lambda i: scores[i], reverse=True)
+        return [passages[i] for i in order]
+
+    def Dedupe(self, passages):
+        # Drop passages that mostly repeat a higher-ranked one (share of the
+        # shorter passage's word 3-grams found in the other)
+        kept, kept_shingles = [], []
+        for source, text in passages:
+            shingles = Shingles(text)
+            if any(len(shingles & other) / min(len(shingles), len(other)) >= self.overlap for other in kept_shingles):
+                continue
+            kept.append((source, text))
+            kept_shingles.append(shingles)
+        return kept
+
+    def History(self, messages):
+        # Recent turns verbatim, newest first, until half the history budget;
+        # older turns collapse into a one-line-per-turn rolling summary
+        recent, used = [], 0
+        index = len(messages)
+        while index > 0:
+            message = messages[index - 1]
+            line = f"{message['role'].capitalize()}: {message['content']}"
+            cost = self.CountTokens(line)
+            if used + cost > self.history_budget // 2:
+                break
+            recent.insert(0, line)
+            used += cost
+            index -= 1
+
+        summary = []
+        for message in reversed(messages[:index]):
+            if message["role"] == "user":
+                line = f"- Asked: {FirstSentence(message['content'])}"
+            else:
+                line = f"- Answered: {FirstSentence(message['content'])}"
+            cost = self.CountTokens(line)
+            if used + cost > self.history_budget:
+                break
+            summary.insert(0, line)
+            used += cost
+
+        parts = []
+        if summary:
+            parts.append("Summary of earlier conversation:\n" + "\n".join(summary))
+        if recent:
+            parts.append("Recent conversation:\n" + "\n".join(recent))
+        return "\n\n".join(parts) + "\n\n" if parts else ""
+
+    def Build(self, question, wiki_info, ddg_info, messages=()):
+        history = self.History(list(messages))
+        skeleton = PROMPT_TEMPLATE.format(history=history, passages="", question=question)
+        remaining = self.budget - self.CountTokens(skeleton)
+
+        chosen = []
+        for source, text in self.Dedupe(self.Rank(question, SplitPassages(wiki_info, ddg_info))):
+            passage = f"[{source}] {text}"
+            cost = self.CountTokens(passage) + 1
+            if cost > remaining:
+                continue
+            chosen.append(passage)
+            remaining -= cost
+
+        passages = "\n".join(chosen) if chosen else "No search results were found."
+        return PROMPT_TEMPLATE.format(history=history, passages=passages, question=question)
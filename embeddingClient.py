@@ -0,0 +1,156 @@
+#######################################################
+# Batched, concurrent embedding client with local fallback
+#######################################################
+
+import os
+import time
+import random
+import hashlib
+import threading
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+import requests
+from langchain_core.embeddings import Embeddings
+
+HF_FEATURE_URL = "https://api-inference.huggingface.co/pipeline/feature-extraction/{model}"
+RETRY_STATUS = {429, 503}
+
+
+class EmbeddingDiskCache:
+    # One .npy file per text hash, sharded by the first two hex digits
+    def __init__(self, root):
+        self.root = root
+
+    def Path(self, key):
+        return os.path.join(self.root, key[:2], key + ".npy")
+
+    def get(self, key):
+        try:
+            return np.load(self.Path(key))
+        except (FileNotFoundError, ValueError, OSError):
+            return None
+
+    def set(self, key, vector):
+        path = self.Path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = f"{path}.{threading.get_ident()}.tmp"
+        with open(tmp_path, "wb") as f:
+            np.save(f, vector)
+        os.replace(tmp_path, path)
+
+
+class BatchedEmbeddings(Embeddings):
+    # Drop-in for HuggingFaceInferenceAPIEmbeddings with control over batch
+    # size, requests in flight and retries. all-MiniLM-L6-v2 is the same model
+    # remotely and locally, so cached, remote and local vectors are comparable.
+    def __init__(
+        self,
+        api_key=None,
+        model_name="sentence-transformers/all-MiniLM-L6-v2",
+        batch_size=32,
+        max_in_flight=4,
+        max_retries=5,
+        timeout=30,
+        cache_dir=None,
+        offline=False,
+        session=None,
+        url=HF_FEATURE_URL,
+    ):
+        self.api_key = api_key
+        self.model_name = model_name
+        self.batch_size = batch_size
+        self.max_in_flight = max_in_flight
+        self.max_retries = max_retries
+        self.timeout = timeout
+        self.cache = EmbeddingDiskCache(cache_dir) if cache_dir else None
+        self.offline = offline
+        self.session = session or requests.Session()
+        self.url = url
+        self.local_model = None
+        self.local_lock = threading.Lock()
+        self.stats = {"cache_hits": 0, "remote": 0, "local": 0, "retries": 0}
+
+    def Key(self, text):
+        return hashlib.sha256(f"{self.model_name}\0{text}".encode("utf-8")).hexdigest()
+
+    def LocalModel(self):
+        with self.local_lock:
+            if self.local_model is None:
+                try:
+                    from sentence_transformers import SentenceTransformer
+                except ImportError:
+                    raise ImportError(
+                        "Offline embeddings need sentence-transformers: pip install sentence-transformers"
+                    )
+                self.local_model = SentenceTransformer(self.model_name, device="cpu")
+            return self.local_model
+
+    def EmbedLocal(self, texts):
+        self.stats["local"] += len(texts)
+        vectors = self.LocalModel().encode(texts, batch_size=self.batch_size, show_progress_bar=False)
+        return np.asarray(vectors, dtype=np.float32)
+
+    def EmbedRemote(self, texts):
+        url = self.url.format(model=self.model_name)
+        headers = {"Authorization": f"Bearer {self.api_key}"}
+        payload = {"inputs": texts, "options": {"wait_for_model": True, "use_cache": True}}
+        for attempt in range(self.max_retries + 1):
+            response = self.session.post(url, headers=headers, json=payload, timeout=self.timeout)
+            if response.status_code not in RETRY_STATUS or attempt == self.max_retries:
+                break
+            # Honour Retry-After when present, otherwise exponential backoff with jitter
+            retry_after = response.headers.get("Retry-After")
+            delay = float(retry_after) if retry_after and retry_after.isdigit() else 2 ** attempt
+            self.stats["retries"] += 1
+            time.sleep(delay + random.uniform(0, 0.5))
+        response.raise_for_status()
+        self.stats["remote"] += len(texts)
+        return np.asarray(response.json(), dtype=np.float32)
+
+    def EmbedBatch(self, texts):
+        if self.offline:
+            return self.EmbedLocal(texts)
+        try:
+            return self.EmbedRemote(texts)
+        except requests.exceptions.ConnectionError:
+            # No network: switch to the local model for the rest of the process
+            self.offline = True
+            return self.EmbedLocal(texts)
+
+    def embed_documents(self, texts):
+        vectors = [None] * len(texts)
+        missing = []
+        for i, text in enumerate(texts):
+            cached = self.cache.get(self.Key(text)) if self.cache else None
+            if cached is not None:
+                vectors[i] = cached
+                self.stats["cache_hits"] += 1
+            else:
+                missing.append(i)
+
+        batches = [missing[i:i + self.batch_size] for i in range(0, len(missing), self.batch_size)]
+        with ThreadPoolExecutor(max_workers=self.max_in_flight) as executor:
+            results = executor.map(lambda batch: self.EmbedBatch([texts[i] for i in batch]), batches)
+            for batch, batch_vectors in zip(batches, results):
+                for i, vector in zip(batch, batch_vectors):
+                    vectors[i] = vector
+                    if self.cache:
+                        self.cache.set(self.Key(texts[i]), vector)
+
+        return [vector.tolist() for vector in vectors]
+
+    def embed_query(self, text):
+        return self.embed_documents([text])[0]
+
+
+def DefaultEmbeddings():
+    from clients import GetHttpSession
+    return BatchedEmbeddings(
+        api_key=os.getenv("embedding_api_key"),
+        batch_size=int(os.getenv("embedding_batch_size", "32")),
+        max_in_flight=int(os.getenv("embedding_max_in_flight", "4")),
+        cache_dir=os.getenv("embedding_cache_dir") or None,
+        offline=os.getenv("embedding_offline", "").lower() in ("1", "true", "yes"),
+        session=GetHttpSession(),
+        url=os.getenv("embedding_api_url") or HF_FEATURE_URL,
+    )
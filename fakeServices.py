@@ -0,0 +1,423 @@
+#######################################################
+# Local stand-ins for the external services, for offline benchmarks
+#######################################################
+
+import re
+import json
+import time
+import base64
+import random
+import hashlib
+import threading
+from types import SimpleNamespace
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from typing import Any, List, Optional
+import numpy as np
+import requests
+from langchain.schema import Document
+from langchain_core.language_models.llms import LLM
+
+SERVICES = ["llm", "embeddings", "wikipedia", "duckduckgo", "tavily", "gemini", "image"]
+
+# Fixed seconds of latency per request; the LLM also waits token_latency per
+# streamed token
+DEFAULT_LATENCY = {
+    "llm": 0.3,
+    "embeddings": 0.05,
+    "wikipedia": 0.2,
+    "duckduckgo": 0.15,
+    "tavily": 0.25,
+    "gemini": 0.6,
+    "image": 0.1,
+}
+
+EMBEDDING_DIM = 384
+
+FAKE_CODE = """def add(a, b):
+    return a + b
+
+print(add(2, 3))
+"""
+
+
+def Words(text):
+    return re.findall(r"\w+", text.lower())
+
+
+def FakeEmbedding(text):
+    # Hashed bag of words: texts sharing words get similar vectors, so the
+    # semantic cache and the vector store behave like they do with a real model
+    vector = np.zeros(EMBEDDING_DIM, dtype=np.float32)
+    for word in Words(text):
+        vector[int(hashlib.md5(word.encode()).hexdigest(), 16) % EMBEDDING_DIM] += 1.0
+    norm = np.linalg.norm(vector)
+    return (vector / norm if norm else vector).tolist()
+
+
+def FakeParagraph(topic, words=120):
+    filler = ("is described in several sources and has a long history that is "
+              "covered in articles reference works and news reports").split()
+    topic_words = Words(topic) or ["topic"]
+    return " ".join((topic_words + filler)[i % (len(topic_words) + len(filler))] for i in range(words)) + "."
+
+
+def FakeCompletion(prompt, words=120):
+    # Just enough prompt awareness for every caller to take its normal path
+    tools = re.search(r"should be one of \[(.*?)\]", prompt)
+    if tools:
+        # ReAct agent: one tool call, then a final answer
+        question = re.findall(r"Question: (.*)", prompt)[-1]
+        scratchpad = prompt.rsplit("Question:", 1)[-1]
+        if "Observation:" not in scratchpad:
+            tool = tools.group(1).split(",")[0].strip()
+            return f" I should search for this.\nAction: {tool}\nAction Input: {question}"
+        return f" I now know the final answer.\nFinal Answer: {FakeParagraph(question, words)}"
+    if prompt.startswith("Fix the following Python code"):
+        return FAKE_CODE
+    if prompt.startswith("Explain the following Python code"):
+        return FakeParagraph("the function adds two numbers", words)
+    if re.search(r"\b(python|code|function|script)\b", prompt, re.IGNORECASE):
+        return FAKE_CODE
+    question = re.findall(r"(?:Question|User question): (.*)", prompt)
+    return FakeParagraph(question[-1] if question else prompt[-200:], words)
+
+
+def FakePNG(seed, size=256):
+    # A small noisy picture, so preprocessing and hashing have real work
+    from PIL import Image
+    import io
+    rng = np.random.default_rng(int(hashlib.md5(seed.encode()).hexdigest()[:8], 16))
+    pixels = rng.integers(0, 256, (size, size, 3), dtype=np.uint8)
+    buffer = io.BytesIO()
+    Image.fromarray(pixels).save(buffer, format="PNG")
+    return buffer.getvalue()
+
+
+class FakeServer:
+    # One threaded HTTP server with a route per service. Every route sleeps
+    # its configured latency (+-50% jitter) and fails with 503 at its error rate.
+    def __init__(self, latency=None, error_rate=None, token_latency=0.01, completion_words=120, seed=0):
+        self.latency = dict(DEFAULT_LATENCY, **(latency or {}))
+        self.error_rate = dict.fromkeys(SERVICES, 0.0)
+        self.error_rate.update(error_rate or {})
+        self.token_latency = token_latency
+        self.completion_words = completion_words
+        self.random = random.Random(seed)
+        self.random_lock = threading.Lock()
+        self.stats = {service: {"requests": 0, "errors": 0} for service in SERVICES}
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), self.Handler())
+        self.server.daemon_threads = True
+        self.thread = None
+
+    @property
+    def url(self):
+        host, port = self.server.server_address
+        return f"http://{host}:{port}"
+
+    def start(self):
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def Delay(self, service):
+        # Returns False if this request should fail
+        with self.random_lock:
+            jitter = self.random.uniform(0.5, 1.5)
+            failed = self.random.random() < self.error_rate[service]
+            self.stats[service]["requests"] += 1
+            self.stats[service]["errors"] += failed
+        time.sleep(self.latency[service] * jitter)
+        return not failed
+
+    def Handler(self):
+        fake = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def log_message(self, format, *args):
+                pass
+
+            def Body(self):
+                length = int(self.headers.get("Content-Length") or 0)
+                return json.loads(self.rfile.read(length) or b"{}")
+
+            def Send(self, status, body, content_type="application/json"):
+                if not isinstance(body, bytes):
+                    body = json.dumps(body).encode()
+                self.send_response(status)
+                self.send_header("Content-Type", content_type)
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def do_GET(self):
+                self.do_POST()
+
+            def do_POST(self):
+                service = self.path.strip("/").split("/")[0].split("?")[0]
+                if service not in SERVICES:
+                    return self.Send(404, {"error": f"unknown service {service}"})
+                body = self.Body() if self.command == "POST" else {}
+                if not fake.Delay(service):
+                    return self.Send(503, {"error": f"{service} unavailable"})
+                getattr(self, service.capitalize())(body)
+
+            def Llm(self, body):
+                # Text Generation Inference protocol: a JSON list, or server-sent
+                # events with one token each when "stream" is set. Under
+                # /llm/completion and /llm/health it speaks the llama.cpp server
+                # protocol instead.
+                if self.path.endswith("/health"):
+                    return self.Send(200, {"status": "ok"})
+                llama = self.path.endswith("/completion")
+                text = FakeCompletion(body.get("prompt" if llama else "inputs", ""), fake.completion_words)
+                for stop in (body.get("stop") or []) if llama else []:
+                    text = text.split(stop)[0]
+                if not body.get("stream"):
+                    return self.Send(200, {"content": text, "stop": True} if llama else [{"generated_text": text}])
+                self.send_response(200)
+                self.send_header("Content-Type", "text/event-stream")
+                self.send_header("Connection", "close")
+                self.end_headers()
+                self.close_connection = True
+                tokens = re.findall(r"\s*\S+", text)
+                if llama:
+                    tokens.append("")
+                for i, token in enumerate(tokens):
+                    time.sleep(fake.token_latency)
+                    if llama:
+                        event = {"content": token, "stop": i == len(tokens) - 1}
+                    else:
+                        event = {
+                            "index": i + 1,
+                            "token": {"id": i, "text": token, "logprob": 0.0, "special": False},
+                            "generated_text": text if i == len(tokens) - 1 else None,
+                            "details": None,
+                        }
+                    try:
+                        self.wfile.write(f"data:{json.dumps(event)}\n\n".encode())
+                        self.wfile.flush()
+                    except (BrokenPipeError, ConnectionResetError):
+                        # The client stopped reading the stream
+                        return
+
+            def Embeddings(self, body):
+                inputs = body.get("inputs", [])
+                if isinstance(inputs, str):
+                    return self.Send(200, FakeEmbedding(inputs))
+                self.Send(200, [FakeEmbedding(text) for text in inputs])
+
+            def Wikipedia(self, body):
+                query = body.get("query", "")
+                self.Send(200, [
+                    {"title": f"{query.title()} ({i})", "content": FakeParagraph(f"{query} part {i}", 200)}
+                    for i in range(body.get("k", 3))
+                ])
+
+            def Duckduckgo(self, body):
+                query = body.get("query", "")
+                self.Send(200, [
+                    {"title": f"{query.title()} result {i}", "body": FakeParagraph(f"{query} snippet {i}", 40)}
+                    for i in range(body.get("max_results", 3))
+                ])
+
+            def Tavily(self, body):
+                query = body.get("query", "")
+                self.Send(200, [
+                    {"url": f"https://example.com/{i}", "content": FakeParagraph(f"{query} page {i}", 80)}
+                    for i in range(body.get("k", 3))
+                ])
+
+            def Gemini(self, body):
+                size = len(base64.b64decode(body.get("image", "")))
+                self.Send(200, {"text": f"A picture ({size} bytes) showing {body.get('prompt', '')[:40].lower()}"})
+
+            def Image(self, body):
+                self.Send(200, FakePNG(self.path), content_type="image/png")
+
+        return Handler
+
+
+#######################################################
+# Clients with the same interface as the real ones
+#######################################################
+
+class FakeClient:
+    def __init__(self, url, session=None):
+        self.url = url
+        self.session = session or requests.Session()
+
+    def Post(self, service, payload, timeout=60):
+        response = self.session.post(f"{self.url}/{service}", json=payload, timeout=timeout)
+        response.raise_for_status()
+        return response.json()
+
+
+class FakeLLM(LLM):
+    # LangChain LLM backed by the fake /llm route
+    url: str
+    timeout: float = 60
+
+    @property
+    def _llm_type(self) -> str:
+        return "fake_tgi"
+
+    def _call(self, prompt: str, stop: Optional[List[str]] = None, run_manager: Any = None, **kwargs: Any) -> str:
+        response = requests.post(f"{self.url}/llm", json={"inputs": prompt, "parameters": {}}, timeout=self.timeout)
+        response.raise_for_status()
+        text = response.json()[0]["generated_text"]
+        for stop_word in stop or []:
+            text = text.split(stop_word)[0]
+        return text
+
+
+class FakeInferenceClient(FakeClient):
+    # huggingface_hub.InferenceClient.text_generation over the TGI stream format
+    def text_generation(self, prompt, stream=False, **parameters):
+        payload = {"inputs": prompt, "parameters": parameters, "stream": stream}
+        if not stream:
+            return self.Post("llm", payload)[0]["generated_text"]
+        return self.Stream(payload)
+
+    def Stream(self, payload):
+        with self.session.post(f"{self.url}/llm", json=payload, stream=True, timeout=60) as response:
+            response.raise_for_status()
+            for line in response.iter_lines():
+                if line.startswith(b"data:"):
+                    yield json.loads(line[5:])["token"]["text"]
+
+
+class FakeWikipediaRetriever(FakeClient):
+    def invoke(self, query):
+        return [
+            Document(page_content=page["content"], metadata={"title": page["title"]})
+            for page in self.Post("wikipedia", {"query": query, "k": 3})
+        ]
+
+
+class FakeWikipediaWrapper(FakeClient):
+    def run(self, query):
+        pages = self.Post("wikipedia", {"query": query, "k": 3})
+        return "\n\n".join(f"Page: {page['title']}\nSummary: {page['content']}" for page in pages)
+
+
+class FakeDDGS(FakeClient):
+    # duckduckgo_search.DDGS: a context manager with text()
+    def __init__(self, url, timeout=10):
+        super().__init__(url)
+        self.timeout = timeout
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.session.close()
+
+    def text(self, query, max_results=3):
+        return self.Post("duckduckgo", {"query": query, "max_results": max_results}, timeout=self.timeout)
+
+
+class FakeDuckDuckGoSearchRun(FakeClient):
+    def run(self, query):
+        return " ".join(hit["body"] for hit in self.Post("duckduckgo", {"query": query, "max_results": 4}))
+
+
+class FakeTavilyRetriever(FakeClient):
+    def invoke(self, query):
+        return [
+            Document(page_content=hit["content"], metadata={"source": hit["url"]})
+            for hit in self.Post("tavily", {"query": query, "k": 3})
+        ]
+
+
+class FakeGeminiModel(FakeClient):
+    # genai.GenerativeModel with inline image blobs
+    def Payload(self, contents):
+        prompt = next(part for part in contents if isinstance(part, str))
+        image = next((part for part in contents if isinstance(part, dict)), {"data": b""})
+        return {"prompt": prompt, "image": base64.b64encode(image["data"]).decode()}
+
+    def Response(self, text):
+        candidate = SimpleNamespace(content=SimpleNamespace(parts=[text]), safety_ratings=[])
+        return SimpleNamespace(text=text, candidates=[candidate])
+
+    def generate_content(self, contents):
+        return self.Response(self.Post("gemini", self.Payload(contents))["text"])
+
+    async def generate_content_async(self, contents):
+        import asyncio
+        return await asyncio.to_thread(self.generate_content, contents)
+
+
+def FakeImageCrawler(url):
+    # icrawler.builtin.BingImageCrawler that fetches max_num pictures from /image
+    class FakeBingImageCrawler(FakeClient):
+        def __init__(self, storage, **kwargs):
+            super().__init__(url)
+            self.root_dir = storage["root_dir"]
+
+        def crawl(self, keyword, max_num=1, **kwargs):
+            import os
+            os.makedirs(self.root_dir, exist_ok=True)
+            for i in range(max_num):
+                response = self.session.get(f"{self.url}/image?q={keyword}&i={i}", timeout=60)
+                response.raise_for_status()
+                with open(os.path.join(self.root_dir, f"{i + 1:06d}.png"), "wb") as f:
+                    f.write(response.content)
+
+    return FakeBingImageCrawler
+
+
+def InstallFakes(url):
+    # Point every client the scripts use at the fake server: registry entries
+    # are replaced, and names the modules import directly are patched
+    import os
+    import clients
+    os.environ["embedding_api_url"] = f"{url}/embeddings"
+    os.environ.setdefault("embedding_api_key", "fake")
+
+    clients.Register("wikipedia_retriever", FakeWikipediaRetriever(url))
+    clients.Register("wikipedia_wrapper", FakeWikipediaWrapper(url))
+    clients.Register("duckduckgo_search", FakeDuckDuckGoSearchRun(url))
+    clients.Register("tavily_retriever:3", FakeTavilyRetriever(url))
+    clients.Register("gemini:gemini-pro-vision", FakeGeminiModel(url))
+
+    import chatPipeline
+    chatPipeline.DDGS = lambda timeout=10: FakeDDGS(url, timeout)
+
+    if os.getenv("llm_backend", "hf").lower() == "local":
+        # The real local backend (localLLM.py), pointed at the fake llama.cpp server
+        os.environ["local_llm_url"] = f"{url}/llm"
+        llm = clients.GetLLM(temperature=0.7, max_new_tokens=512)
+    else:
+        llm = FakeLLM(url=url)
+        import modelRouter
+        for model in {modelRouter.SmallModel(), modelRouter.LargeModel()}:
+            clients.Register(f"inference_client:{model}", FakeInferenceClient(url))
+
+        for name in ("tavilyDdg", "wikiDdgAgent"):
+            try:
+                module = __import__(name)
+                module.GetLLM = lambda api_key_env=None, **kwargs: llm
+            except ImportError:
+                pass
+
+        try:
+            import coder
+            coder.HuggingFaceEndpoint = lambda **kwargs: llm
+        except ImportError:
+            pass
+
+    try:
+        import imageProcessing
+        crawler = FakeImageCrawler(url)
+        imageProcessing.ImageCrawler = lambda: crawler
+    except ImportError:
+        pass
+
+    return llm
@@ -0,0 +1,153 @@
+#######################################################
+# Fan-out mode for the search agents: every tool at once,
+# one streamed LLM answer, ReAct only as a fallback
+#######################################################
+
+import os
+import re
+import time
+from concurrent.futures import ThreadPoolExecutor
+from clients import Lazy
+from contextBuilder import ContextBuilder, Words
+from metrics import MetricsCallbackHandler, GetRegistry
+from modelRouter import Route, Escalate, LargeModel, RouterMode
+
+FANOUT_TEMPLATE = """Answer the question using the search results below and your own knowledge.
+
+Search results:
+{passages}
+
+Question: {question}
+Answer:"""
+
+# Tool outputs that mean "nothing found" rather than content
+NO_RESULT_MARKERS = (
+    "No relevant information found",
+    "An error occurred",
+    "No good DuckDuckGo Search Result",
+    "No good Wikipedia Search Result",
+)
+
+# Answers that suggest the model could not use the results
+WEAK_ANSWER_MARKERS = (
+    "i don't know", "i do not know", "i'm not sure", "i am not sure", "cannot answer",
+    "can't answer", "no information", "couldn't find", "could not find", "unable to find",
+)
+
+PASSAGE_WORDS = 120
+
+
+def AgentMode():
+    # "react" (default, the original agent loop) or "fanout" (opt-in)
+    return os.getenv("agent_mode", "react").lower()
+
+
+def ToolPool():
+    return Lazy("fanout_pool", lambda: ThreadPoolExecutor(max_workers=int(os.getenv("fanout_workers", "8"))))
+
+
+def RunTools(question, tools, pipeline, timeout=None):
+    # Call every tool with the question at once; a tool that fails or misses
+    # the shared deadline contributes nothing. Returns [(tool name, output)].
+    timeout = timeout if timeout is not None else float(os.getenv("fanout_timeout", "10"))
+    callbacks = [MetricsCallbackHandler(pipeline)]
+    started = time.monotonic()
+    futures = [(tool.name, ToolPool().submit(tool.run, question, callbacks=callbacks)) for tool in tools]
+
+    results = []
+    for name, future in futures:
+        try:
+            output = future.result(timeout=max(0.0, started + timeout - time.monotonic()))
+        except Exception:
+            future.cancel()
+            continue
+        if isinstance(output, str) and output.strip() and not output.startswith(NO_RESULT_MARKERS):
+            results.append((name, output))
+    return results
+
+
+def SplitOutput(name, output):
+    # Paragraphs, with long ones cut into windows of PASSAGE_WORDS words
+    passages = []
+    for paragraph in re.split(r"\n\s*\n", output):
+        words = paragraph.split()
+        for i in range(0, len(words), PASSAGE_WORDS):
+            passages.append((name, " ".join(words[i:i + PASSAGE_WORDS])))
+    return passages
+
+
+def BuildPrompt(question, results, builder):
+    # Merge all tool outputs, rank against the question, drop near-duplicates
+    # and keep what fits the token budget
+    passages = [passage for name, output in results for passage in SplitOutput(name, output)]
+    remaining = builder.budget - builder.CountTokens(FANOUT_TEMPLATE.format(passages="", question=question))
+    chosen = []
+    for source, text in builder.Dedupe(builder.Rank(question, passages)):
+        passage = f"[{source}] {text}"
+        cost = builder.CountTokens(passage) + 1
+        if cost > remaining:
+            continue
+        chosen.append(passage)
+        remaining -= cost
+    return FANOUT_TEMPLATE.format(passages="\n".join(chosen) or "No search results were found.", question=question), len(chosen)
+
+
+def IsWeakAnswer(question, answer, passages):
+    # Cheap check: no usable search results, a very short answer, a refusal,
+    # or an answer sharing no content words with the question
+    text = answer.strip().lower()
+    if not passages or len(text) < 20:
+        return True
+    if any(marker in text for marker in WEAK_ANSWER_MARKERS):
+        return True
+    content_words = {word for word in Words(question) if len(word) > 3}
+    return bool(content_words) and not content_words & set(Words(text))
+
+
+def Generate(llm, prompt, pipeline, on_token=None):
+    answer = ""
+    for token in llm.stream(prompt, config={"callbacks": [MetricsCallbackHandler(pipeline)]}):
+        answer += token
+        if on_token:
+            on_token(token)
+    return answer
+
+
+def FanOutAnswer(question, tools, get_llm, pipeline, fallback=None, on_token=None):
+    # One parallel round of tool calls and one streamed LLM call on the model
+    # picked by the router (get_llm(model) returns the LLM). A weak answer from
+    # the small model is regenerated on the large one, without streaming;
+    # fallback() (the ReAct agent) only runs when the answer is still weak.
+    results = RunTools(question, tools, pipeline)
+    builder = Lazy(f"fanout_builder:{LargeModel()}", lambda: ContextBuilder(
+        LargeModel(), budget=int(os.getenv("fanout_context_budget", "1536"))))
+    prompt, passages = BuildPrompt(question, results, builder)
+
+    model, _ = Route(pipeline, question, sources=len(results), context_tokens=builder.CountTokens(prompt))
+    answer = Generate(get_llm(model), prompt, pipeline, on_token)
+    if passages and model != LargeModel() and RouterMode() == "cascade" and IsWeakAnswer(question, answer, passages):
+        answer = Generate(get_llm(Escalate(pipeline, "answer", "weak_answer")), prompt, pipeline)
+
+    if fallback is not None and IsWeakAnswer(question, answer, passages):
+        GetRegistry().Inc("fanout_fallbacks_total", {"pipeline": pipeline})
+        return fallback()
+    return answer.strip()
+
+
+class StreamPrinter:
+    # Prints tokens as they arrive; finish() prints the final answer if it is
+    # not what was streamed (a cache hit or a ReAct fallback)
+    def __init__(self):
+        self.text = ""
+
+    def __call__(self, token):
+        self.text += token
+        print(token, end="", flush=True)
+
+    def finish(self, answer):
+        if self.text.strip() == answer.strip():
+            print()
+        elif self.text:
+            print(f"\n\nRevised answer: {answer}")
+        else:
+            print(answer)
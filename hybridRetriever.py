@@ -0,0 +1,184 @@
+#######################################################
+# Hybrid BM25 + vector retrieval with optional reranking
+#######################################################
+
+import re
+import math
+import time
+import hashlib
+import threading
+from collections import defaultdict, Counter
+from typing import Any, List, Optional
+from langchain.schema import Document
+from langchain_core.retrievers import BaseRetriever
+
+
+def Tokenize(text):
+    return re.findall(r"\w+", text.lower())
+
+
+def DocKey(doc):
+    # Chunks from ingest.py carry a content-hash id; fall back to hashing text
+    return doc.metadata.get("chunk_id") or hashlib.sha256(doc.page_content.encode("utf-8")).hexdigest()
+
+
+class BM25Index:
+    # Inverted index: term -> {doc key: term frequency}
+    def __init__(self, k1=1.5, b=0.75):
+        self.k1 = k1
+        self.b = b
+        self.postings = defaultdict(dict)
+        self.lengths = {}
+        self.docs = {}
+        self.total_length = 0
+        self.lock = threading.Lock()
+
+    @classmethod
+    def FromFaiss(cls, store):
+        # Build over exactly the chunks held by a LangChain FAISS store
+        index = cls()
+        docs = [store.docstore.search(store.index_to_docstore_id[i]) for i in range(len(store.index_to_docstore_id))]
+        index.add([doc for doc in docs if isinstance(doc, Document)])
+        return index
+
+    def add(self, docs):
+        with self.lock:
+            for doc in docs:
+                key = DocKey(doc)
+                if key in self.docs:
+                    self.Remove(key)
+                terms = Counter(Tokenize(doc.page_content))
+                for term, tf in terms.items():
+                    self.postings[term][key] = tf
+                length = sum(terms.values())
+                self.lengths[key] = length
+                self.total_length += length
+                self.docs[key] = doc
+
+    def delete(self, keys):
+        with self.lock:
+            for key in keys:
+                if key in self.docs:
+                    self.Remove(key)
+
+    def Remove(self, key):
+        # Caller holds self.lock
+        doc = self.docs.pop(key)
+        for term in set(Tokenize(doc.page_content)):
+            postings = self.postings.get(term)
+            if postings is not None:
+                postings.pop(key, None)
+                if not postings:
+                    del self.postings[term]
+        self.total_length -= self.lengths.pop(key)
+
+    def search(self, query, k=4):
+        with self.lock:
+            n = len(self.docs)
+            if not n:
+                return []
+            avg_length = self.total_length / n
+            scores = defaultdict(float)
+            for term in set(Tokenize(query)):
+                postings = self.postings.get(term)
+                if not postings:
+                    continue
+                idf = math.log(1 + (n - len(postings) + 0.5) / (len(postings) + 0.5))
+                for key, tf in postings.items():
+                    norm = self.k1 * (1 - self.b + self.b * self.lengths[key] / avg_length)
+                    scores[key] += idf * tf * (self.k1 + 1) / (tf + norm)
+            best = sorted(scores.items(), key=lambda item: item[1], reverse=True)[:k]
+            return [self.docs[key] for key, _ in best]
+
+
+def ReciprocalRankFusion(result_lists, k=60):
+    # Each document scores sum(1 / (k + rank)) over the lists it appears in
+    scores = defaultdict(float)
+    docs = {}
+    for results in result_lists:
+        for rank, doc in enumerate(results):
+            key = DocKey(doc)
+            scores[key] += 1.0 / (k + rank + 1)
+            docs.setdefault(key, doc)
+    return [docs[key] for key in sorted(scores, key=scores.get, reverse=True)]
+
+
+class CrossEncoderReranker:
+    # Local cross-encoder scored in small batches until the latency budget runs
+    # out; anything unscored keeps its fused order after the scored documents
+    def __init__(self, model_name="cross-encoder/ms-marco-MiniLM-L-6-v2", top_k=4, budget=0.5, batch_size=8):
+        self.model_name = model_name
+        self.top_k = top_k
+        self.budget = budget
+        self.batch_size = batch_size
+        self.model = None
+        self.lock = threading.Lock()
+
+    def Model(self):
+        with self.lock:
+            if self.model is None:
+                try:
+                    from sentence_transformers import CrossEncoder
+                except ImportError:
+                    raise ImportError("Reranking needs sentence-transformers: pip install sentence-transformers")
+                self.model = CrossEncoder(self.model_name, device="cpu")
+            return self.model
+
+    def rerank(self, query, docs):
+        deadline = time.monotonic() + self.budget
+        scored = []
+        position = 0
+        while position < len(docs) and time.monotonic() < deadline:
+            batch = docs[position:position + self.batch_size]
+            scores = self.Model().predict([(query, doc.page_content) for doc in batch])
+            scored.extend(zip(scores, batch))
+            position += len(batch)
+        scored.sort(key=lambda item: item[0], reverse=True)
+        return ([doc for _, doc in scored] + docs[position:])[:self.top_k]
+
+
+class HybridRetriever(BaseRetriever):
+    vectorstore: Any
+    bm25: Any
+    k: int = 4
+    fetch_k: int = 20
+    rrf_k: int = 60
+    reranker: Optional[Any] = None
+
+    class Config:
+        arbitrary_types_allowed = True
+
+    @classmethod
+    def FromFaiss(cls, store, **kwargs):
+        # Large indexes (indexFactory.py) search the FTS5 table persisted in
+        # their SQLite docstore; pickled stores get an in-memory BM25 index
+        if hasattr(store.docstore, "LexicalIndex"):
+            return cls(vectorstore=store, bm25=store.docstore.LexicalIndex(), **kwargs)
+        return cls(vectorstore=store, bm25=BM25Index.FromFaiss(store), **kwargs)
+
+    def CheckWritable(self):
+        # Large indexes (SQLite docstore, row-keyed FAISS index) are not
+        # updated in place; fail before touching either index
+        if hasattr(self.vectorstore.docstore, "LexicalIndex"):
+            raise ValueError("Large indexes are read-only; rebuild them with indexFactory.BuildLargeIndex")
+
+    def add_documents(self, docs, **kwargs):
+        # Keeps the lexical index in step with the vector store
+        self.CheckWritable()
+        ids = self.vectorstore.add_documents(docs, **kwargs)
+        self.bm25.add(docs)
+        return ids
+
+    def delete(self, ids, keys=None):
+        # ids: vector store ids; keys: BM25 keys (default: the same ids)
+        self.CheckWritable()
+        self.vectorstore.delete(ids)
+        self.bm25.delete(keys if keys is not None else ids)
+
+    def _get_relevant_documents(self, query: str, *, run_manager=None) -> List[Document]:
+        vector_docs = self.vectorstore.similarity_search(query, k=self.fetch_k)
+        lexical_docs = self.bm25.search(query, k=self.fetch_k)
+        fused = ReciprocalRankFusion([vector_docs, lexical_docs], k=self.rrf_k)
+        if self.reranker is not None:
+            return self.reranker.rerank(query, fused)
+        return fused[:self.k]
@@ -0,0 +1,53 @@
+#######################################################
+# Shrink images before sending them to the vision model
+#######################################################
+
+import io
+import os
+import threading
+from PIL import Image
+
+MIME_TYPES = {"JPEG": "image/jpeg", "WEBP": "image/webp", "PNG": "image/png"}
+
+stats = {"requests": 0, "bytes_in": 0, "bytes_out": 0, "bytes_saved": 0}
+stats_lock = threading.Lock()
+
+
+def PreprocessImage(image_path, max_side=None, image_format=None, quality=None):
+    # Downscale to max_side on the longest edge, re-encode at the target
+    # quality and drop metadata (EXIF, ICC, comments are not carried over).
+    # Returns a blob dict that generate_content accepts as-is, plus per-request
+    # byte counts.
+    max_side = max_side or int(os.getenv("image_max_side", "1024"))
+    image_format = (image_format or os.getenv("image_format", "JPEG")).upper()
+    quality = quality or int(os.getenv("image_quality", "85"))
+
+    bytes_in = os.path.getsize(image_path)
+    with Image.open(image_path) as image:
+        if image.format == "JPEG":
+            # Let the JPEG decoder scale down by 1/2, 1/4 or 1/8 while decoding
+            image.draft("RGB", (max_side, max_side))
+        keep_alpha = image_format in ("WEBP", "PNG") and image.mode in ("RGBA", "LA", "P")
+        image = image.convert("RGBA" if keep_alpha else "RGB")
+        image.thumbnail((max_side, max_side), Image.LANCZOS)
+
+        buffer = io.BytesIO()
+        options = {"quality": quality} if image_format in ("JPEG", "WEBP") else {"optimize": True}
+        if image_format == "JPEG":
+            options["optimize"] = True
+        image.save(buffer, format=image_format, **options)
+
+    data = buffer.getvalue()
+    saved = bytes_in - len(data)
+    with stats_lock:
+        stats["requests"] += 1
+        stats["bytes_in"] += bytes_in
+        stats["bytes_out"] += len(data)
+        stats["bytes_saved"] += saved
+    blob = {"mime_type": MIME_TYPES[image_format], "data": data}
+    return blob, {"bytes_in": bytes_in, "bytes_out": len(data), "bytes_saved": saved}
+
+
+def Stats():
+    with stats_lock:
+        return dict(stats)
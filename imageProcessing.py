@@ -1,49 +1,188 @@
 import os
+import shutil
+import asyncio
+import tempfile
 from dotenv import load_dotenv
-from PIL import Image
-import google.generativeai as genai
 from langchain.agents import AgentExecutor, BaseSingleActionAgent
 from langchain.schema import AgentFinish
-from icrawler.builtin import BingImageCrawler
 from typing import List, Tuple, Any, Union
 import json
+from imageStore import GetImageStore, HashFile
+from imagePreprocess import PreprocessImage
+from clients import Lazy, GetGemini, ImportModule
+from metrics import Traced, RecordImageBytes
+from searchCache import NormalizeQuery
+from singleFlight import GetSingleFlight, GetAsyncSingleFlight
 
 load_dotenv()
 
-GOOGLE_API_KEY = os.getenv("Gemini_api_key")
+# Gemini is configured and the crawler imported on first use, so importing
+# ProcessQuery stays cheap
 
-genai.configure(api_key=GOOGLE_API_KEY)
+CAPTION_PROMPT = "Generate a detailed caption for the image, explaining what is happening in the scene. The caption should be easy to understand and informative. Make sure to use LATEX for Mathematical and Numerical equations."
 
 def GeminiVision(): 
-    model = genai.GenerativeModel('gemini-pro-vision')
+    model = GetGemini('gemini-pro-vision')
     return model
 
+def ImageCrawler():
+    return ImportModule("icrawler.builtin").BingImageCrawler
+
+def CaptionFromResponse(response):
+    if response.candidates:
+        if response.candidates[0].content.parts:
+            return response.text
+        else:
+            safety_ratings = response.candidates[0].safety_ratings
+            return f"Caption generation blocked due to safety concerns: {safety_ratings}"
+    else:
+        return "Caption generation failed: No valid response from the model."
+
+def IsCaption(caption):
+    return not (caption.startswith("Caption generation failed") or caption.startswith("Caption generation blocked"))
+
+@Traced("imageCaption", "llm", "gemini")
 def GenerateImageCaption(image_path):
+    # The same picture with the same prompt is only sent to Gemini once
     try:
-        model = GeminiVision()
-        image = Image.open(image_path)
-        prompt = "Generate a detailed caption for the image, explaining what is happening in the scene. The caption should be easy to understand and informative. Make sure to use LATEX for Mathematical and Numerical equations."            
-        response = model.generate_content([prompt, image])
-        
-        if response.candidates:
-            if response.candidates[0].content.parts:
-                return response.text
-            else:
-                safety_ratings = response.candidates[0].safety_ratings
-                return f"Caption generation blocked due to safety concerns: {safety_ratings}"
-        else:
-            return "Caption generation failed: No valid response from the model."
+        image_hash = HashFile(image_path)
+        cached = GetImageStore().GetCaption(image_hash, CAPTION_PROMPT)
+        if cached is not None:
+            return cached
+
+        def Caption():
+            model = GeminiVision()
+            # Downscaled, re-encoded, metadata-free copy instead of the full-size file
+            image, sizes = PreprocessImage(image_path)
+            RecordImageBytes("imageCaption", sizes)
+            response = model.generate_content([CAPTION_PROMPT, image])
+            caption = CaptionFromResponse(response)
+            if IsCaption(caption):
+                GetImageStore().SetCaption(image_hash, CAPTION_PROMPT, caption)
+            return caption
+        # Concurrent requests for the same picture share one Gemini call
+        return GetSingleFlight("caption").Do(image_hash, Caption)
+    except Exception as e:
+        return f"Caption generation failed: {str(e)}"
+
+@Traced("imageCaption", "llm", "gemini")
+async def GenerateImageCaptionAsync(image_path):
+    # Non-blocking variant: the upload and generation run on the event loop
+    try:
+        image_hash = await asyncio.to_thread(HashFile, image_path)
+        cached = GetImageStore().GetCaption(image_hash, CAPTION_PROMPT)
+        if cached is not None:
+            return cached
+
+        async def Caption():
+            model = GeminiVision()
+            image, sizes = await asyncio.to_thread(PreprocessImage, image_path)
+            RecordImageBytes("imageCaption", sizes)
+            response = await model.generate_content_async([CAPTION_PROMPT, image])
+            caption = CaptionFromResponse(response)
+            if IsCaption(caption):
+                GetImageStore().SetCaption(image_hash, CAPTION_PROMPT, caption)
+            return caption
+        return await GetAsyncSingleFlight("caption").Do(image_hash, Caption)
     except Exception as e:
         return f"Caption generation failed: {str(e)}"
 
+@Traced("imageCaption", "tool", "crawl")
 def DownloadImages(keyword, max_num=1):
+    # Concurrent requests for the same keyword share one crawl
+    return GetSingleFlight("crawl").Do(f"{NormalizeQuery(keyword)}:{max_num}", lambda: CrawlImages(keyword, max_num))
+
+def CrawlImages(keyword, max_num=1):
+    # Keywords that already have enough images in the store skip the crawl.
+    # Otherwise crawl into a scratch folder and move the files into the
+    # content-addressed store, deduplicating against other keywords.
+    store = GetImageStore()
+    if len(store.ImagesFor(keyword)) >= max_num:
+        return True
+    os.makedirs('./images/.crawl', exist_ok=True)
+    crawl_dir = tempfile.mkdtemp(dir='./images/.crawl')
     try:
-        google_crawler = BingImageCrawler(storage={'root_dir': f'./images/{keyword}'})
+        BingImageCrawler = ImageCrawler()
+        google_crawler = BingImageCrawler(storage={'root_dir': crawl_dir})
         google_crawler.crawl(keyword=keyword, max_num=max_num)
+        for name in sorted(os.listdir(crawl_dir)):
+            store.Add(os.path.join(crawl_dir, name), keyword)
         return True
     except Exception as e:
         print(f"Error downloading image: {str(e)}")
         return False
+    finally:
+        shutil.rmtree(crawl_dir, ignore_errors=True)
+
+def FindImageFile(query):
+    stored = GetImageStore().ImagesFor(query)
+    if stored:
+        return stored[0]
+    image_path = f'./images/{query}/'
+    for ext in ['.jpg', '.png', '.jpeg', '.gif']:
+        if os.path.isfile(image_path + '000001' + ext):
+            return image_path + '000001' + ext
+    return None
+
+def DownloadFailed(query):
+    return AgentFinish(
+        return_values={"output": json.dumps({
+            "image_path": None,
+            "caption": f"I couldn't find any images for '{query}'. Could you try a different query?"
+        })},
+        log=f"Failed to download image for query: {query}"
+    )
+
+def NoImageFound(query):
+    return AgentFinish(
+        return_values={"output": json.dumps({
+            "image_path": None,
+            "caption": f"I couldn't find any suitable images for '{query}'. Could you try a different query?"
+        })},
+        log=f"No suitable image file found for query: {query}"
+    )
+
+def CaptionFinish(query, full_image_path, caption):
+    if not IsCaption(caption):
+        return AgentFinish(
+            return_values={"output": json.dumps({
+                "image_path": full_image_path,
+                "caption": f"I found an image, but I couldn't generate a caption for it. Here's what happened: {caption}"
+            })},
+            log=f"Downloaded image but failed to generate caption for query: {query}"
+        )
+    else:
+        return AgentFinish(
+            return_values={"output": json.dumps({
+                "image_path": full_image_path,
+                "caption": caption
+            })},
+            log=f"Downloaded image and generated caption for query: {query}"
+        )
+
+class NoLimit:
+    # Stand-in for a semaphore when a stage is unbounded
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc):
+        return False
+
+async def CaptionQueryAsync(query, crawl_limit=None, caption_limit=None):
+    # Crawl and caption one query. Each stage can be bounded by its own
+    # semaphore so a batch pipelines: some queries crawl while others caption.
+    async with crawl_limit or NoLimit():
+        download_success = await asyncio.to_thread(DownloadImages, query, 1)
+    if not download_success:
+        return DownloadFailed(query)
+
+    full_image_path = FindImageFile(query)
+    if not full_image_path:
+        return NoImageFound(query)
+
+    async with caption_limit or NoLimit():
+        caption = await GenerateImageCaptionAsync(full_image_path)
+    return CaptionFinish(query, full_image_path, caption)
 
 class ImageCaptionAgent(BaseSingleActionAgent):
     def plan(
@@ -54,71 +193,83 @@ class ImageCaptionAgent(BaseSingleActionAgent):
         download_success = DownloadImages(query, max_num=1)
         
         if not download_success:
-            return AgentFinish(
-                return_values={"output": json.dumps({
-                    "image_path": None,
-                    "caption": f"I couldn't find any images for '{query}'. Could you try a different query?"
-                })},
-                log=f"Failed to download image for query: {query}"
-            )
-        
-        image_path = f'./images/{query}/'
+            return DownloadFailed(query)
 
-        image_file = None
-        for ext in ['.jpg', '.png', '.jpeg', '.gif']:
-            if os.path.isfile(image_path + '000001' + ext):
-                image_file = '000001' + ext
-                break
+        full_image_path = FindImageFile(query)
 
-        if image_file:
-            full_image_path = image_path + image_file
+        if full_image_path:
             caption = GenerateImageCaption(full_image_path)
-            
-            if caption.startswith("Caption generation failed") or caption.startswith("Caption generation blocked"):
-                return AgentFinish(
-                    return_values={"output": json.dumps({
-                        "image_path": full_image_path,
-                        "caption": f"I found an image, but I couldn't generate a caption for it. Here's what happened: {caption}"
-                    })},
-                    log=f"Downloaded image but failed to generate caption for query: {query}"
-                )
-            else:
-                return AgentFinish(
-                    return_values={"output": json.dumps({
-                        "image_path": full_image_path,
-                        "caption": caption
-                    })},
-                    log=f"Downloaded image and generated caption for query: {query}"
-                )
+            return CaptionFinish(query, full_image_path, caption)
         else:
-            return AgentFinish(
-                return_values={"output": json.dumps({
-                    "image_path": None,
-                    "caption": f"I couldn't find any suitable images for '{query}'. Could you try a different query?"
-                })},
-                log=f"No suitable image file found for query: {query}"
-            )
+            return NoImageFound(query)
 
     async def aplan(
         self, intermediate_steps: List[Tuple[Any, str]], **kwargs: Any
     ) -> Union[Any, AgentFinish]:
-        return self.plan(intermediate_steps, **kwargs)
+        return await CaptionQueryAsync(kwargs["input"])
 
     @property
     def input_keys(self):
         return ["input"]
 
-agent = ImageCaptionAgent()
-agent_executor = AgentExecutor.from_agent_and_tools(
-    agent=agent,
-    tools=[],
-    verbose=False
-)
+def GetAgentExecutor():
+    return Lazy("agent:imageCaption", lambda: AgentExecutor.from_agent_and_tools(
+        agent=ImageCaptionAgent(),
+        tools=[],
+        verbose=False
+    ))
 
+@Traced("imageCaption", "chain", "ProcessQuery")
 def ProcessQuery(query):
-    result = agent_executor.run(query)
+    # Identical queries arriving while one is running share its result
+    result = GetSingleFlight("imageCaption").Do(NormalizeQuery(query), lambda: GetAgentExecutor().run(query))
+    return json.loads(result)
+
+@Traced("imageCaption", "chain", "ProcessQuery")
+async def ProcessQueryAsync(query):
+    result = await GetAsyncSingleFlight("imageCaption").Do(NormalizeQuery(query), lambda: GetAgentExecutor().arun(query))
     return json.loads(result)
 
+async def ProcessQueriesAsync(queries, crawl_concurrency=4, caption_concurrency=8):
+    # Async generator yielding one (query, result) per input entry as each
+    # query finishes. Crawling and captioning have separate concurrency bounds.
+    crawl_limit = asyncio.Semaphore(crawl_concurrency)
+    caption_limit = asyncio.Semaphore(caption_concurrency)
+
+    async def Run(query):
+        finish = await CaptionQueryAsync(query, crawl_limit, caption_limit)
+        return query, json.loads(finish.return_values["output"])
+
+    # A repeated query runs once, so it takes no extra crawl or caption slot,
+    # and its result is yielded once for every time it was given
+    counts = {}
+    for query in queries:
+        counts[query] = counts.get(query, 0) + 1
+    tasks = [asyncio.ensure_future(Run(query)) for query in counts]
+    try:
+        for task in asyncio.as_completed(tasks):
+            query, result = await task
+            for _ in range(counts[query]):
+                yield query, dict(result)
+    finally:
+        for task in tasks:
+            task.cancel()
+
+def ProcessQueries(queries, crawl_concurrency=4, caption_concurrency=8):
+    # Synchronous wrapper around ProcessQueriesAsync; still yields results in
+    # completion order
+    loop = asyncio.new_event_loop()
+    results = ProcessQueriesAsync(queries, crawl_concurrency, caption_concurrency)
+    try:
+        while True:
+            try:
+                yield loop.run_until_complete(results.__anext__())
+            except StopAsyncIteration:
+                break
+    finally:
+        loop.run_until_complete(results.aclose())
+        loop.close()
+
 # Example usage: Run usage.py to see the output
 ################################################################################################################################
 '''
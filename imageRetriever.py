@@ -1,27 +1,142 @@
 from icrawler.builtin import GoogleImageCrawler,BaiduImageCrawler,BingImageCrawler
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from urllib.parse import urlparse
+import threading
+import json
 import time
-import random
+import sys
+import os
 
-def DownloadImages(keyword, max_num=10):
+class TokenBucket:
+    # Allows `rate` requests per second with bursts of up to `burst`
+    def __init__(self, rate, burst):
+        self.rate = rate
+        self.capacity = burst
+        self.tokens = burst
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def acquire(self):
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                wait = (1 - self.tokens) / self.rate
+            time.sleep(wait)
+
+class HostRateLimiter:
+    # One token bucket per host, shared by every crawler in the process
+    def __init__(self, rate=2.0, burst=4):
+        self.rate = rate
+        self.burst = burst
+        self.buckets = {}
+        self.lock = threading.Lock()
+
+    def acquire(self, url):
+        host = urlparse(url).netloc
+        with self.lock:
+            bucket = self.buckets.get(host)
+            if bucket is None:
+                bucket = self.buckets[host] = TokenBucket(self.rate, self.burst)
+        bucket.acquire()
+
+    def Wrap(self, session):
+        # Every feeder, parser and downloader request goes through the
+        # crawler's session, so rate-limit it there
+        request = session.request
+        def LimitedRequest(method, url, *args, **kwargs):
+            self.acquire(url)
+            return request(method, url, *args, **kwargs)
+        session.request = LimitedRequest
+        return session
+
+rate_limiter = HostRateLimiter(
+    rate=float(os.getenv("crawl_rate_per_host", "2")),
+    burst=int(os.getenv("crawl_burst_per_host", "4")),
+)
+
+def DownloadImages(keyword, max_num=10, feeder_threads=1, parser_threads=1, downloader_threads=1):
     google_crawler = BingImageCrawler(
-        feeder_threads=1,
-        parser_threads=1,
-        downloader_threads=1,
+        feeder_threads=feeder_threads,
+        parser_threads=parser_threads,
+        downloader_threads=downloader_threads,
         storage={'root_dir': f'./images/{keyword}'})
-    
+    rate_limiter.Wrap(google_crawler.session)
+
     try:
         google_crawler.crawl(
-            keyword=keyword, 
+            keyword=keyword,
             max_num=max_num,
             min_size=(200,200),
             max_size=None,
             file_idx_offset=0
         )
-        time.sleep(random.uniform(1, 3))  # Random delay between 1 and 3 seconds
+        return True
     except Exception as e:
         print(f"An error occurred while crawling for '{keyword}': {str(e)}")
+        return False
+
+def CountImages(keyword):
+    folder = f'./images/{keyword}'
+    return len(os.listdir(folder)) if os.path.isdir(folder) else 0
+
+def LoadCheckpoint(path):
+    if not os.path.isfile(path):
+        return {}
+    with open(path, "r", encoding="utf-8") as f:
+        return json.load(f)
+
+def SaveCheckpoint(path, checkpoint):
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(checkpoint, f, indent=2)
+    os.replace(tmp_path, path)
+
+def ReadKeywords(keywords):
+    # A path to a file with one keyword per line, or a list of keywords
+    if isinstance(keywords, str):
+        with open(keywords, "r", encoding="utf-8") as f:
+            keywords = [line.strip() for line in f]
+    return list(dict.fromkeys(k for k in keywords if k))
+
+def BulkDownloadImages(keywords, max_num=10, keyword_workers=8, downloader_threads=4,
+                       checkpoint_path="./images/crawl_checkpoint.json"):
+    # Crawl many keywords at once on a shared pool. Keywords recorded as
+    # complete in the checkpoint (or already holding max_num images) are
+    # skipped, so an interrupted run resumes where it stopped.
+    os.makedirs(os.path.dirname(checkpoint_path) or ".", exist_ok=True)
+    checkpoint = LoadCheckpoint(checkpoint_path)
+
+    pending = []
+    for keyword in ReadKeywords(keywords):
+        if checkpoint.get(keyword, {}).get("complete") or CountImages(keyword) >= max_num:
+            continue
+        pending.append(keyword)
 
-# Usage
-input_keyword = input("Enter the keyword: ")
-DownloadImages(input_keyword, max_num=10)
+    print(f"{len(pending)} keywords to crawl, {len(checkpoint)} in checkpoint")
+    with ThreadPoolExecutor(max_workers=keyword_workers) as executor:
+        futures = {
+            executor.submit(DownloadImages, keyword, max_num, 1, 1, downloader_threads): keyword
+            for keyword in pending
+        }
+        for future in as_completed(futures):
+            keyword = futures[future]
+            future.result()
+            # icrawler drops failed images without raising, so a keyword only
+            # counts as complete once it actually holds max_num images
+            images = CountImages(keyword)
+            checkpoint[keyword] = {"complete": images >= max_num, "images": images}
+            SaveCheckpoint(checkpoint_path, checkpoint)
+    return checkpoint
 
+# Usage: python imageRetriever.py [keywords.txt]
+if __name__ == "__main__":
+    if len(sys.argv) > 1:
+        BulkDownloadImages(sys.argv[1], max_num=10)
+    else:
+        input_keyword = input("Enter the keyword: ")
+        DownloadImages(input_keyword, max_num=10)
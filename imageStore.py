@@ -0,0 +1,141 @@
+#######################################################
+# Content-addressed image store and caption cache
+#######################################################
+
+import os
+import time
+import shutil
+import sqlite3
+import hashlib
+import threading
+from searchCache import NormalizeQuery
+
+
+def HashFile(path):
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+class ImageStore:
+    # Images are stored once under their SHA-256, whatever keyword found them.
+    # A SQLite index maps keywords to image hashes and caches captions per
+    # (image hash, prompt). Blobs are evicted least recently used first once
+    # the store grows past max_bytes; captions are kept since they are small.
+    def __init__(self, root="./images/store", max_bytes=2 * 1024 ** 3):
+        self.root = root
+        self.max_bytes = max_bytes
+        os.makedirs(root, exist_ok=True)
+        self.lock = threading.Lock()
+        self.conn = sqlite3.connect(os.path.join(root, "index.sqlite"), check_same_thread=False)
+        self.conn.executescript(
+            "CREATE TABLE IF NOT EXISTS images ("
+            "hash TEXT PRIMARY KEY, path TEXT NOT NULL, size INTEGER NOT NULL, accessed_at REAL NOT NULL);"
+            "CREATE TABLE IF NOT EXISTS keywords ("
+            "keyword TEXT NOT NULL, hash TEXT NOT NULL, added_at REAL NOT NULL, PRIMARY KEY (keyword, hash));"
+            "CREATE TABLE IF NOT EXISTS captions ("
+            "hash TEXT NOT NULL, prompt_hash TEXT NOT NULL, caption TEXT NOT NULL, PRIMARY KEY (hash, prompt_hash));"
+        )
+        self.conn.commit()
+        self.stats = {"deduplicated": 0, "caption_hits": 0, "caption_misses": 0, "evicted": 0}
+
+    def Add(self, path, keyword):
+        # Moves a downloaded file into the store and links it to the keyword.
+        # Returns (image hash, stored path).
+        image_hash = HashFile(path)
+        ext = os.path.splitext(path)[1].lower() or ".jpg"
+        stored = os.path.join(self.root, image_hash[:2], image_hash + ext)
+        now = time.time()
+        with self.lock:
+            row = self.conn.execute("SELECT path FROM images WHERE hash = ?", (image_hash,)).fetchone()
+            if row is not None and os.path.isfile(row[0]):
+                stored = row[0]
+                os.remove(path)
+                self.stats["deduplicated"] += 1
+            else:
+                os.makedirs(os.path.dirname(stored), exist_ok=True)
+                shutil.move(path, stored)
+                self.conn.execute(
+                    "INSERT OR REPLACE INTO images VALUES (?, ?, ?, ?)",
+                    (image_hash, stored, os.path.getsize(stored), now),
+                )
+            self.conn.execute(
+                "INSERT OR IGNORE INTO keywords VALUES (?, ?, ?)", (NormalizeQuery(keyword), image_hash, now)
+            )
+            self.conn.commit()
+        self.Evict()
+        return image_hash, stored
+
+    def ImagesFor(self, keyword):
+        # Stored paths for a keyword, oldest first; touching them for LRU
+        with self.lock:
+            rows = self.conn.execute(
+                "SELECT images.hash, images.path FROM keywords JOIN images ON images.hash = keywords.hash "
+                "WHERE keywords.keyword = ? ORDER BY keywords.added_at",
+                (NormalizeQuery(keyword),),
+            ).fetchall()
+            rows = [(image_hash, path) for image_hash, path in rows if os.path.isfile(path)]
+            self.conn.executemany(
+                "UPDATE images SET accessed_at = ? WHERE hash = ?", [(time.time(), h) for h, _ in rows]
+            )
+            self.conn.commit()
+        return [path for _, path in rows]
+
+    def PromptHash(self, prompt):
+        return hashlib.sha256(prompt.encode("utf-8")).hexdigest()
+
+    def GetCaption(self, image_hash, prompt):
+        with self.lock:
+            row = self.conn.execute(
+                "SELECT caption FROM captions WHERE hash = ? AND prompt_hash = ?",
+                (image_hash, self.PromptHash(prompt)),
+            ).fetchone()
+            self.stats["caption_hits" if row else "caption_misses"] += 1
+        return row[0] if row else None
+
+    def SetCaption(self, image_hash, prompt, caption):
+        with self.lock:
+            self.conn.execute(
+                "INSERT OR REPLACE INTO captions VALUES (?, ?, ?)", (image_hash, self.PromptHash(prompt), caption)
+            )
+            self.conn.commit()
+
+    def Evict(self):
+        with self.lock:
+            total = self.conn.execute("SELECT COALESCE(SUM(size), 0) FROM images").fetchone()[0]
+            if total <= self.max_bytes:
+                return
+            for image_hash, path, size in self.conn.execute(
+                "SELECT hash, path, size FROM images ORDER BY accessed_at"
+            ).fetchall():
+                if total <= self.max_bytes:
+                    break
+                if os.path.isfile(path):
+                    os.remove(path)
+                self.conn.execute("DELETE FROM images WHERE hash = ?", (image_hash,))
+                self.conn.execute("DELETE FROM keywords WHERE hash = ?", (image_hash,))
+                total -= size
+                self.stats["evicted"] += 1
+            self.conn.commit()
+
+    def Stats(self):
+        with self.lock:
+            count, size = self.conn.execute("SELECT COUNT(*), COALESCE(SUM(size), 0) FROM images").fetchone()
+            return dict(self.stats, images=count, bytes=size)
+
+
+_image_store = None
+_image_store_lock = threading.Lock()
+
+
+def GetImageStore():
+    global _image_store
+    with _image_store_lock:
+        if _image_store is None:
+            _image_store = ImageStore(
+                root=os.getenv("image_store_path", "./images/store"),
+                max_bytes=int(float(os.getenv("image_store_max_mb", "2048")) * 1024 * 1024),
+            )
+        return _image_store
@@ -0,0 +1,251 @@
+#######################################################
+# Memory-mapped, quantized FAISS indexes with a SQLite docstore
+#######################################################
+
+import os
+import re
+import json
+import sqlite3
+import threading
+import numpy as np
+import faiss
+from langchain.schema import Document
+from langchain_community.docstore.base import Docstore
+from langchain_community.vectorstores import FAISS
+from ingest import Batched
+
+INDEX_FILE = "index.faiss"
+DOCSTORE_FILE = "docstore.sqlite"
+CONFIG_FILE = "index_config.json"
+
+
+def FactoryString(kind, nlist=1024, pq_m=16, pq_nbits=8, hnsw_m=32):
+    # Index types understood by faiss.index_factory
+    if kind == "flat":
+        return "Flat"
+    if kind == "ivf_flat":
+        return f"IVF{nlist},Flat"
+    if kind == "ivf_pq":
+        return f"IVF{nlist},PQ{pq_m}x{pq_nbits}"
+    if kind == "hnsw":
+        return f"HNSW{hnsw_m},Flat"
+    raise ValueError(f"Unknown index kind: {kind!r} (expected flat, ivf_flat, ivf_pq or hnsw)")
+
+
+def SetSearchParams(index, nprobe=None, ef_search=None):
+    # nprobe applies to IVF indexes, efSearch to HNSW; other types ignore them
+    if nprobe is not None:
+        try:
+            faiss.extract_index_ivf(index).nprobe = nprobe
+        except RuntimeError:
+            pass
+    if ef_search is not None and hasattr(index, "hnsw"):
+        index.hnsw.efSearch = ef_search
+
+
+class SQLiteDocstore(Docstore):
+    # Chunks live on disk keyed by their FAISS row and are read on demand, so
+    # serving does not unpickle the whole corpus at startup
+    def __init__(self, path):
+        self.lock = threading.Lock()
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        self.conn.execute(
+            "CREATE TABLE IF NOT EXISTS chunks ("
+            "row INTEGER PRIMARY KEY, doc_id TEXT, page_content TEXT NOT NULL, metadata TEXT NOT NULL)"
+        )
+
+    def add(self, rows):
+        # rows: iterable of (row, doc_id, Document)
+        with self.lock:
+            self.conn.executemany(
+                "INSERT OR REPLACE INTO chunks VALUES (?, ?, ?, ?)",
+                [(row, doc_id, doc.page_content, json.dumps(doc.metadata)) for row, doc_id, doc in rows],
+            )
+            self.conn.commit()
+
+    def search(self, search):
+        with self.lock:
+            found = self.conn.execute(
+                "SELECT page_content, metadata FROM chunks WHERE row = ?", (int(search),)
+            ).fetchone()
+        if found is None:
+            return f"ID {search} not found."
+        return Document(page_content=found[0], metadata=json.loads(found[1]))
+
+    def __len__(self):
+        with self.lock:
+            return self.conn.execute("SELECT COUNT(*) FROM chunks").fetchone()[0]
+
+    def BuildFullText(self):
+        # FTS5 index over the chunks table, built inside SQLite and persisted in
+        # the same file; indexes built before it existed get it on first use
+        with self.lock:
+            exists = self.conn.execute(
+                "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'chunks_fts'"
+            ).fetchone()
+            if exists:
+                return
+            self.conn.execute(
+                "CREATE VIRTUAL TABLE chunks_fts USING fts5(page_content, content='chunks', content_rowid='row')"
+            )
+            self.conn.execute("INSERT INTO chunks_fts(chunks_fts) VALUES ('rebuild')")
+            self.conn.commit()
+
+    def LexicalIndex(self):
+        return SQLiteBM25(self)
+
+
+class SQLiteBM25:
+    # BM25 search over the docstore's FTS5 index, a drop-in for the search
+    # side of hybridRetriever.BM25Index that keeps nothing in memory. Large
+    # indexes are read-only: rebuild them with BuildLargeIndex.
+    def __init__(self, docstore):
+        self.docstore = docstore
+        self.ready = False
+
+    def search(self, query, k=4):
+        if not self.ready:
+            self.docstore.BuildFullText()
+            self.ready = True
+        terms = set(re.findall(r"\w+", query.lower()))
+        if not terms:
+            return []
+        match = " OR ".join(f'"{term}"' for term in sorted(terms))
+        with self.docstore.lock:
+            rows = self.docstore.conn.execute(
+                "SELECT chunks.page_content, chunks.metadata FROM chunks_fts "
+                "JOIN chunks ON chunks.row = chunks_fts.rowid "
+                "WHERE chunks_fts MATCH ? ORDER BY bm25(chunks_fts) LIMIT ?",
+                (match, k),
+            ).fetchall()
+        return [Document(page_content=content, metadata=json.loads(metadata)) for content, metadata in rows]
+
+
+class RowIdMap:
+    # Stands in for FAISS.index_to_docstore_id: the docstore is keyed by FAISS
+    # row, so the mapping is the identity and needs no memory
+    def __init__(self, size):
+        self.size = size
+
+    def __getitem__(self, i):
+        if not 0 <= i < self.size:
+            raise KeyError(i)
+        return int(i)
+
+    def get(self, i, default=None):
+        return self[i] if 0 <= i < self.size else default
+
+    def __len__(self):
+        return self.size
+
+
+def SourceManifest(paths):
+    # {path: [size, mtime_ns]} of the files an index is built from; cheap to
+    # compute on every start, unlike hashing the whole corpus
+    manifest = {}
+    for path in paths:
+        stat = os.stat(path)
+        manifest[path] = [stat.st_size, stat.st_mtime_ns]
+    return manifest
+
+
+def IsCurrent(index_path, sources):
+    # True if the index at index_path was built from exactly these sources
+    config_path = os.path.join(index_path, CONFIG_FILE)
+    if not os.path.isfile(config_path):
+        return False
+    with open(config_path, "r", encoding="utf-8") as f:
+        return json.load(f).get("sources") == sources
+
+
+def BuildLargeIndex(
+    chunks,
+    embeddings,
+    index_path,
+    kind="ivf_flat",
+    nlist=1024,
+    pq_m=16,
+    pq_nbits=8,
+    hnsw_m=32,
+    train_size=50000,
+    batch_size=256,
+    sources=None,
+):
+    # chunks: iterable of Documents (a generator is fine). IVF/PQ indexes buffer
+    # the first `train_size` vectors for training; after that every batch is
+    # embedded and added straight away. sources (see SourceManifest) is stored
+    # in the config so IsCurrent can tell when the data has changed.
+    os.makedirs(index_path, exist_ok=True)
+    docstore_path = os.path.join(index_path, DOCSTORE_FILE)
+    if os.path.exists(docstore_path):
+        os.remove(docstore_path)
+    docstore = SQLiteDocstore(docstore_path)
+
+    needs_training = kind in ("ivf_flat", "ivf_pq")
+    factory = None if needs_training else FactoryString(kind, hnsw_m=hnsw_m)
+    index = None
+    train_vectors, train_docs = [], []
+    size = 0
+
+    def Add(vectors, docs):
+        nonlocal size
+        index.add(vectors)
+        docstore.add((size + i, doc.metadata.get("chunk_id"), doc) for i, doc in enumerate(docs))
+        size += len(docs)
+
+    def TrainAndAdd():
+        nonlocal index, factory, kind
+        vectors = np.concatenate(train_vectors)
+        # PQ needs at least 2^pq_nbits training points per codebook; smaller
+        # corpora get IVF-Flat, which is no larger than PQ at that size anyway
+        if kind == "ivf_pq" and len(vectors) < 2 ** pq_nbits:
+            kind = "ivf_flat"
+        # IVF needs ~39 training points per list; shrink nlist for small corpora
+        factory = FactoryString(kind, min(nlist, max(1, len(vectors) // 39)), pq_m, pq_nbits)
+        index = faiss.index_factory(vectors.shape[1], factory)
+        index.train(vectors)
+        Add(vectors, train_docs)
+        train_vectors.clear()
+        train_docs.clear()
+
+    for batch in Batched(chunks, batch_size):
+        vectors = np.asarray(embeddings.embed_documents([doc.page_content for doc in batch]), dtype=np.float32)
+        if index is None and not needs_training:
+            index = faiss.index_factory(vectors.shape[1], factory)
+        if index is not None:
+            Add(vectors, batch)
+            continue
+        train_vectors.append(vectors)
+        train_docs.extend(batch)
+        if len(train_docs) >= train_size:
+            TrainAndAdd()
+
+    if train_docs:
+        TrainAndAdd()
+    if index is None:
+        raise ValueError("No chunks to index")
+
+    docstore.BuildFullText()
+    faiss.write_index(index, os.path.join(index_path, INDEX_FILE))
+    with open(os.path.join(index_path, CONFIG_FILE), "w", encoding="utf-8") as f:
+        json.dump({"kind": kind, "factory": factory, "size": size, "sources": sources}, f)
+    return LoadLargeIndex(index_path, embeddings)
+
+
+def LoadLargeIndex(index_path, embeddings, nprobe=16, ef_search=64, mmap=True):
+    # The index file is memory-mapped where the index type supports it, and the
+    # docstore is opened lazily; no pickle is involved
+    with open(os.path.join(index_path, CONFIG_FILE), "r", encoding="utf-8") as f:
+        config = json.load(f)
+    index_file = os.path.join(index_path, INDEX_FILE)
+    index = None
+    if mmap:
+        try:
+            index = faiss.read_index(index_file, faiss.IO_FLAG_MMAP | faiss.IO_FLAG_READ_ONLY)
+        except RuntimeError:
+            index = None
+    if index is None:
+        index = faiss.read_index(index_file)
+    SetSearchParams(index, nprobe=nprobe, ef_search=ef_search)
+    docstore = SQLiteDocstore(os.path.join(index_path, DOCSTORE_FILE))
+    return FAISS(embeddings, index, docstore, RowIdMap(config["size"]))
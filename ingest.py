@@ -0,0 +1,136 @@
+#######################################################
+# Incremental, streaming ingestion into a FAISS index
+#######################################################
+
+import os
+import json
+import hashlib
+from pathlib import Path
+from langchain_community.vectorstores import FAISS
+import langchain_community.document_loaders as doc_loaders
+
+MANIFEST_NAME = "ingest_manifest.json"
+
+
+def FileHash(path):
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def ChunkId(source, content):
+    # Chunks are fingerprinted by content; the source is part of the key so a
+    # deleted file only removes its own chunks
+    return hashlib.sha256(f"{source}\0{content}".encode("utf-8")).hexdigest()
+
+
+def IterFiles(directory, pattern="**/*.txt"):
+    for path in sorted(Path(directory).glob(pattern)):
+        if path.is_file():
+            yield str(path)
+
+
+def IterChunks(path, text_splitter):
+    # One file at a time through the splitter, so memory stays bounded by the
+    # largest file rather than the corpus
+    seen = set()
+    for document in doc_loaders.TextLoader(path, autodetect_encoding=True).lazy_load():
+        for chunk in text_splitter.split_documents([document]):
+            chunk_id = ChunkId(path, chunk.page_content)
+            if chunk_id in seen:
+                continue
+            seen.add(chunk_id)
+            chunk.metadata["source"] = path
+            chunk.metadata["chunk_id"] = chunk_id
+            yield chunk_id, chunk
+
+
+def FreshChunks(chunks, known_ids, all_ids):
+    # Records every chunk id of the file in all_ids, yields only unseen chunks
+    for chunk_id, chunk in chunks:
+        all_ids.append(chunk_id)
+        if chunk_id not in known_ids:
+            yield chunk_id, chunk
+
+
+def Batched(items, batch_size):
+    batch = []
+    for item in items:
+        batch.append(item)
+        if len(batch) >= batch_size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def LoadManifest(index_path):
+    manifest_path = os.path.join(index_path, MANIFEST_NAME)
+    if not os.path.isfile(manifest_path):
+        return {}
+    with open(manifest_path, "r", encoding="utf-8") as f:
+        return json.load(f)
+
+
+def SaveManifest(index_path, manifest):
+    os.makedirs(index_path, exist_ok=True)
+    manifest_path = os.path.join(index_path, MANIFEST_NAME)
+    tmp_path = manifest_path + ".tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(manifest, f)
+    os.replace(tmp_path, manifest_path)
+
+
+def IncrementalIngest(directory, index_path, embeddings, text_splitter, pattern="**/*.txt", batch_size=64):
+    # Sync the persisted index with the files under `directory`: unchanged files
+    # are skipped, only new chunks are embedded, and chunks of edited or deleted
+    # files are removed. Returns the updated store and a summary of the work.
+    manifest = LoadManifest(index_path)
+    library = None
+    if manifest and os.path.isfile(os.path.join(index_path, "index.faiss")):
+        library = FAISS.load_local(index_path, embeddings, allow_dangerous_deserialization=True)
+
+    stats = {"files_skipped": 0, "files_updated": 0, "files_removed": 0, "chunks_added": 0, "chunks_deleted": 0}
+    seen_sources = set()
+
+    for path in IterFiles(directory, pattern):
+        seen_sources.add(path)
+        file_hash = FileHash(path)
+        previous = manifest.get(path)
+        if previous and previous["hash"] == file_hash:
+            stats["files_skipped"] += 1
+            continue
+
+        old_ids = set(previous["chunks"]) if previous else set()
+        new_ids = []
+        fresh = FreshChunks(IterChunks(path, text_splitter), old_ids, new_ids)
+        for batch in Batched(fresh, batch_size):
+            ids = [chunk_id for chunk_id, _ in batch]
+            chunks = [chunk for _, chunk in batch]
+            if library is None:
+                library = FAISS.from_documents(chunks, embeddings, ids=ids)
+            else:
+                library.add_documents(chunks, ids=ids)
+            stats["chunks_added"] += len(ids)
+
+        stale = list(old_ids.difference(new_ids))
+        if stale and library is not None:
+            library.delete(stale)
+            stats["chunks_deleted"] += len(stale)
+
+        manifest[path] = {"hash": file_hash, "chunks": new_ids}
+        stats["files_updated"] += 1
+
+    for path in [p for p in manifest if p not in seen_sources]:
+        stale = manifest.pop(path)["chunks"]
+        if stale and library is not None:
+            library.delete(stale)
+            stats["chunks_deleted"] += len(stale)
+        stats["files_removed"] += 1
+
+    if library is not None:
+        library.save_local(index_path)
+    SaveManifest(index_path, manifest)
+    return library, stats
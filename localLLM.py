@@ -0,0 +1,208 @@
+#######################################################
+# Local CPU inference with llama.cpp (GGUF models), a
+# drop-in for HuggingFaceEndpoint and InferenceClient
+#######################################################
+
+# llm_backend=local switches GetLLM and GetInferenceClient (clients.py) to this
+# module. Two engines:
+#   server (default): one llama.cpp server child per model file, started on
+#     first use; its --parallel slots decode concurrent requests together
+#     (continuous batching). local_llm_url uses a server that is already running.
+#   python: llama-cpp-python in this process; one context, so requests take turns.
+# Nothing here touches the network beyond localhost.
+
+import os
+import json
+import time
+import atexit
+import socket
+import tempfile
+import threading
+import subprocess
+from typing import Any, Iterator, List, Optional
+from langchain_core.language_models.llms import LLM
+from langchain_core.outputs import GenerationChunk
+from clients import Lazy, ImportModule, GetHttpSession
+
+
+def LlmBackend():
+    # "hf" (default): HuggingFace endpoints; "local": llama.cpp on this machine
+    return os.getenv("llm_backend", "hf").lower()
+
+
+def LocalModelPath(repo_id=None):
+    # GGUF file for a model id: local_model_map ("repo_id=path,repo_id=path")
+    # first, then local_model_path for every model
+    for entry in os.getenv("local_model_map", "").split(","):
+        name, _, path = entry.partition("=")
+        if repo_id and name.strip() == repo_id and path.strip():
+            return path.strip()
+    path = os.getenv("local_model_path")
+    if not path and not os.getenv("local_llm_url"):
+        raise ValueError("llm_backend=local needs local_model_path (a GGUF file) or local_llm_url")
+    return path
+
+
+def FreePort():
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+class LlamaServer:
+    def __init__(self, model_path=None, url=None, parallel=4, n_ctx=4096, threads=None,
+                 binary="llama-server", start_timeout=300.0):
+        self.model_path = model_path
+        self.url = url.rstrip("/") if url else None
+        self.parallel = parallel
+        self.n_ctx = n_ctx
+        self.threads = threads or os.cpu_count() or 4
+        self.binary = binary
+        self.start_timeout = start_timeout
+        self.process = None
+        self.log = None
+
+    def start(self):
+        if self.url:
+            self.WaitReady()
+            return self
+        port = FreePort()
+        self.log = tempfile.TemporaryFile()
+        # -c is the total context, shared by the slots
+        self.process = subprocess.Popen(
+            [self.binary, "-m", self.model_path, "--host", "127.0.0.1", "--port", str(port),
+             "--parallel", str(self.parallel), "--cont-batching", "-c", str(self.n_ctx * self.parallel),
+             "-t", str(self.threads)],
+            stdout=self.log, stderr=subprocess.STDOUT,
+        )
+        atexit.register(self.stop)
+        self.url = f"http://127.0.0.1:{port}"
+        self.WaitReady()
+        return self
+
+    def WaitReady(self):
+        # /health answers 503 while the model loads
+        deadline = time.monotonic() + self.start_timeout
+        while time.monotonic() < deadline:
+            if self.process is not None and self.process.poll() is not None:
+                raise RuntimeError(f"llama.cpp server exited with code {self.process.returncode}:\n{self.LogTail()}")
+            try:
+                if GetHttpSession().get(f"{self.url}/health", timeout=2).status_code == 200:
+                    return
+            except Exception:
+                pass
+            time.sleep(0.25)
+        self.stop()
+        raise RuntimeError(f"llama.cpp server not ready after {self.start_timeout:.0f}s")
+
+    def LogTail(self, limit=2000):
+        if self.log is None:
+            return ""
+        self.log.seek(0)
+        return self.log.read().decode("utf-8", "replace")[-limit:]
+
+    def stop(self):
+        if self.process is not None and self.process.poll() is None:
+            self.process.terminate()
+            try:
+                self.process.wait(timeout=10)
+            except subprocess.TimeoutExpired:
+                self.process.kill()
+
+    def Stream(self, prompt, max_tokens=512, temperature=0.8, stop=None):
+        # Tokens as the server produces them. cache_prompt reuses the slot's KV
+        # cache when a prompt starts like the previous one.
+        payload = {
+            "prompt": prompt,
+            "n_predict": max_tokens,
+            "temperature": temperature,
+            "stop": list(stop or []),
+            "stream": True,
+            "cache_prompt": True,
+        }
+        timeout = float(os.getenv("llm_timeout", "60"))
+        with GetHttpSession().post(f"{self.url}/completion", json=payload, stream=True, timeout=timeout) as response:
+            response.raise_for_status()
+            for line in response.iter_lines():
+                if not line.startswith(b"data:"):
+                    continue
+                event = json.loads(line[5:])
+                if event.get("content"):
+                    yield event["content"]
+                if event.get("stop"):
+                    return
+
+
+class LlamaCppModel:
+    def __init__(self, model_path, n_ctx=4096, threads=None):
+        Llama = ImportModule("llama_cpp").Llama
+        self.model = Llama(model_path=model_path, n_ctx=n_ctx, n_threads=threads or os.cpu_count(), verbose=False)
+        self.lock = threading.Lock()
+
+    def Stream(self, prompt, max_tokens=512, temperature=0.8, stop=None):
+        with self.lock:
+            for chunk in self.model.create_completion(prompt, max_tokens=max_tokens, temperature=temperature,
+                                                      stop=list(stop or []), stream=True):
+                yield chunk["choices"][0]["text"]
+
+
+def GetLocalEngine(repo_id=None):
+    # One engine per model file, loaded on first use and kept for the process
+    engine = os.getenv("local_llm_engine", "server").lower()
+    path = LocalModelPath(repo_id)
+    n_ctx = int(os.getenv("local_llm_ctx", "4096"))
+    threads = int(os.getenv("local_llm_threads", "0")) or None
+
+    def Build():
+        if engine == "python":
+            try:
+                return LlamaCppModel(path, n_ctx, threads)
+            except ImportError:
+                raise ImportError("local_llm_engine=python needs llama-cpp-python: pip install llama-cpp-python")
+        return LlamaServer(
+            model_path=path,
+            url=os.getenv("local_llm_url"),
+            parallel=int(os.getenv("local_llm_parallel", "4")),
+            n_ctx=n_ctx,
+            threads=threads,
+            binary=os.getenv("local_llm_server_bin", "llama-server"),
+            start_timeout=float(os.getenv("local_llm_start_timeout", "300")),
+        ).start()
+    return Lazy(f"local_engine:{engine}:{path or os.getenv('local_llm_url')}", Build)
+
+
+class LocalLLM(LLM):
+    # LangChain LLM over the local engine, for initialize_agent, RetrievalQA,
+    # LLMChain and llm.stream(); tokens go to callbacks as they are produced
+    repo_id: str = ""
+    temperature: float = 0.8
+    max_new_tokens: Optional[int] = None
+    max_length: Optional[int] = None
+    streaming: bool = True
+
+    @property
+    def _llm_type(self) -> str:
+        return "llama_cpp"
+
+    def MaxTokens(self) -> int:
+        return self.max_new_tokens or self.max_length or 512
+
+    def _stream(self, prompt: str, stop: Optional[List[str]] = None, run_manager: Any = None, **kwargs: Any) -> Iterator[GenerationChunk]:
+        for token in GetLocalEngine(self.repo_id).Stream(prompt, self.MaxTokens(), self.temperature, stop):
+            chunk = GenerationChunk(text=token)
+            if run_manager:
+                run_manager.on_llm_new_token(token, chunk=chunk)
+            yield chunk
+
+    def _call(self, prompt: str, stop: Optional[List[str]] = None, run_manager: Any = None, **kwargs: Any) -> str:
+        return "".join(chunk.text for chunk in self._stream(prompt, stop, run_manager, **kwargs))
+
+
+class LocalInferenceClient:
+    # huggingface_hub.InferenceClient.text_generation over the local engine
+    def __init__(self, model=None):
+        self.model = model
+
+    def text_generation(self, prompt, max_new_tokens=512, temperature=0.8, stop_sequences=None, stream=False, **kwargs):
+        tokens = GetLocalEngine(self.model).Stream(prompt, max_new_tokens, temperature, stop_sequences)
+        return tokens if stream else "".join(tokens)
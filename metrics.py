@@ -0,0 +1,325 @@
+#######################################################
+# Per-stage timings, token counts, cache hits and errors
+#######################################################
+
+import os
+import time
+import inspect
+import functools
+import threading
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from langchain_core.callbacks import BaseCallbackHandler
+from clients import Lazy, ImportModule
+
+# Histogram buckets (seconds) for stage durations
+BUCKETS = (0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+# Histogram buckets (bytes) for payload sizes
+SIZE_BUCKETS = (1024, 4096, 16384, 65536, 262144, 1048576, 4194304, 16777216)
+
+
+def EstimateTokens(text):
+    return len(text) // 4 + 1 if text else 0
+
+
+class Registry:
+    # Counters, gauges and histograms keyed by metric name and a sorted
+    # label tuple
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.counters = {}
+        self.gauges = {}
+        self.histograms = {}
+
+    def Inc(self, name, labels, value=1):
+        key = (name, tuple(sorted(labels.items())))
+        with self.lock:
+            self.counters[key] = self.counters.get(key, 0) + value
+
+    def Set(self, name, labels, value):
+        key = (name, tuple(sorted(labels.items())))
+        with self.lock:
+            self.gauges[key] = value
+
+    def Observe(self, name, labels, value, buckets=BUCKETS):
+        key = (name, tuple(sorted(labels.items())))
+        with self.lock:
+            histogram = self.histograms.get(key)
+            if histogram is None:
+                histogram = self.histograms[key] = {"bounds": buckets, "buckets": [0] * len(buckets), "sum": 0.0, "count": 0}
+            for i, bound in enumerate(histogram["bounds"]):
+                if value <= bound:
+                    histogram["buckets"][i] += 1
+            histogram["sum"] += value
+            histogram["count"] += 1
+
+    def Prometheus(self):
+        # Prometheus text exposition format
+        def Labels(labels, extra=()):
+            pairs = list(labels) + list(extra)
+            if not pairs:
+                return ""
+            escaped = (str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n") for _, value in pairs)
+            return "{" + ",".join(f'{key}="{value}"' for (key, _), value in zip(pairs, escaped)) + "}"
+
+        lines, typed = [], set()
+        with self.lock:
+            for (name, labels), value in sorted(self.counters.items()):
+                if name not in typed:
+                    lines.append(f"# TYPE {name} counter")
+                    typed.add(name)
+                lines.append(f"{name}{Labels(labels)} {value}")
+            for (name, labels), value in sorted(self.gauges.items()):
+                if name not in typed:
+                    lines.append(f"# TYPE {name} gauge")
+                    typed.add(name)
+                lines.append(f"{name}{Labels(labels)} {value}")
+            for (name, labels), histogram in sorted(self.histograms.items()):
+                if name not in typed:
+                    lines.append(f"# TYPE {name} histogram")
+                    typed.add(name)
+                for bound, count in zip(histogram["bounds"], histogram["buckets"]):
+                    lines.append(f"{name}_bucket{Labels(labels, [('le', bound)])} {count}")
+                lines.append(f"{name}_bucket{Labels(labels, [('le', '+Inf')])} {histogram['count']}")
+                lines.append(f"{name}_sum{Labels(labels)} {histogram['sum']}")
+                lines.append(f"{name}_count{Labels(labels)} {histogram['count']}")
+        return "\n".join(lines) + "\n"
+
+    def Snapshot(self):
+        # Plain dict for JSON reports
+        with self.lock:
+            return {
+                "counters": [dict(labels, metric=name, value=value) for (name, labels), value in self.counters.items()],
+                "gauges": [dict(labels, metric=name, value=value) for (name, labels), value in self.gauges.items()],
+                "histograms": [
+                    dict(labels, metric=name, count=h["count"], sum=h["sum"])
+                    for (name, labels), h in self.histograms.items()
+                ],
+            }
+
+
+def GetRegistry():
+    registry = Lazy("metrics_registry", Registry)
+    if os.getenv("metrics_port"):
+        Lazy("metrics_server", lambda: StartMetricsServer(int(os.getenv("metrics_port"))))
+    return registry
+
+
+def StartMetricsServer(port, host="127.0.0.1"):
+    # Serves GET /metrics for a Prometheus scraper
+    class Handler(BaseHTTPRequestHandler):
+        def log_message(self, format, *args):
+            pass
+
+        def do_GET(self):
+            body = GetRegistry().Prometheus().encode()
+            self.send_response(200 if self.path.startswith("/metrics") else 404)
+            self.send_header("Content-Type", "text/plain; version=0.0.4")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+    server = ThreadingHTTPServer((host, port), Handler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def GetTracer():
+    # OpenTelemetry tracer exporting OTLP/HTTP to a local collector when
+    # otel_endpoint is set (e.g. http://localhost:4318/v1/traces); None otherwise
+    endpoint = os.getenv("otel_endpoint")
+    if not endpoint:
+        return None
+
+    def Build():
+        try:
+            trace = ImportModule("opentelemetry.trace")
+            sdk_trace = ImportModule("opentelemetry.sdk.trace")
+            export = ImportModule("opentelemetry.sdk.trace.export")
+            resources = ImportModule("opentelemetry.sdk.resources")
+            exporter = ImportModule("opentelemetry.exporter.otlp.proto.http.trace_exporter").OTLPSpanExporter
+        except ImportError:
+            return None
+        provider = sdk_trace.TracerProvider(
+            resource=resources.Resource.create({"service.name": os.getenv("otel_service_name", "langchain-series")})
+        )
+        provider.add_span_processor(export.BatchSpanProcessor(exporter(endpoint=endpoint)))
+        trace.set_tracer_provider(provider)
+        return trace.get_tracer("langchain-series")
+    return Lazy("otel_tracer", Build)
+
+
+def Record(pipeline, kind, name, duration, error=None, tokens_in=0, tokens_out=0):
+    labels = {"pipeline": pipeline, "kind": kind, "name": name}
+    registry = GetRegistry()
+    registry.Observe("stage_duration_seconds", labels, duration)
+    if error is not None:
+        registry.Inc("stage_errors_total", dict(labels, error=type(error).__name__))
+    AddTokens(pipeline, kind, name, tokens_in, tokens_out)
+
+
+def RecordImageBytes(pipeline, sizes):
+    # Per-request sizes of one preprocessed image (imagePreprocess.PreprocessImage);
+    # bytes_saved can be negative when re-encoding grows a small file
+    registry = GetRegistry()
+    for direction in ("in", "out"):
+        registry.Observe("image_bytes", {"pipeline": pipeline, "direction": direction}, sizes[f"bytes_{direction}"], SIZE_BUCKETS)
+    registry.Observe("image_bytes_saved", {"pipeline": pipeline}, sizes["bytes_saved"], SIZE_BUCKETS)
+
+
+def CountCache(cache, namespace, hit):
+    GetRegistry().Inc("cache_requests_total", {"cache": cache, "namespace": namespace, "result": "hit" if hit else "miss"})
+
+
+def AddTokens(pipeline, kind, name, tokens_in=0, tokens_out=0):
+    labels = {"pipeline": pipeline, "kind": kind, "name": name}
+    if tokens_in:
+        GetRegistry().Inc("tokens_total", dict(labels, direction="in"), tokens_in)
+    if tokens_out:
+        GetRegistry().Inc("tokens_total", dict(labels, direction="out"), tokens_out)
+
+
+class Span:
+    # Times a block; the duration goes to the registry and, when configured,
+    # to an OpenTelemetry span
+    def __init__(self, pipeline, kind, name, parent=None):
+        self.pipeline, self.kind, self.name = pipeline, kind, name
+        self.tokens_in = self.tokens_out = 0
+        self.otel = None
+        tracer = GetTracer()
+        if tracer is not None:
+            context = None
+            if parent is not None and parent.otel is not None:
+                context = ImportModule("opentelemetry.trace").set_span_in_context(parent.otel)
+            self.otel = tracer.start_span(f"{kind}:{name}", context=context, attributes={"pipeline": pipeline, "kind": kind})
+
+    def __enter__(self):
+        self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        # A consumer closing a stream early is not an error
+        self.finish(None if isinstance(exc, GeneratorExit) else exc)
+        return False
+
+    def start(self):
+        return self.__enter__()
+
+    def finish(self, error=None):
+        Record(self.pipeline, self.kind, self.name, time.perf_counter() - self.started,
+               error, self.tokens_in, self.tokens_out)
+        if self.otel is not None:
+            self.otel.set_attribute("tokens_in", self.tokens_in)
+            self.otel.set_attribute("tokens_out", self.tokens_out)
+            if error is not None:
+                self.otel.record_exception(error)
+                self.otel.set_attribute("error", True)
+            self.otel.end()
+
+
+def Traced(pipeline, kind, name=None):
+    # Decorator for plain, async and generator functions. For generators the
+    # span covers the whole stream and each yielded item counts as a token out.
+    def Decorate(function):
+        span_name = name or function.__name__
+
+        if inspect.isgeneratorfunction(function):
+            @functools.wraps(function)
+            def Generator(*args, **kwargs):
+                with Span(pipeline, kind, span_name) as span:
+                    for item in function(*args, **kwargs):
+                        span.tokens_out += 1
+                        yield item
+            return Generator
+
+        if inspect.iscoroutinefunction(function):
+            @functools.wraps(function)
+            async def Coroutine(*args, **kwargs):
+                with Span(pipeline, kind, span_name):
+                    return await function(*args, **kwargs)
+            return Coroutine
+
+        @functools.wraps(function)
+        def Function(*args, **kwargs):
+            with Span(pipeline, kind, span_name):
+                return function(*args, **kwargs)
+        return Function
+    return Decorate
+
+
+class MetricsCallbackHandler(BaseCallbackHandler):
+    # LangChain callbacks: LLM, tool, retriever and chain runs become spans
+    # (nested by parent run), agent actions are counted as ReAct steps.
+    # Pass it per call so child runs inherit it, e.g.
+    # agent.run(question, callbacks=[MetricsCallbackHandler("tavilyDdg")])
+    def __init__(self, pipeline):
+        self.pipeline = pipeline
+        self.runs = {}
+        self.lock = threading.Lock()
+
+    def Start(self, kind, serialized, run_id, parent_run_id, tokens_in=0, name=None):
+        name = name or (serialized or {}).get("name") or ((serialized or {}).get("id") or [kind])[-1]
+        with self.lock:
+            parent = self.runs.get(parent_run_id)
+        span = Span(self.pipeline, kind, name, parent=parent).start()
+        span.tokens_in = tokens_in
+        with self.lock:
+            self.runs[run_id] = span
+
+    def End(self, run_id, error=None, tokens_out=0):
+        with self.lock:
+            span = self.runs.pop(run_id, None)
+        if span is not None:
+            span.tokens_out = tokens_out
+            span.finish(error)
+
+    def on_llm_start(self, serialized, prompts, *, run_id, parent_run_id=None, **kwargs):
+        self.Start("llm", serialized, run_id, parent_run_id, sum(EstimateTokens(p) for p in prompts))
+
+    def on_chat_model_start(self, serialized, messages, *, run_id, parent_run_id=None, **kwargs):
+        tokens = sum(EstimateTokens(str(m.content)) for batch in messages for m in batch)
+        self.Start("llm", serialized, run_id, parent_run_id, tokens)
+
+    def on_llm_end(self, response, *, run_id, **kwargs):
+        usage = (response.llm_output or {}).get("token_usage") or {}
+        tokens_out = usage.get("completion_tokens") or sum(
+            EstimateTokens(generation.text) for generations in response.generations for generation in generations
+        )
+        with self.lock:
+            span = self.runs.get(run_id)
+        if span is not None and usage.get("prompt_tokens"):
+            span.tokens_in = usage["prompt_tokens"]
+        self.End(run_id, tokens_out=tokens_out)
+
+    def on_llm_error(self, error, *, run_id, **kwargs):
+        self.End(run_id, error)
+
+    def on_tool_start(self, serialized, input_str, *, run_id, parent_run_id=None, **kwargs):
+        self.Start("tool", serialized, run_id, parent_run_id)
+
+    def on_tool_end(self, output, *, run_id, **kwargs):
+        self.End(run_id)
+
+    def on_tool_error(self, error, *, run_id, **kwargs):
+        self.End(run_id, error)
+
+    def on_retriever_start(self, serialized, query, *, run_id, parent_run_id=None, **kwargs):
+        self.Start("retriever", serialized, run_id, parent_run_id)
+
+    def on_retriever_end(self, documents, *, run_id, **kwargs):
+        self.End(run_id)
+
+    def on_retriever_error(self, error, *, run_id, **kwargs):
+        self.End(run_id, error)
+
+    def on_chain_start(self, serialized, inputs, *, run_id, parent_run_id=None, **kwargs):
+        self.Start("chain", serialized, run_id, parent_run_id, name=kwargs.get("name"))
+
+    def on_chain_end(self, outputs, *, run_id, **kwargs):
+        self.End(run_id)
+
+    def on_chain_error(self, error, *, run_id, **kwargs):
+        self.End(run_id, error)
+
+    def on_agent_action(self, action, *, run_id, **kwargs):
+        GetRegistry().Inc("agent_steps_total", {"pipeline": self.pipeline, "tool": action.tool})
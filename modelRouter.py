@@ -0,0 +1,95 @@
+#######################################################
+# Model cascade: the small model by default, the large
+# model only for requests that look hard
+#######################################################
+
+import os
+import re
+from metrics import GetRegistry
+
+SMALL_MODEL = "mistralai/Mistral-7B-Instruct-v0.3"
+LARGE_MODEL = "mistralai/Mixtral-8x7B-Instruct-v0.1"
+
+# Phrases that usually mean multi-step reasoning or a long answer
+COMPLEX_MARKERS = (
+    "step by step", "step-by-step", "compare", "difference between", "differences between",
+    "prove", "derive", "explain why", "pros and cons", "trade-off", "tradeoff", "in detail",
+    "analyze", "analyse", "evaluate",
+)
+
+CODE_PATTERN = re.compile(r"```|\bdef\b|\bclass\b|\bimport\b|\breturn\b|[{};]\s*$", re.MULTILINE)
+
+
+def SmallModel():
+    return os.getenv("small_model", SMALL_MODEL)
+
+
+def LargeModel():
+    return os.getenv("large_model", LARGE_MODEL)
+
+
+def RouterMode():
+    # "cascade" (default), or "small" / "large" to pin every request to one model
+    return os.getenv("router_mode", "cascade").lower()
+
+
+def LargeTasks():
+    # Tasks that always go to the large model, e.g. code repair
+    return {task.strip() for task in os.getenv("router_large_tasks", "fix_code").split(",") if task.strip()}
+
+
+def Complexity(question, task, sources=0, context_tokens=0):
+    # ("small" | "large", reason) from cheap signals known before generation.
+    # Reasons are a fixed set so they can be used as a metric label.
+    if task in LargeTasks():
+        return "large", "large_task"
+    if len(question.split()) > int(os.getenv("router_max_words", "60")):
+        return "large", "long_question"
+    if task == "answer" and CODE_PATTERN.search(question):
+        # Code tasks always carry code; for them only length counts
+        return "large", "code"
+    text = question.lower()
+    if any(marker in text for marker in COMPLEX_MARKERS):
+        return "large", "complex_phrase"
+    if sources >= int(os.getenv("router_max_sources", "3")) and context_tokens >= int(os.getenv("router_max_context", "1200")):
+        return "large", "large_context"
+    return "small", "simple"
+
+
+def Count(pipeline, task, tier, model, reason):
+    # Every routing and escalation decision, exported with the other metrics
+    GetRegistry().Inc("router_decisions_total",
+                      {"pipeline": pipeline, "task": task, "tier": tier, "model": model, "reason": reason})
+
+
+def Route(pipeline, question, task="answer", sources=0, context_tokens=0, small=None, large=None):
+    # Returns (model id, reason); every decision is counted.
+    # small/large override the configured models for one caller.
+    mode = RouterMode()
+    if mode in ("small", "large"):
+        tier, reason = mode, "router_mode"
+    else:
+        tier, reason = Complexity(question, task, sources, context_tokens)
+    model = (large or LargeModel()) if tier == "large" else (small or SmallModel())
+    Count(pipeline, task, tier, model, reason)
+    return model, reason
+
+
+def Escalate(pipeline, task, reason, large=None):
+    # The small model's answer failed a confidence check; retry on the large one
+    model = large or LargeModel()
+    Count(pipeline, task, "escalated", model, reason)
+    return model
+
+
+def Cascade(pipeline, question, generate, weak=None, task="answer", sources=0, context_tokens=0, small=None, large=None):
+    # generate(model) on the routed model; when the small model answered and
+    # weak(answer) says the answer is not good enough, generate again on the
+    # large model. Returns (answer, model).
+    large = large or LargeModel()
+    model, _ = Route(pipeline, question, task, sources, context_tokens, small, large)
+    answer = generate(model)
+    if weak is not None and model != large and RouterMode() == "cascade" and weak(answer):
+        model = Escalate(pipeline, task, "weak_answer", large)
+        answer = generate(model)
+    return answer, model
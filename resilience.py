@@ -0,0 +1,263 @@
+#######################################################
+# Timeouts, hedged requests and circuit breakers for
+# the search and LLM backends
+#######################################################
+
+import os
+import time
+import threading
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from clients import Lazy
+from metrics import GetRegistry
+
+# Seconds allowed per call, overridable with <backend>_timeout
+DEFAULT_TIMEOUTS = {
+    "wiki": 4.0,
+    "ddg": 4.0,
+    "tavily": 6.0,
+    "llm": 60.0,
+}
+
+CIRCUIT_STATES = {"closed": 0, "half_open": 1, "open": 2}
+
+
+class BackendError(Exception):
+    pass
+
+
+class CircuitOpen(BackendError):
+    pass
+
+
+class BackendTimeout(BackendError):
+    pass
+
+
+class CircuitBreaker:
+    # Opens after `threshold` consecutive failures and rejects calls for
+    # `cooldown` seconds; then lets one trial call through (half-open), which
+    # closes the circuit on success or re-opens it on failure
+    def __init__(self, name, threshold=5, cooldown=30.0):
+        self.name = name
+        self.threshold = threshold
+        self.cooldown = cooldown
+        self.failures = 0
+        self.state = "closed"
+        self.opened_at = 0.0
+        self.trial_running = False
+        self.lock = threading.Lock()
+        self.Publish()
+
+    def allow(self):
+        with self.lock:
+            if self.state == "open" and time.monotonic() - self.opened_at >= self.cooldown:
+                self.state = "half_open"
+                self.trial_running = False
+                self.Publish()
+            if self.state == "closed":
+                return True
+            if self.state == "half_open" and not self.trial_running:
+                self.trial_running = True
+                return True
+            return False
+
+    def success(self):
+        with self.lock:
+            self.failures = 0
+            if self.state != "closed":
+                self.state = "closed"
+                self.Publish()
+
+    def failure(self):
+        with self.lock:
+            self.failures += 1
+            if self.state == "half_open" or (self.state == "closed" and self.failures >= self.threshold):
+                self.state = "open"
+                self.opened_at = time.monotonic()
+                GetRegistry().Inc("circuit_opened_total", {"backend": self.name})
+                self.Publish()
+
+    def Publish(self):
+        # Caller holds self.lock (or is __init__)
+        GetRegistry().Set("circuit_state", {"backend": self.name}, CIRCUIT_STATES[self.state])
+
+
+class Backend:
+    # One external service: a per-call timeout, a circuit breaker and a
+    # window of recent latencies used to pick the hedging delay
+    def __init__(self, name, timeout, threshold=5, cooldown=30.0, window=200,
+                 min_samples=20, hedge_percentile=95, max_hedge_ratio=0.1):
+        self.name = name
+        self.timeout = timeout
+        self.breaker = CircuitBreaker(name, threshold, cooldown)
+        self.latencies = deque(maxlen=window)
+        self.min_samples = min_samples
+        self.hedge_percentile = hedge_percentile
+        self.max_hedge_ratio = max_hedge_ratio
+        self.calls = 0
+        self.hedges = 0
+        self.lock = threading.Lock()
+
+    def HedgeDelay(self):
+        # p95 of recent successful calls; half the timeout until there is data
+        with self.lock:
+            if len(self.latencies) < self.min_samples:
+                return self.timeout / 2
+            ordered = sorted(self.latencies)
+        return ordered[min(len(ordered) - 1, int(len(ordered) * self.hedge_percentile / 100))]
+
+    def AllowHedge(self):
+        # Hedges are capped at a share of calls so a slow backend does not
+        # get double the load
+        with self.lock:
+            if self.hedges + 1 > self.max_hedge_ratio * self.calls + 1:
+                return False
+            self.hedges += 1
+        GetRegistry().Inc("hedged_requests_total", {"backend": self.name})
+        return True
+
+    def Succeeded(self, latency):
+        with self.lock:
+            self.latencies.append(latency)
+        self.breaker.success()
+
+    def Failed(self, error):
+        GetRegistry().Inc("backend_failures_total", {"backend": self.name, "error": type(error).__name__})
+        self.breaker.failure()
+
+    def Call(self, fn, *args, hedge=True, good=None):
+        # fn(*args) within the timeout. A duplicate is sent if the first call
+        # has not answered after the hedging delay.
+        attempts = [(self, 0.0, fn, args)]
+        if hedge:
+            attempts.append((self, self.HedgeDelay(), fn, args))
+        return Race(attempts, self.timeout, good)
+
+    def Guard(self):
+        # Breaker and failure accounting for calls that cannot go through
+        # Call(), e.g. a token stream consumed by the caller
+        return Guarded(self)
+
+
+class Guarded:
+    def __init__(self, backend):
+        self.backend = backend
+
+    def __enter__(self):
+        if not self.backend.breaker.allow():
+            raise CircuitOpen(f"{self.backend.name} circuit is open")
+        self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc is None or isinstance(exc, GeneratorExit):
+            self.backend.Succeeded(time.perf_counter() - self.started)
+        else:
+            self.backend.Failed(exc)
+        return False
+
+
+def CallPool():
+    return Lazy("resilience_pool", lambda: ThreadPoolExecutor(max_workers=int(os.getenv("resilience_workers", "32"))))
+
+
+def Race(attempts, timeout, good=None):
+    # attempts: [(backend, delay, fn, args)]. Each attempt starts at its delay
+    # (or at once when everything started so far has failed) unless a good
+    # answer has already arrived; the first good answer wins. Attempts on a
+    # backend that already failed in this race, or whose circuit is open, are
+    # skipped. Attempts started while another is still
+    # running are hedges and count against the first backend's hedge budget.
+    # Slower attempts finish in the background and are discarded. A backend's
+    # breaker sees at most one failure per race, however many of its attempts
+    # failed or timed out.
+    good = good or (lambda result: result is not None)
+    primary = attempts[0][0]
+    with primary.lock:
+        primary.calls += 1
+    started = time.monotonic()
+    deadline = started + timeout
+    pending = {}
+    timed_out = set()
+    failed = set()
+    errors = []
+    counted = set()
+    counted_lock = threading.Lock()
+    index = 0
+
+    def CountFailure(backend, error=None):
+        with counted_lock:
+            if backend.name in counted:
+                return
+            counted.add(backend.name)
+        if error is None:
+            GetRegistry().Inc("backend_timeouts_total", {"backend": backend.name})
+            backend.breaker.failure()
+        else:
+            backend.Failed(error)
+
+    def Run(backend, fn, args, key):
+        call_started = time.perf_counter()
+        try:
+            result = fn(*args)
+        except Exception as e:
+            if key not in timed_out:
+                CountFailure(backend, e)
+            raise
+        if key not in timed_out:
+            backend.Succeeded(time.perf_counter() - call_started)
+        return result
+
+    while True:
+        now = time.monotonic()
+        while index < len(attempts) and (started + attempts[index][1] <= now or not pending):
+            backend, _, fn, args = attempts[index]
+            if backend.name in failed or (pending and not primary.AllowHedge()):
+                index += 1
+                continue
+            if backend.breaker.allow():
+                pending[CallPool().submit(Run, backend, fn, args, index)] = (backend, index)
+            else:
+                errors.append(CircuitOpen(f"{backend.name} circuit is open"))
+            index += 1
+
+        if not pending:
+            raise errors[-1] if errors else BackendError("no attempts")
+
+        next_start = started + attempts[index][1] if index < len(attempts) else deadline
+        done, _ = wait(list(pending), timeout=max(0.0, min(next_start, deadline) - time.monotonic()),
+                       return_when=FIRST_COMPLETED)
+        for future in done:
+            backend, _ = pending.pop(future)
+            try:
+                result = future.result()
+            except Exception as e:
+                errors.append(e)
+                failed.add(backend.name)
+                continue
+            if good(result):
+                return result
+            errors.append(BackendError(f"{backend.name} returned no usable result"))
+            failed.add(backend.name)
+
+        if time.monotonic() >= deadline and pending:
+            for backend, key in pending.values():
+                timed_out.add(key)
+            for backend, _ in pending.values():
+                CountFailure(backend)
+            raise BackendTimeout(f"no answer from {', '.join(sorted({b.name for b, _ in pending.values()}))} within {timeout:.1f}s")
+
+
+def GetBackend(name):
+    return Lazy(f"backend:{name}", lambda: Backend(
+        name,
+        timeout=float(os.getenv(f"{name}_timeout", DEFAULT_TIMEOUTS.get(name, 10.0))),
+        threshold=int(os.getenv("circuit_threshold", "5")),
+        cooldown=float(os.getenv("circuit_cooldown", "30")),
+        max_hedge_ratio=float(os.getenv("hedge_max_ratio", "0.1")),
+    ))
+
+
+def Resilient(name, fn, *args, hedge=True, good=None):
+    return GetBackend(name).Call(fn, *args, hedge=hedge, good=good)
@@ -0,0 +1,263 @@
+#######################################################
+# Sandboxed, parallel runner for generated code
+#######################################################
+
+import os
+import re
+import sys
+import time
+import shutil
+import signal
+import tempfile
+import threading
+import traceback
+import subprocess
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+
+OUTPUT_LIMIT = 64 * 1024
+
+
+def ReadOutput(path):
+    try:
+        with open(path, "r", encoding="utf-8", errors="replace") as f:
+            return f.read(OUTPUT_LIMIT)
+    except FileNotFoundError:
+        return ""
+
+
+# SyntaxError tracebacks print the offending location without ", in <name>"
+FRAME_RE = re.compile(r'^  File "(?P<file>[^"]+)", line (?P<line>\d+)(?:, in (?P<name>.+))?$')
+EXCEPTION_RE = re.compile(r"^(?P<type>[A-Za-z_][\w.]*(?:Error|Exception|Exit|Interrupt|Warning)?)(?::\s?(?P<message>.*))?$")
+
+
+def ParseTraceback(stderr):
+    # Structured view of the last traceback in stderr: exception type, message
+    # and the frames that belong to the program under test
+    lines = stderr.splitlines()
+    starts = [i for i, line in enumerate(lines) if line.startswith("Traceback (most recent call last)")]
+    if not starts:
+        return None
+    frames = []
+    exception = None
+    i = starts[-1] + 1
+    while i < len(lines):
+        frame = FRAME_RE.match(lines[i])
+        if frame:
+            code = lines[i + 1].strip() if i + 1 < len(lines) and lines[i + 1].startswith("    ") else ""
+            internal = frame["file"].startswith("<frozen") or "/unittest/" in frame["file"] or frame["file"] == __file__
+            if not internal:
+                frames.append({"file": os.path.basename(frame["file"]), "line": int(frame["line"]),
+                               "name": frame["name"], "code": code})
+            i += 1
+            continue
+        match = EXCEPTION_RE.match(lines[i])
+        if match and not lines[i].startswith(" "):
+            exception = {"type": match["type"], "message": (match["message"] or "").strip()}
+            break
+        i += 1
+    if exception is None:
+        return None
+    return dict(exception, frames=frames)
+
+
+def DescribeFailure(returncode, timed_out, stderr, wall_seconds):
+    # Structured error for a failed run, including runs killed by a limit
+    if timed_out:
+        return {"type": "TimeoutError", "message": f"Wall-clock limit of {wall_seconds}s exceeded", "frames": []}
+    if hasattr(signal, "SIGXCPU") and returncode == -signal.SIGXCPU:
+        return {"type": "TimeoutError", "message": "CPU time limit exceeded", "frames": []}
+    if returncode < 0:
+        return {"type": "Killed", "message": f"Terminated by signal {-returncode}", "frames": []}
+    return ParseTraceback(stderr) or {"type": "Error", "message": stderr.strip()[-2000:], "frames": []}
+
+
+def WarmWorker():
+    # Paid once per pool worker instead of once per test run
+    import unittest  # noqa: F401
+    import runpy  # noqa: F401
+
+
+def UserThreads():
+    # Threads the current user already runs, which is what RLIMIT_NPROC
+    # counts on Linux (from /proc); 0 elsewhere
+    uid = os.getuid()
+    count = 0
+    try:
+        pids = [name for name in os.listdir("/proc") if name.isdigit()]
+    except OSError:
+        return 0
+    for name in pids:
+        try:
+            if os.stat(f"/proc/{name}").st_uid == uid:
+                count += len(os.listdir(f"/proc/{name}/task"))
+        except OSError:
+            pass
+    return count
+
+
+def RunChild(entry, workdir, cpu_seconds, memory_mb, max_processes):
+    # Runs in the forked child: start a new process group so every process the
+    # program spawns can be killed with it, apply limits, redirect output,
+    # execute entry
+    import resource
+    import runpy
+    os.setsid()
+    resource.setrlimit(resource.RLIMIT_CPU, (cpu_seconds, cpu_seconds + 1))
+    if memory_mb:
+        limit = memory_mb * 1024 * 1024
+        resource.setrlimit(resource.RLIMIT_AS, (limit, limit))
+    if max_processes:
+        # RLIMIT_NPROC counts all of the user's threads, so allow the ones
+        # already running plus max_processes new ones
+        limit = UserThreads() + max_processes
+        _, hard = resource.getrlimit(resource.RLIMIT_NPROC)
+        if hard != resource.RLIM_INFINITY:
+            limit = min(limit, hard)
+        resource.setrlimit(resource.RLIMIT_NPROC, (limit, limit))
+    os.chdir(workdir)
+    for fd, name in ((1, "stdout.txt"), (2, "stderr.txt")):
+        out = os.open(os.path.join(workdir, name), os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+        os.dup2(out, fd)
+        os.close(out)
+    sys.stdout = open(1, "w", closefd=False)
+    sys.stderr = open(2, "w", closefd=False)
+    sys.argv = [entry]
+    sys.path.insert(0, workdir)
+    code = 0
+    try:
+        runpy.run_path(entry, run_name="__main__")
+    except SystemExit as e:
+        code = e.code if isinstance(e.code, int) else (0 if e.code is None else 1)
+    except BaseException:
+        traceback.print_exc()
+        code = 1
+    sys.stdout.flush()
+    sys.stderr.flush()
+    os._exit(code)
+
+
+def KillGroup(pid):
+    # The child leads its own process group; this also reaches processes it
+    # forked, even after the child itself has exited
+    try:
+        os.killpg(pid, signal.SIGKILL)
+    except (ProcessLookupError, PermissionError):
+        try:
+            os.kill(pid, signal.SIGKILL)
+        except (ProcessLookupError, PermissionError):
+            pass
+
+
+def ForkAndWait(entry, workdir, cpu_seconds, wall_seconds, memory_mb, max_processes):
+    pid = os.fork()
+    if pid == 0:
+        try:
+            RunChild(entry, workdir, cpu_seconds, memory_mb, max_processes)
+        finally:
+            os._exit(1)
+
+    deadline = time.monotonic() + wall_seconds
+    timed_out = False
+    while True:
+        done, status = os.waitpid(pid, os.WNOHANG)
+        if done:
+            break
+        if time.monotonic() >= deadline:
+            timed_out = True
+            KillGroup(pid)
+            _, status = os.waitpid(pid, 0)
+            break
+        time.sleep(0.01)
+    # Leftover background processes must not outlive the run
+    KillGroup(pid)
+
+    if os.WIFSIGNALED(status):
+        return -os.WTERMSIG(status), timed_out
+    return os.WEXITSTATUS(status), timed_out
+
+
+def RunSubprocess(entry, workdir, wall_seconds):
+    # Fallback for platforms without fork/resource limits
+    try:
+        completed = subprocess.run(
+            [sys.executable, entry], cwd=workdir, timeout=wall_seconds, capture_output=True, text=True
+        )
+    except subprocess.TimeoutExpired as e:
+        return -signal.SIGKILL if hasattr(signal, "SIGKILL") else -9, True, e.stdout or "", e.stderr or ""
+    return completed.returncode, False, completed.stdout, completed.stderr
+
+
+def RunJob(files, entry, cpu_seconds, wall_seconds, memory_mb, max_processes):
+    # Executed inside a pool worker. Every run gets its own temp directory.
+    workdir = tempfile.mkdtemp(prefix="sandbox_")
+    started = time.monotonic()
+    try:
+        for name, source in files.items():
+            with open(os.path.join(workdir, name), "w", encoding="utf-8") as f:
+                f.write(source)
+        if hasattr(os, "fork"):
+            returncode, timed_out = ForkAndWait(entry, workdir, cpu_seconds, wall_seconds, memory_mb, max_processes)
+            stdout = ReadOutput(os.path.join(workdir, "stdout.txt"))
+            stderr = ReadOutput(os.path.join(workdir, "stderr.txt"))
+        else:
+            returncode, timed_out, stdout, stderr = RunSubprocess(entry, workdir, wall_seconds)
+        passed = returncode == 0 and not timed_out
+        return {
+            "returncode": returncode,
+            "passed": passed,
+            "timed_out": timed_out,
+            "stdout": stdout,
+            "stderr": stderr,
+            "error": None if passed else DescribeFailure(returncode, timed_out, stderr, wall_seconds),
+            "duration": time.monotonic() - started,
+        }
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+
+class Sandbox:
+    # A pool of pre-started worker processes. Each run forks a child from an
+    # already-warm worker, so it skips interpreter startup but still gets its
+    # own CPU-time, wall-clock, memory and process-count limits.
+    def __init__(self, workers=None, cpu_seconds=5, wall_seconds=10, memory_mb=512, max_processes=16):
+        self.cpu_seconds = cpu_seconds
+        self.wall_seconds = wall_seconds
+        self.memory_mb = memory_mb
+        self.max_processes = max_processes
+        context = multiprocessing.get_context("fork") if hasattr(os, "fork") else None
+        self.pool = ProcessPoolExecutor(
+            max_workers=workers or os.cpu_count() or 1, mp_context=context, initializer=WarmWorker
+        )
+
+    def submit(self, files, entry):
+        return self.pool.submit(RunJob, files, entry, self.cpu_seconds, self.wall_seconds, self.memory_mb, self.max_processes)
+
+    def run(self, files, entry):
+        return self.submit(files, entry).result()
+
+    def map(self, candidates, entry):
+        # Test several candidate programs in parallel; results keep input order
+        futures = [self.submit(files, entry) for files in candidates]
+        return [future.result() for future in futures]
+
+    def shutdown(self):
+        self.pool.shutdown(wait=True)
+
+
+_sandbox = None
+_sandbox_lock = threading.Lock()
+
+
+def GetSandbox():
+    global _sandbox
+    with _sandbox_lock:
+        if _sandbox is None:
+            _sandbox = Sandbox(
+                workers=int(os.getenv("sandbox_workers", "0")) or None,
+                cpu_seconds=int(os.getenv("sandbox_cpu_seconds", "5")),
+                wall_seconds=float(os.getenv("sandbox_wall_seconds", "10")),
+                memory_mb=int(os.getenv("sandbox_memory_mb", "512")),
+                max_processes=int(os.getenv("sandbox_max_processes", "16")),
+            )
+        return _sandbox
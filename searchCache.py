@@ -0,0 +1,187 @@
+#######################################################
+# Shared TTL + LRU cache for search results
+#######################################################
+
+import os
+import json
+import time
+import sqlite3
+import threading
+from collections import OrderedDict
+from langchain.schema import Document
+from metrics import CountCache
+from singleFlight import GetSingleFlight
+
+
+def NormalizeQuery(query):
+    # Repeated questions differ mostly in case, spacing and trailing punctuation
+    return " ".join(str(query).lower().split()).rstrip("?!. ")
+
+
+def EncodeValue(value):
+    def default(obj):
+        if isinstance(obj, Document):
+            return {"__document__": True, "page_content": obj.page_content, "metadata": obj.metadata}
+        raise TypeError(f"Cannot cache value of type {type(obj).__name__}")
+    return json.dumps(value, default=default)
+
+
+def DecodeValue(text):
+    def hook(obj):
+        if obj.get("__document__"):
+            return Document(page_content=obj["page_content"], metadata=obj["metadata"])
+        return obj
+    return json.loads(text, object_hook=hook)
+
+
+class SQLiteBackend:
+    # On-disk layer that survives restarts; values are stored as JSON, not pickle
+    def __init__(self, path, max_entries=100000):
+        self.max_entries = max_entries
+        self.lock = threading.Lock()
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        self.conn.execute(
+            "CREATE TABLE IF NOT EXISTS search_cache ("
+            "key TEXT PRIMARY KEY, value TEXT NOT NULL, "
+            "expires_at REAL NOT NULL, accessed_at REAL NOT NULL)"
+        )
+        self.conn.execute("DELETE FROM search_cache WHERE expires_at < ?", (time.time(),))
+        self.conn.commit()
+
+    def get(self, key):
+        now = time.time()
+        with self.lock:
+            row = self.conn.execute(
+                "SELECT value, expires_at FROM search_cache WHERE key = ?", (key,)
+            ).fetchone()
+            if row is None:
+                return None
+            if row[1] < now:
+                self.conn.execute("DELETE FROM search_cache WHERE key = ?", (key,))
+                self.conn.commit()
+                return None
+            self.conn.execute("UPDATE search_cache SET accessed_at = ? WHERE key = ?", (now, key))
+            self.conn.commit()
+        return row[0], row[1]
+
+    def set(self, key, value, expires_at):
+        with self.lock:
+            self.conn.execute(
+                "INSERT OR REPLACE INTO search_cache VALUES (?, ?, ?, ?)",
+                (key, value, expires_at, time.time()),
+            )
+            # Drop the least recently used rows once the table is over its bound
+            cursor = self.conn.execute(
+                "DELETE FROM search_cache WHERE key IN ("
+                "SELECT key FROM search_cache ORDER BY accessed_at DESC LIMIT -1 OFFSET ?)",
+                (self.max_entries,),
+            )
+            self.conn.commit()
+        return cursor.rowcount
+
+    def clear(self):
+        with self.lock:
+            self.conn.execute("DELETE FROM search_cache")
+            self.conn.commit()
+
+
+class SearchCache:
+    def __init__(self, max_entries=1024, ttl=3600, path=None):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+        self.disk = SQLiteBackend(path) if path else None
+        self.stats = {"hits": 0, "misses": 0, "evictions": 0, "expirations": 0}
+
+    def Key(self, source, query):
+        return f"{source}:{NormalizeQuery(query)}"
+
+    def get(self, source, query):
+        # Returns (hit, value)
+        key = self.Key(source, query)
+        now = time.time()
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is not None:
+                value, expires_at = entry
+                if expires_at >= now:
+                    self.entries.move_to_end(key)
+                    self.stats["hits"] += 1
+                    return True, value
+                del self.entries[key]
+                self.stats["expirations"] += 1
+
+        if self.disk is not None:
+            row = self.disk.get(key)
+            if row is not None:
+                value = DecodeValue(row[0])
+                with self.lock:
+                    self.Store(key, value, row[1])
+                    self.stats["hits"] += 1
+                return True, value
+
+        with self.lock:
+            self.stats["misses"] += 1
+        return False, None
+
+    def set(self, source, query, value):
+        key = self.Key(source, query)
+        expires_at = time.time() + self.ttl
+        with self.lock:
+            self.Store(key, value, expires_at)
+        if self.disk is not None:
+            evicted = self.disk.set(key, EncodeValue(value), expires_at)
+            with self.lock:
+                self.stats["evictions"] += evicted
+
+    def Store(self, key, value, expires_at):
+        # Caller holds self.lock
+        self.entries[key] = (value, expires_at)
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.max_entries:
+            self.entries.popitem(last=False)
+            self.stats["evictions"] += 1
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+        if self.disk is not None:
+            self.disk.clear()
+
+    def Stats(self):
+        with self.lock:
+            return dict(self.stats, size=len(self.entries))
+
+
+_search_cache = None
+_search_cache_lock = threading.Lock()
+
+
+def GetSearchCache():
+    # One cache per process, shared by every agent that imports this module
+    global _search_cache
+    with _search_cache_lock:
+        if _search_cache is None:
+            _search_cache = SearchCache(
+                max_entries=int(os.getenv("search_cache_size", "1024")),
+                ttl=float(os.getenv("search_cache_ttl", "3600")),
+                path=os.getenv("search_cache_path") or None,
+            )
+        return _search_cache
+
+
+def CachedSearch(source, query, search):
+    # Errors propagate and are never cached. Identical searches arriving while
+    # one is in flight wait for it instead of calling the backend again.
+    cache = GetSearchCache()
+    hit, value = cache.get(source, query)
+    CountCache("search", source, hit)
+    if hit:
+        return value
+
+    def Search():
+        value = search(query)
+        cache.set(source, query, value)
+        return value
+    return GetSingleFlight("search").Do(cache.Key(source, query), Search)
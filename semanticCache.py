@@ -0,0 +1,130 @@
+#######################################################
+# Semantic response cache in front of the LLM calls
+#######################################################
+
+import os
+import re
+import time
+import threading
+from collections import OrderedDict
+import numpy as np
+from metrics import CountCache
+from searchCache import NormalizeQuery
+from singleFlight import GetSingleFlight
+
+
+def ReplayTokens(text, delay=0.0):
+    # Re-emit a cached completion as a token stream so the UI renders it the
+    # same way as a live generation
+    for token in re.findall(r"\s*\S+", text):
+        yield token
+        if delay:
+            time.sleep(delay)
+
+
+class SemanticCache:
+    # Prompt embeddings are kept in a small in-process vector index per
+    # namespace; a lookup returns the completion of the most similar stored
+    # prompt if its cosine similarity clears the threshold
+    def __init__(self, embeddings, threshold=0.92, max_entries=512):
+        self.embeddings = embeddings
+        self.threshold = threshold
+        self.max_entries = max_entries
+        self.namespaces = {}
+        self.lock = threading.Lock()
+        self.stats = {"hits": 0, "misses": 0, "evictions": 0}
+
+    def Embed(self, text):
+        vector = np.asarray(self.embeddings.embed_query(text), dtype=np.float32)
+        norm = np.linalg.norm(vector)
+        return vector / norm if norm else vector
+
+    def Index(self, namespace):
+        # Caller holds self.lock
+        if namespace not in self.namespaces:
+            self.namespaces[namespace] = {"entries": OrderedDict(), "matrix": None, "keys": []}
+        return self.namespaces[namespace]
+
+    def lookup(self, text, namespace="default", vector=None):
+        if vector is None:
+            vector = self.Embed(text)
+        with self.lock:
+            index = self.Index(namespace)
+            if not index["entries"]:
+                self.stats["misses"] += 1
+                return None
+            if index["matrix"] is None:
+                index["keys"] = list(index["entries"])
+                index["matrix"] = np.stack([index["entries"][k][0] for k in index["keys"]])
+            scores = index["matrix"] @ vector
+            best = int(np.argmax(scores))
+            if scores[best] < self.threshold:
+                self.stats["misses"] += 1
+                return None
+            key = index["keys"][best]
+            index["entries"].move_to_end(key)
+            self.stats["hits"] += 1
+            return index["entries"][key][1]
+
+    def update(self, text, completion, namespace="default", vector=None):
+        if vector is None:
+            vector = self.Embed(text)
+        with self.lock:
+            index = self.Index(namespace)
+            index["entries"][text] = (vector, completion)
+            index["entries"].move_to_end(text)
+            while len(index["entries"]) > self.max_entries:
+                index["entries"].popitem(last=False)
+                self.stats["evictions"] += 1
+            index["matrix"] = None
+
+    def clear(self):
+        with self.lock:
+            self.namespaces.clear()
+
+    def Stats(self):
+        with self.lock:
+            size = sum(len(index["entries"]) for index in self.namespaces.values())
+            return dict(self.stats, size=size)
+
+
+_semantic_cache = None
+_semantic_cache_lock = threading.Lock()
+
+
+def GetSemanticCache():
+    # One cache per process; survives Streamlit reruns because imported
+    # modules are not re-executed
+    global _semantic_cache
+    with _semantic_cache_lock:
+        if _semantic_cache is None:
+            from clients import GetEmbeddings
+            _semantic_cache = SemanticCache(
+                GetEmbeddings(),
+                threshold=float(os.getenv("semantic_cache_threshold", "0.92")),
+                max_entries=int(os.getenv("semantic_cache_size", "512")),
+            )
+        return _semantic_cache
+
+
+def CachedGenerate(namespace, question, generate, vector=None):
+    # Returns the cached completion for a near-duplicate question, otherwise
+    # calls generate() and stores its result. The same question arriving while
+    # it is being generated shares that call. Cache failures never block
+    # generation. vector: the question's normalized embedding, if already known.
+    cache = GetSemanticCache()
+    try:
+        vector = vector if vector is not None else cache.Embed(question)
+        cached = cache.lookup(question, namespace, vector=vector)
+    except Exception:
+        vector, cached = None, None
+    CountCache("semantic", namespace, cached is not None)
+    if cached is not None:
+        return cached
+
+    def Generate():
+        completion = generate()
+        if vector is not None:
+            cache.update(question, completion, namespace, vector=vector)
+        return completion
+    return GetSingleFlight("generate").Do(f"{namespace}:{NormalizeQuery(question)}", Generate)
@@ -0,0 +1,166 @@
+#######################################################
+# Coalescing of identical in-flight requests
+#######################################################
+
+import asyncio
+import threading
+from clients import Lazy
+from metrics import GetRegistry
+
+
+def CountShared(group):
+    GetRegistry().Inc("singleflight_shared_total", {"group": group})
+
+
+class Call:
+    def __init__(self):
+        self.done = threading.Event()
+        self.value = None
+        self.error = None
+
+
+class SingleFlight:
+    # Do(key, fn): the first caller for a key runs fn; callers arriving while
+    # it runs wait for and share its result (or its exception)
+    def __init__(self, name):
+        self.name = name
+        self.calls = {}
+        self.lock = threading.Lock()
+
+    def Do(self, key, fn):
+        with self.lock:
+            call = self.calls.get(key)
+            leader = call is None
+            if leader:
+                call = self.calls[key] = Call()
+        if not leader:
+            CountShared(self.name)
+            call.done.wait()
+            if call.error is not None:
+                raise call.error
+            return call.value
+        try:
+            call.value = fn()
+            return call.value
+        except BaseException as e:
+            call.error = e
+            raise
+        finally:
+            with self.lock:
+                del self.calls[key]
+            call.done.set()
+
+
+class AsyncSingleFlight:
+    # Event-loop variant: duplicates await one shared task, which is only
+    # cancelled once every caller awaiting it has been cancelled
+    def __init__(self, name):
+        self.name = name
+        self.calls = {}
+
+    async def Do(self, key, factory):
+        entry = self.calls.get(key)
+        if entry is None or entry["task"].get_loop() is not asyncio.get_running_loop():
+            task = asyncio.ensure_future(factory())
+            entry = self.calls[key] = {"task": task, "waiters": 0}
+            task.add_done_callback(lambda _: self.calls.get(key) is entry and self.calls.pop(key))
+        else:
+            CountShared(self.name)
+        entry["waiters"] += 1
+        try:
+            return await asyncio.shield(entry["task"])
+        finally:
+            entry["waiters"] -= 1
+            if entry["waiters"] == 0 and not entry["task"].done():
+                entry["task"].cancel()
+
+
+class SharedStream:
+    def __init__(self, lock):
+        self.changed = threading.Condition(lock)
+        self.tokens = []
+        self.done = False
+        self.cancelled = False
+        self.error = None
+        self.subscribers = 0
+
+
+class StreamGroup:
+    # Subscribe(key, factory) returns an iterator over the tokens of one shared
+    # factory() stream per key. Late subscribers first get the tokens already
+    # produced. When the last subscriber leaves before the end, the upstream
+    # stream is closed.
+    def __init__(self, name):
+        self.name = name
+        self.streams = {}
+        self.lock = threading.Lock()
+
+    def Subscribe(self, key, factory):
+        with self.lock:
+            stream = self.streams.get(key)
+            if stream is None:
+                stream = self.streams[key] = SharedStream(self.lock)
+                threading.Thread(target=self.Produce, args=(key, stream, factory), daemon=True).start()
+            else:
+                CountShared(self.name)
+            stream.subscribers += 1
+        return self.Iterate(key, stream)
+
+    def Produce(self, key, stream, factory):
+        source = None
+        try:
+            source = factory()
+            for token in source:
+                with stream.changed:
+                    if stream.cancelled:
+                        break
+                    stream.tokens.append(token)
+                    stream.changed.notify_all()
+        except Exception as e:
+            stream.error = e
+        finally:
+            if hasattr(source, "close"):
+                source.close()
+            with stream.changed:
+                stream.done = True
+                if self.streams.get(key) is stream:
+                    del self.streams[key]
+                stream.changed.notify_all()
+
+    def Iterate(self, key, stream):
+        index = 0
+        try:
+            while True:
+                with stream.changed:
+                    while index >= len(stream.tokens) and not stream.done:
+                        stream.changed.wait()
+                    batch = stream.tokens[index:]
+                    index = len(stream.tokens)
+                    finished = stream.done
+                for token in batch:
+                    yield token
+                if finished and index >= len(stream.tokens):
+                    if stream.error is not None:
+                        raise stream.error
+                    return
+        finally:
+            with stream.changed:
+                stream.subscribers -= 1
+                if stream.subscribers == 0 and not stream.done:
+                    # Nobody is listening: stop the upstream call and let the
+                    # next request for this key start a fresh one
+                    stream.cancelled = True
+                    if self.streams.get(key) is stream:
+                        del self.streams[key]
+
+
+def GetSingleFlight(name):
+    return Lazy(f"singleflight:{name}", lambda: SingleFlight(name))
+
+
+def GetAsyncSingleFlight(name):
+    return Lazy(f"async_singleflight:{name}", lambda: AsyncSingleFlight(name))
+
+
+def GetStreamGroup(name):
+    return Lazy(f"stream_group:{name}", lambda: StreamGroup(name))
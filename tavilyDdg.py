@@ -3,48 +3,63 @@
 #######################################################
 
 import os
-from langchain_community.retrievers import TavilySearchAPIRetriever
-from langchain.tools import DuckDuckGoSearchRun
 from langchain.agents import Tool, initialize_agent
-from langchain.llms import HuggingFaceEndpoint
 from dotenv import load_dotenv
+from searchCache import CachedSearch
+from semanticCache import CachedGenerate
+from metrics import MetricsCallbackHandler
+from fanOut import AgentMode, FanOutAnswer, StreamPrinter
+from resilience import Resilient, Race, GetBackend
+from modelRouter import Route, LargeModel
+from clients import Lazy, GetLLM, GetTavilyRetriever, GetDuckDuckGoSearch
 
 # Load environment variables
 load_dotenv()
 
-# Initialize TavilySearchAPIRetriever
-tavily_retriever = TavilySearchAPIRetriever(
-    api_key=os.getenv("TAVILY_API_KEY"),
-    k=3,
-)
-
-# Initialize DuckDuckGo search
-search = DuckDuckGoSearchRun()
-
-# Initialize HuggingFace LLM
-api_key = os.getenv("huggingfacehub_api_token")
-if not api_key:
-    raise ValueError("huggingfacehub_api_token not found in environment variables")
-
-llm = HuggingFaceEndpoint(
-    huggingfacehub_api_token=api_key,
-    repo_id="mistralai/Mixtral-8x7B-Instruct-v0.1",
+# The Tavily retriever, DuckDuckGo search and HuggingFace LLM come from the
+# shared client registry and are only created on first use
+LLM_SETTINGS = dict(
     temperature=0.8,
     max_new_tokens=512,
     streaming=True,
 )
 
+def TavilyText(query):
+    results = GetTavilyRetriever(k=3).invoke(query)
+    return ' '.join(doc.page_content for doc in results) if results else ""
+
+def SharedDuckDuckGoText(query):
+    # Same cache entry and in-flight call as the DuckDuckGoSearch tool
+    return CachedSearch("duckduckgo", query, GetDuckDuckGoSearch().run)
+
+def RaceTavily(query):
+    # Tavily first; if it has not answered by its usual p95 (or fails, or its
+    # circuit is open) DuckDuckGo is raced against it and the first non-empty
+    # answer wins. In fan-out mode DuckDuckGo is already a tool of the same
+    # round, so Tavily only hedges with itself; set tavily_race_ddg=0 to do
+    # that in ReAct mode too.
+    tavily = GetBackend("tavily")
+    if AgentMode() != "react" or os.getenv("tavily_race_ddg", "1").lower() in ("0", "false", "no"):
+        return tavily.Call(TavilyText, query, good=bool)
+    attempts = [
+        (tavily, 0.0, TavilyText, (query,)),
+        (GetBackend("ddg"), tavily.HedgeDelay(), SharedDuckDuckGoText, (query,)),
+    ]
+    return Race(attempts, tavily.timeout, good=bool)
+
 # Define Tavily retriever function
 def TavilySearch(query):
     try:
-        results = tavily_retriever.invoke(query)
-        if isinstance(results, list) and results:
-            content_list = [doc.page_content for doc in results]
-            return ' '.join(content_list)
-        return "No relevant information found."
+        return CachedSearch("tavily_text", query, RaceTavily) or "No relevant information found."
     except Exception as e:
         return f"An error occurred during Tavily AI search: {str(e)}"
 
+def DuckDuckGoSearch(query):
+    try:
+        return CachedSearch("duckduckgo", query, lambda q: Resilient("ddg", GetDuckDuckGoSearch().run, q))
+    except Exception:
+        return "No good DuckDuckGo Search Result was found"
+
 # Define tools
 tools = [
     Tool(
@@ -54,19 +69,41 @@ tools = [
     ),
     Tool(
         name='DuckDuckGoSearch',
-        func=search.run,
+        func=DuckDuckGoSearch,
         description="Useful for searching the internet for information not found in other tools"
     )
 ]
 
+# The model (small or large) is picked per request by modelRouter.py
+def AgentLLM(model):
+    return GetLLM(repo_id=model, **LLM_SETTINGS)
+
 # Initialize agent
-agent = initialize_agent(
-    agent="zero-shot-react-description",
-    tools=tools,
-    llm=llm,
-    verbose=True,
-    max_iterations=3,
-)
+def GetAgent(model=None):
+    model = model or LargeModel()
+    return Lazy(f"agent:tavilyDdg:{model}", lambda: initialize_agent(
+        agent="zero-shot-react-description",
+        tools=tools,
+        llm=AgentLLM(model),
+        verbose=True,
+        max_iterations=3,
+    ))
+
+def RunAgent(question, model=None):
+    # ReAct loop; agent runs report per-step timings to the metrics registry
+    model = model or Route("tavilyDdg", question)[0]
+    return GetAgent(model).run(question, callbacks=[MetricsCallbackHandler("tavilyDdg")])
+
+def Ask(question, on_token=None):
+    # Near-duplicate questions are answered from the semantic cache. In fan-out
+    # mode (agent_mode=fanout, opt-in) both tools run in parallel and one
+    # streamed LLM call answers; the ReAct agent only runs if that answer is weak.
+    if AgentMode() == "react":
+        return CachedGenerate("tavilyDdg", question, lambda: RunAgent(question))
+    return CachedGenerate("tavilyDdg", question, lambda: FanOutAnswer(
+        question, tools, AgentLLM, "tavilyDdg",
+        fallback=lambda: RunAgent(question, LargeModel()), on_token=on_token,
+    ))
 
 def main():
     print("Welcome to the AI Assistant!")
@@ -80,8 +117,9 @@ def main():
             break
 
         try:
-            answer = agent.run(question)
-            print(f"\nAnswer: {answer}")
+            print("\nAnswer: ", end="", flush=True)
+            printer = StreamPrinter()
+            printer.finish(Ask(question, on_token=printer))
         except Exception as e:
             print(f"An error occurred: {e}")
 
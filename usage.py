@@ -1,4 +1,5 @@
 from imageProcessing import ProcessQuery
+from clients import ReportTimings
 
 def getImages(state):
     query = state["imageQuery"]
@@ -21,4 +22,5 @@ def getImages(state):
 state = {
     "imageQuery": "What is the map of the Roman Empire"
 }
-getImages(state)
\ No newline at end of file
+getImages(state)
+print(ReportTimings())
\ No newline at end of file
@@ -1,40 +1,98 @@
-from langchain.llms import HuggingFaceEndpoint
 from langchain.text_splitter import RecursiveCharacterTextSplitter
-from langchain_community.embeddings import HuggingFaceInferenceAPIEmbeddings
 from langchain_community.vectorstores import FAISS
 from langchain_core.vectorstores import VectorStoreRetriever
 from langchain.chains import RetrievalQA
 import os
 from dotenv import load_dotenv
 import langchain_community.document_loaders as doc_loaders
+from semanticCache import CachedGenerate
+from ingest import IncrementalIngest, IterFiles, IterChunks
+from indexFactory import BuildLargeIndex, LoadLargeIndex, SourceManifest, IsCurrent
+from clients import GetLLM, GetEmbeddings
+from hybridRetriever import HybridRetriever, CrossEncoderReranker
+from metrics import MetricsCallbackHandler
+from modelRouter import Route
+from batchQA import GetBatchQA
+import json
+
+load_dotenv()
+
+# A directory switches to incremental ingestion: only new or changed chunks are
+# embedded and added to the persisted index. A single file rebuilds it.
+DATA_PATH = "/path to your txtual data"
+INDEX_PATH = "fiass_index_metallica"
+
+# Set index_kind to ivf_flat, ivf_pq, hnsw or flat to serve a memory-mapped FAISS
+# index with a SQLite docstore (indexFactory.py) instead of the pickled one. It is
+# not updated incrementally: when any source file is added, removed or modified,
+# the whole index is rebuilt on the next start.
+INDEX_KIND = os.getenv("index_kind")
+LARGE_INDEX_PATH = f"{INDEX_PATH}_{INDEX_KIND}"
 
-loader = doc_loaders.TextLoader("/path to your txtual data")  
-documents = loader.load()
 text_splitter = RecursiveCharacterTextSplitter(
 chunk_size=500,
 chunk_overlap=0,
 length_function=len,
 )
-docs = text_splitter.split_documents (documents)
-load_dotenv()
-embeddings = HuggingFaceInferenceAPIEmbeddings(
-    api_key=os.getenv("embedding_api_key"),
-    model_name="sentence-transformers/all-MiniLM-l6-v2",
-)
-library = FAISS.from_documents(docs, embeddings)
-retriever = library.as_retriever()
-api_key = os.getenv("huggingfacehub_api_token")
-llm = HuggingFaceEndpoint(
-    huggingfacehub_api_token=api_key,
-    repo_id="mistralai/Mistral-7B-Instruct-v0.3",
+# Batched, retrying embedding client with an on-disk cache and a local CPU fallback
+embeddings = GetEmbeddings()
+if INDEX_KIND:
+    paths = list(IterFiles(DATA_PATH)) if os.path.isdir(DATA_PATH) else [DATA_PATH]
+    sources = SourceManifest(paths)
+    if not IsCurrent(LARGE_INDEX_PATH, sources):
+        chunks = (chunk for path in paths for _, chunk in IterChunks(path, text_splitter))
+        BuildLargeIndex(chunks, embeddings, LARGE_INDEX_PATH, kind=INDEX_KIND, sources=sources)
+elif os.path.isdir(DATA_PATH):
+    library, ingest_stats = IncrementalIngest(DATA_PATH, INDEX_PATH, embeddings, text_splitter)
+    print(ingest_stats)
+else:
+    loader = doc_loaders.TextLoader(DATA_PATH)
+    documents = loader.load()
+    docs = text_splitter.split_documents (documents)
+    library = FAISS.from_documents(docs, embeddings)
+    library.save_local(INDEX_PATH)
+question = "Question about your text which you made a vector store from."
+# Small model unless the question looks hard (modelRouter.py)
+llm = GetLLM(
+    repo_id=Route("vectorStore", question, sources=int(os.getenv("retriever_k", "3")))[0],
     temperature=0.7,
     max_new_tokens=1024,
 )
-library.save_local("fiass_index_metallica")
 
-metallica_saved = FAISS.load_local("fiass_index_metallica", embeddings, allow_dangerous_deserialization=True)
-qa = RetrievalQA.from_chain_type(llm=llm, chain_type="stuff", retriever=metallica_saved.as_retriever())
+if INDEX_KIND:
+    metallica_saved = LoadLargeIndex(
+        LARGE_INDEX_PATH,
+        embeddings,
+        nprobe=int(os.getenv("index_nprobe", "16")),
+        ef_search=int(os.getenv("index_ef_search", "64")),
+    )
+else:
+    metallica_saved = FAISS.load_local(INDEX_PATH, embeddings, allow_dangerous_deserialization=True)
+# BM25 + vector search fused with reciprocal rank fusion; set hybrid_rerank=1 to
+# add a local cross-encoder pass within a latency budget
+reranker = None
+if os.getenv("hybrid_rerank", "").lower() in ("1", "true", "yes"):
+    reranker = CrossEncoderReranker(
+        top_k=int(os.getenv("rerank_top_k", "3")),
+        budget=float(os.getenv("rerank_budget", "0.5")),
+    )
+retriever = HybridRetriever.FromFaiss(metallica_saved, k=int(os.getenv("retriever_k", "3")), reranker=reranker)
+qa = RetrievalQA.from_chain_type(llm=llm, chain_type="stuff", retriever=retriever)
 
-question = "Question about your text which you made a vector store from."
-res = qa.invoke(question)
-print(res)
+# Batch mode: set qa_questions_file to a file with one question per line; one
+# JSON result per line (answer, sources, timings) goes to stdout, in input order
+# unless qa_ordered=0
+QUESTIONS_FILE = os.getenv("qa_questions_file")
+if QUESTIONS_FILE:
+    batch_qa = GetBatchQA(
+        retriever,
+        lambda model: GetLLM(repo_id=model, temperature=0.7, max_new_tokens=1024),
+        namespace=f"vectorStore:{INDEX_PATH}",
+    )
+    with open(QUESTIONS_FILE, "r", encoding="utf-8") as f:
+        questions = (line.strip() for line in f if line.strip())
+        for result in batch_qa.Run(questions, ordered=os.getenv("qa_ordered", "1").lower() not in ("0", "false", "no")):
+            print(json.dumps(result, default=str), flush=True)
+else:
+    res = CachedGenerate(f"vectorStore:{INDEX_PATH}", question, lambda: qa.invoke(question, config={"callbacks": [MetricsCallbackHandler("vectorStore")]}))
+    print(res)
@@ -1,55 +1,86 @@
 #######################################################
 # Agent = Wikipedia + DuckDuckGo
 #######################################################
-import os
-from langchain.utilities import WikipediaAPIWrapper
-from langchain.tools import DuckDuckGoSearchRun
-from langchain.llms import HuggingFaceEndpoint
 from langchain.agents import Tool, initialize_agent
 from dotenv import load_dotenv
+from searchCache import CachedSearch
+from semanticCache import CachedGenerate
+from metrics import MetricsCallbackHandler
+from fanOut import AgentMode, FanOutAnswer, StreamPrinter
+from resilience import Resilient
+from modelRouter import Route, LargeModel
+from clients import Lazy, GetLLM, GetWikipediaWrapper, GetDuckDuckGoSearch
 
 # Load environment variables
 load_dotenv()
 
-# Initialize API wrappers
-wikipedia = WikipediaAPIWrapper()
-search = DuckDuckGoSearchRun()
-
-# Initialize HuggingFace LLM
-api_key = os.getenv("HUGGINGFACEHUB_API_TOKEN")
-if not api_key:
-    raise ValueError("HUGGINGFACEHUB_API_TOKEN not found in environment variables")
-
-llm = HuggingFaceEndpoint(
-    huggingfacehub_api_token=api_key,
-    repo_id="mistralai/Mixtral-8x7B-Instruct-v0.1",
+# API wrappers and the HuggingFace LLM come from the shared client registry
+# and are only created on first use
+LLM_SETTINGS = dict(
     temperature=0.8,
     max_new_tokens=512,
     streaming=True,
 )
 
+# Search results are shared with the other agents through the result cache.
+# Each backend has a timeout, hedging and a circuit breaker; a failed search
+# reads as "no result" instead of stopping the agent.
+def WikipediaSearch(query):
+    try:
+        return CachedSearch("wikipedia", query, lambda q: Resilient("wiki", GetWikipediaWrapper().run, q))
+    except Exception:
+        return "No good Wikipedia Search Result was found"
+
+def DuckDuckGoSearch(query):
+    try:
+        return CachedSearch("duckduckgo", query, lambda q: Resilient("ddg", GetDuckDuckGoSearch().run, q))
+    except Exception:
+        return "No good DuckDuckGo Search Result was found"
+
 # Define tools
 tools = [
     Tool(
         name='Wikipedia',
-        func=wikipedia.run,
+        func=WikipediaSearch,
         description="Useful for looking up information about a topic, country, or person on Wikipedia"
     ),
     Tool(
         name='DuckDuckGo Search',
-        func=search.run,
+        func=DuckDuckGoSearch,
         description="Useful for searching the internet for information not found in other tools"
     )
 ]
 
+# The model (small or large) is picked per request by modelRouter.py
+def AgentLLM(model):
+    return GetLLM(api_key_env="HUGGINGFACEHUB_API_TOKEN", repo_id=model, **LLM_SETTINGS)
+
 # Initialize agent
-agent = initialize_agent(
-    agent="zero-shot-react-description",
-    tools=tools,
-    llm=llm,
-    verbose=True,
-    max_iterations=3,
-)
+def GetAgent(model=None):
+    model = model or LargeModel()
+    return Lazy(f"agent:wikiDdgAgent:{model}", lambda: initialize_agent(
+        agent="zero-shot-react-description",
+        tools=tools,
+        llm=AgentLLM(model),
+        verbose=True,
+        max_iterations=3,
+    ))
+
+def RunAgent(question, model=None):
+    # ReAct loop; agent runs report per-step timings to the metrics registry
+    model = model or Route("wikiDdgAgent", question)[0]
+    return GetAgent(model).run(question, callbacks=[MetricsCallbackHandler("wikiDdgAgent")])
+
+def Ask(question, on_token=None):
+    # Near-duplicate questions are answered from the semantic cache. In fan-out
+    # mode (agent_mode=fanout, opt-in) both tools run in parallel and one
+    # streamed LLM call answers; the ReAct agent only runs if that answer is weak.
+    if AgentMode() == "react":
+        return CachedGenerate("wikiDdgAgent", question, lambda: RunAgent(question))
+    return CachedGenerate("wikiDdgAgent", question, lambda: FanOutAnswer(
+        question, tools, AgentLLM, "wikiDdgAgent",
+        fallback=lambda: RunAgent(question, LargeModel()), on_token=on_token,
+    ))
 
 def main():
     print("Welcome to the AI Assistant!")
@@ -63,8 +94,9 @@ def main():
             break
 
         try:
-            answer = agent.run(question)
-            print(f"\nAnswer: {answer}")
+            print("\nAnswer: ", end="", flush=True)
+            printer = StreamPrinter()
+            printer.finish(Ask(question, on_token=printer))
         except Exception as e:
             print(f"An error occurred: {e}")
 